@@ -60,6 +60,7 @@ BACKEND_DIR="$PROJECT_DIR/funil-backend"
 FRONTEND_DIR="$PROJECT_DIR/funil-frontend"
 NGINX_SITE="/etc/nginx/sites-available/$PROJECT_NAME"
 SYSTEMD_SERVICE="/etc/systemd/system/funil-backend.service"
+SNAPSHOT_SERVICE="/etc/systemd/system/funil-snapshots.service"
 
 # Verificar argumentos
 DOMAIN=""
@@ -203,6 +204,8 @@ SECRET_KEY=$(openssl rand -hex 32)
 JWT_SECRET_KEY=$(openssl rand -hex 32)
 FLASK_ENV=production
 CORS_ORIGINS=https://$DOMAIN,https://www.$DOMAIN
+ANALYTICS_SNAPSHOTS_ENABLED=true
+LIVE_EVENTS_BACKEND=postgres
 EOF
 
 log "✅ Arquivo .env criado"
@@ -279,13 +282,33 @@ Restart=always
 WantedBy=multi-user.target
 EOF
 
+# Worker que pré-calcula os snapshots do dashboard
+sudo tee $SNAPSHOT_SERVICE > /dev/null << EOF
+[Unit]
+Description=Funil Digital Snapshots de Analytics
+After=network.target postgresql.service
+
+[Service]
+User=www-data
+Group=www-data
+WorkingDirectory=$BACKEND_DIR
+Environment="PATH=$BACKEND_DIR/venv/bin"
+ExecStart=$BACKEND_DIR/venv/bin/flask --app app snapshots run
+Restart=always
+
+[Install]
+WantedBy=multi-user.target
+EOF
+
 # Ajustar permissões
 sudo chown -R www-data:www-data $PROJECT_DIR
 
-# Ativar e iniciar serviço
+# Ativar e iniciar serviços
 sudo systemctl daemon-reload
 sudo systemctl start funil-backend
 sudo systemctl enable funil-backend
+sudo systemctl start funil-snapshots
+sudo systemctl enable funil-snapshots
 
 log "✅ Gunicorn configurado"
 
@@ -424,6 +447,13 @@ else
     error "❌ Backend não está rodando"
 fi
 
+# Verificar worker de snapshots
+if sudo systemctl is-active --quiet funil-snapshots; then
+    log "✅ Worker de snapshots está rodando"
+else
+    error "❌ Worker de snapshots não está rodando"
+fi
+
 # Verificar Nginx
 if sudo systemctl is-active --quiet nginx; then
     log "✅ Nginx está rodando"
@@ -469,6 +499,7 @@ echo -e "🎨 Frontend: $FRONTEND_DIR"
 echo ""
 echo -e "${BLUE}🔧 Serviços:${NC}"
 echo -e "🦄 Backend: sudo systemctl status funil-backend"
+echo -e "📸 Snapshots: sudo systemctl status funil-snapshots"
 echo -e "🌐 Nginx: sudo systemctl status nginx"
 echo -e "🗄️ PostgreSQL: sudo systemctl status postgresql"
 echo ""
@@ -514,11 +545,13 @@ Diretórios:
 
 Serviços:
 - Backend: sudo systemctl status funil-backend
+- Snapshots: sudo systemctl status funil-snapshots
 - Nginx: sudo systemctl status nginx
 - PostgreSQL: sudo systemctl status postgresql
 
 Logs:
 - Backend: sudo journalctl -u funil-backend -f
+- Snapshots: sudo journalctl -u funil-snapshots -f
 - Nginx Access: sudo tail -f /var/log/nginx/${PROJECT_NAME}_access.log
 - Nginx Error: sudo tail -f /var/log/nginx/${PROJECT_NAME}_error.log
 
@@ -0,0 +1,18 @@
+# Configuração do Gunicorn (carregada automaticamente a partir deste diretório)
+import os
+
+# Workers com threads: cada cliente do stream ao vivo (SSE) ocupa uma thread enquanto
+# está conectado, então workers síncronos ficariam presos a um único dashboard
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 32))
+
+def worker_exit(server, worker):
+    """Grava eventos, atividades e presença pendentes antes do worker encerrar"""
+    from src.services.event_buffer import event_buffer
+    from src.services.presence import presence
+    from src.services.activity_coalescer import activity_coalescer
+    from src.services.live_events import live_events
+    event_buffer.shutdown()
+    activity_coalescer.shutdown()
+    presence.shutdown()
+    live_events.shutdown()
@@ -0,0 +1,49 @@
+"""Add analytics and lookup indexes
+
+Revision ID: 3f9c2a7d41b8
+Revises: 005aec75c211
+Create Date: 2026-10-18 09:12:44.215306
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9c2a7d41b8'
+down_revision = '005aec75c211'
+branch_labels = None
+depends_on = None
+
+
+# (nome, tabela, colunas, único)
+INDEXES = [
+    ('ix_visitor_events_step_type_created', 'visitor_events', ['step_id', 'event_type', 'created_at'], False),
+    ('ix_visitor_events_visitor_created', 'visitor_events', ['visitor_id', 'created_at'], False),
+    ('ix_visitors_online_activity_funnel', 'visitors', ['is_online', 'last_activity', 'funnel_id'], False),
+    ('ix_payments_status_funnel_created', 'payments', ['status', 'funnel_id', 'created_at'], False),
+    ('uq_payments_external_id', 'payments', ['external_id'], True),
+]
+
+
+def upgrade():
+    duplicates = op.get_bind().execute(sa.text(
+        'SELECT external_id FROM payments WHERE external_id IS NOT NULL '
+        'GROUP BY external_id HAVING COUNT(*) > 1'
+    )).fetchall()
+    if duplicates:
+        raise RuntimeError(
+            'payments.external_id has duplicated values (%s); resolve them before creating the unique index'
+            % ', '.join(row[0] for row in duplicates[:10])
+        )
+
+    # CREATE INDEX CONCURRENTLY não pode rodar dentro de uma transação no PostgreSQL
+    with op.get_context().autocommit_block():
+        for name, table, columns, unique in INDEXES:
+            op.create_index(name, table, columns, unique=unique, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, columns, unique in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
@@ -0,0 +1,58 @@
+"""Add funnel_id to visitor_events
+
+Revision ID: 8b1e6d0c5a92
+Revises: 3f9c2a7d41b8
+Create Date: 2026-10-18 10:03:27.581940
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b1e6d0c5a92'
+down_revision = '3f9c2a7d41b8'
+branch_labels = None
+depends_on = None
+
+
+BACKFILL_BATCH_SIZE = 10000
+
+INDEXES = [
+    ('ix_visitor_events_funnel_created', ['funnel_id', 'created_at']),
+    ('ix_visitor_events_funnel_type_created', ['funnel_id', 'event_type', 'created_at']),
+]
+
+
+def upgrade():
+    with op.batch_alter_table('visitor_events', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('funnel_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_visitor_events_funnel_id', 'funnels', ['funnel_id'], ['id'])
+
+    backfill = sa.text(
+        'UPDATE visitor_events SET funnel_id = COALESCE('
+        '(SELECT funnel_steps.funnel_id FROM funnel_steps WHERE funnel_steps.id = visitor_events.step_id), '
+        '(SELECT visitors.funnel_id FROM visitors WHERE visitors.id = visitor_events.visitor_id)'
+        ') WHERE id > :start AND id <= :end AND funnel_id IS NULL'
+    )
+
+    # Cada lote (faixa de id) é confirmado separadamente para não travar a tabela inteira;
+    # eventos sem etapa herdam o funil do visitante
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        max_id = bind.execute(sa.text('SELECT MAX(id) FROM visitor_events')).scalar() or 0
+        for start in range(0, max_id, BACKFILL_BATCH_SIZE):
+            bind.execute(backfill, {'start': start, 'end': start + BACKFILL_BATCH_SIZE})
+
+        for name, columns in INDEXES:
+            op.create_index(name, 'visitor_events', columns, unique=False, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, columns in reversed(INDEXES):
+            op.drop_index(name, table_name='visitor_events', postgresql_concurrently=True)
+
+    with op.batch_alter_table('visitor_events', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_visitor_events_funnel_id', type_='foreignkey')
+        batch_op.drop_column('funnel_id')
@@ -0,0 +1,46 @@
+"""Add visitor updated_at
+
+Revision ID: 9e39a9362441
+Revises: f52579ee6f20
+Create Date: 2026-10-18 13:58:35.903055
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e39a9362441'
+down_revision = 'f52579ee6f20'
+branch_labels = None
+depends_on = None
+
+
+BACKFILL_BATCH_SIZE = 10000
+
+
+def upgrade():
+    with op.batch_alter_table('visitors', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+
+    backfill = sa.text(
+        'UPDATE visitors SET updated_at = last_activity '
+        'WHERE id > :start AND id <= :end AND updated_at IS NULL'
+    )
+
+    # Cada lote (faixa de id) é confirmado separadamente para não travar a tabela inteira
+    with op.get_context().autocommit_block():
+        bind = op.get_bind()
+        max_id = bind.execute(sa.text('SELECT MAX(id) FROM visitors')).scalar() or 0
+        for start in range(0, max_id, BACKFILL_BATCH_SIZE):
+            bind.execute(backfill, {'start': start, 'end': start + BACKFILL_BATCH_SIZE})
+
+        op.create_index('ix_visitors_updated_at', 'visitors', ['updated_at'], unique=False, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_visitors_updated_at', table_name='visitors', postgresql_concurrently=True)
+
+    with op.batch_alter_table('visitors', schema=None) as batch_op:
+        batch_op.drop_column('updated_at')
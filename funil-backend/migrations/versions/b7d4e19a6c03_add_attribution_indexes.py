@@ -0,0 +1,36 @@
+"""Add attribution indexes
+
+Revision ID: b7d4e19a6c03
+Revises: 06cbe12eabc8
+Create Date: 2026-10-18 13:41:07.318254
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d4e19a6c03'
+down_revision = '06cbe12eabc8'
+branch_labels = None
+depends_on = None
+
+
+# (nome, tabela, colunas)
+INDEXES = [
+    ('ix_visitors_funnel_first_visit', 'visitors', ['funnel_id', 'first_visit']),
+    ('ix_payments_visitor_status', 'payments', ['visitor_id', 'status']),
+]
+
+
+def upgrade():
+    # CREATE INDEX CONCURRENTLY não pode rodar dentro de uma transação no PostgreSQL
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, unique=False, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, columns in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
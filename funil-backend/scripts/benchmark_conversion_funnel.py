@@ -0,0 +1,309 @@
+"""Benchmark do funil de conversão (VisitorEvent.get_conversion_funnel)
+
+Popula um banco separado com N eventos sintéticos e compara a implementação
+antiga (duas consultas COUNT por etapa) com a atual (uma única consulta),
+medindo o número de consultas e a latência de cada uma e conferindo que as
+duas devolvem o mesmo resultado.
+
+O banco não recebe buckets horários, então a medição é do caminho que lê
+visitor_events diretamente.
+
+Uso (a partir de funil-backend/):
+
+    python scripts/benchmark_conversion_funnel.py --events 10000000
+    python scripts/benchmark_conversion_funnel.py --database-url postgresql://... --events 10000000
+
+O banco é reaproveitado entre execuções com o mesmo --events; use --reseed
+para recriá-lo.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import event
+from sqlalchemy.exc import SQLAlchemyError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BENCHMARK_SLUG = 'benchmark-funnel'
+NOISE_SLUG = 'benchmark-noise'
+
+# Eventos por visitante sintético
+EVENTS_PER_VISITOR = 1000
+
+# Linhas por lote de INSERT na carga
+SEED_CHUNK_SIZE = 50000
+
+# Tipos de evento e pesos relativos na carga
+EVENT_TYPE_WEIGHTS = {
+    'page_view': 80,
+    'payment_init': 5,
+    'form_submit': 12,
+    'payment_complete': 3,
+}
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', default='sqlite:///' + os.path.join(tempfile.gettempdir(), 'funil_benchmark.db'),
+                        help='Banco usado no benchmark (padrão: SQLite no diretório temporário)')
+    parser.add_argument('--events', type=int, default=10_000_000, help='Eventos do funil medido (padrão: 10M)')
+    parser.add_argument('--steps', type=int, default=15, help='Etapas ativas do funil medido')
+    parser.add_argument('--days', type=int, default=30, help='Dias de histórico gerados')
+    parser.add_argument('--range-days', type=int, default=20, help='Dias consultados (os mais recentes)')
+    parser.add_argument('--repeat', type=int, default=5, help='Execuções medidas por implementação')
+    parser.add_argument('--seed', type=int, default=42, help='Semente do gerador de eventos')
+    parser.add_argument('--reseed', action='store_true', help='Recria o banco antes de medir')
+    return parser.parse_args()
+
+def create_app(database_url):
+    """Carrega a aplicação apontando para o banco do benchmark, sem threads de fundo"""
+    os.environ['DATABASE_URL'] = database_url
+    for flag in ('EVENT_BUFFER_ENABLED', 'PRESENCE_ENABLED', 'ACTIVITY_COALESCE_ENABLED',
+                 'ANALYTICS_CACHE_ENABLED', 'ANALYTICS_SNAPSHOTS_ENABLED', 'LIVE_EVENTS_ENABLED',
+                 'PIXEL_CACHE_ENABLED'):
+        os.environ[flag] = 'false'
+    
+    from src.main import app
+    return app
+
+def legacy_conversion_funnel(funnel_id, start_date=None, end_date=None):
+    """Implementação anterior: duas consultas COUNT por etapa"""
+    from src.models.funnel_step import FunnelStep
+    from src.models.visitor_event import VisitorEvent
+    
+    steps = FunnelStep.query.filter_by(
+        funnel_id=funnel_id,
+        is_active=True
+    ).order_by(FunnelStep.order_index).all()
+    
+    conversion_data = []
+    
+    for step in steps:
+        query = VisitorEvent.query.filter_by(
+            event_type='page_view',
+            step_id=step.id
+        )
+        
+        if start_date:
+            query = query.filter(VisitorEvent.created_at >= start_date)
+        
+        if end_date:
+            query = query.filter(VisitorEvent.created_at <= end_date)
+        
+        page_views = query.count()
+        
+        conversion_query = VisitorEvent.query.filter(
+            VisitorEvent.step_id == step.id,
+            VisitorEvent.event_type.in_(['form_submit', 'payment_complete'])
+        )
+        
+        if start_date:
+            conversion_query = conversion_query.filter(VisitorEvent.created_at >= start_date)
+        
+        if end_date:
+            conversion_query = conversion_query.filter(VisitorEvent.created_at <= end_date)
+        
+        conversions = conversion_query.count()
+        
+        conversion_rate = (conversions / page_views * 100) if page_views > 0 else 0
+        
+        conversion_data.append({
+            'step_id': step.id,
+            'step_name': step.name,
+            'step_type': step.step_type,
+            'order_index': step.order_index,
+            'page_views': page_views,
+            'conversions': conversions,
+            'conversion_rate': round(conversion_rate, 2)
+        })
+    
+    return conversion_data
+
+def _create_funnel(db, slug, steps):
+    """Cria o funil com as etapas ativas e uma inativa; devolve o funil e os ids das ativas"""
+    from src.models.funnel import Funnel
+    from src.models.funnel_step import FunnelStep
+    
+    funnel = Funnel(name=slug, slug=slug)
+    db.session.add(funnel)
+    db.session.flush()
+    
+    for index in range(steps):
+        db.session.add(FunnelStep(
+            funnel_id=funnel.id,
+            name=f'Etapa {index + 1}',
+            slug=f'etapa-{index + 1}',
+            step_type='capture',
+            order_index=index
+        ))
+    
+    # Uma etapa inativa, que não deve aparecer no resultado
+    db.session.add(FunnelStep(funnel_id=funnel.id, name='Inativa', slug='inativa',
+                              step_type='capture', order_index=steps, is_active=False))
+    db.session.flush()
+    
+    step_ids = db.session.execute(
+        db.select(FunnelStep.id).where(FunnelStep.funnel_id == funnel.id, FunnelStep.is_active == True)
+        .order_by(FunnelStep.order_index)
+    ).scalars().all()
+    return funnel, step_ids
+
+def seed(db, args, now):
+    """Gera os eventos sintéticos; a cada cinco eventos do funil medido, um evento extra vai para um segundo funil (ruído)"""
+    from src.models.visitor import Visitor
+    from src.models.visitor_event import VisitorEvent
+    
+    db.drop_all()
+    db.create_all()
+    
+    funnel, step_ids = _create_funnel(db, BENCHMARK_SLUG, args.steps)
+    noise, noise_step_ids = _create_funnel(db, NOISE_SLUG, 5)
+    
+    visitors = max(1, args.events // EVENTS_PER_VISITOR)
+    db.session.execute(db.insert(Visitor.__table__), [
+        {'session_id': f'benchmark-{index}', 'funnel_id': funnel.id, 'first_visit': now, 'last_activity': now}
+        for index in range(visitors)
+    ])
+    first_visitor = db.session.execute(db.select(db.func.min(Visitor.id))).scalar()
+    db.session.commit()
+    
+    rng = random.Random(args.seed)
+    event_types = list(EVENT_TYPE_WEIGHTS)
+    type_weights = list(EVENT_TYPE_WEIGHTS.values())
+    # Cada etapa recebe 80% do tráfego da anterior
+    step_weights = [0.8 ** index for index in range(len(step_ids))]
+    start = now - timedelta(days=args.days)
+    span = (now - start).total_seconds()
+    table = VisitorEvent.__table__
+    
+    with db.engine.begin() as connection:
+        if db.engine.dialect.name == 'sqlite':
+            connection.exec_driver_sql('PRAGMA synchronous = OFF')
+        
+        for offset in range(0, args.events, SEED_CHUNK_SIZE):
+            size = min(SEED_CHUNK_SIZE, args.events - offset)
+            types = rng.choices(event_types, type_weights, k=size)
+            steps = rng.choices(range(len(step_ids)), step_weights, k=size)
+            rows = []
+            
+            for index in range(size):
+                position = offset + index
+                row = {
+                    'visitor_id': first_visitor + position % visitors,
+                    'funnel_id': funnel.id,
+                    'step_id': step_ids[steps[index]],
+                    'event_type': types[index],
+                    'created_at': start + timedelta(seconds=span * position / args.events),
+                }
+                rows.append(row)
+                
+                if position % 5 == 4:
+                    rows.append(dict(row, funnel_id=noise.id, step_id=noise_step_ids[steps[index] % len(noise_step_ids)]))
+            
+            connection.execute(table.insert(), rows)
+            print(f'\r  {offset + size:,}/{args.events:,} eventos', end='', flush=True)
+    
+    print()
+    with db.engine.begin() as connection:
+        connection.exec_driver_sql('ANALYZE')
+    
+    return funnel
+
+def measure(db, function, funnel_id, start_date, end_date, repeat):
+    """Executa a função uma vez para aquecer e contar consultas, depois mede as latências"""
+    statements = []
+    
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    
+    event.listen(db.engine, 'before_cursor_execute', count_statement)
+    try:
+        result = function(funnel_id, start_date, end_date)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', count_statement)
+        db.session.remove()
+    
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function(funnel_id, start_date, end_date)
+        timings.append((time.perf_counter() - started) * 1000)
+        db.session.remove()
+    
+    return result, len(statements), timings
+
+def main():
+    args = parse_args()
+    app = create_app(args.database_url)
+    
+    from src.models import db
+    from src.models.event_rollup import EventHourlyRollup
+    from src.models.funnel import Funnel
+    from src.models.visitor_event import VisitorEvent
+    
+    with app.app_context():
+        # Fim do período alinhado ao dia para que o resultado não dependa da hora da execução
+        now = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        funnel = None
+        
+        if not args.reseed:
+            try:
+                funnel = Funnel.query.filter_by(slug=BENCHMARK_SLUG).first()
+            except SQLAlchemyError:
+                db.session.rollback()
+            
+            if funnel is not None:
+                seeded = db.session.execute(
+                    db.select(db.func.count()).where(VisitorEvent.funnel_id == funnel.id)
+                ).scalar()
+                if seeded != args.events:
+                    funnel = None
+                else:
+                    # Reaproveita o banco: o período termina na data do evento mais recente
+                    latest = db.session.execute(db.select(db.func.max(VisitorEvent.created_at))).scalar()
+                    now = latest.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        
+        if funnel is None:
+            print(f'Populando {args.database_url} com {args.events:,} eventos...')
+            started = time.perf_counter()
+            funnel = seed(db, args, now)
+            print(f'  carga concluída em {time.perf_counter() - started:.0f}s')
+        
+        end_date = now - timedelta(microseconds=1)
+        start_date = now - timedelta(days=args.range_days)
+        
+        if EventHourlyRollup.covers(start_date, end_date):
+            sys.exit('O banco tem buckets horários cobrindo o período; use --reseed para medir o caminho de visitor_events')
+        
+        in_range = db.session.execute(
+            db.select(db.func.count()).where(
+                VisitorEvent.funnel_id == funnel.id,
+                VisitorEvent.created_at >= start_date,
+                VisitorEvent.created_at <= end_date
+            )
+        ).scalar()
+        db.session.remove()
+        
+        print(f'Banco: {db.engine.dialect.name}, {args.events:,} eventos no funil, '
+              f'{in_range:,} no período de {args.range_days} dias, {args.steps} etapas ativas')
+        
+        results = {}
+        for label, function in (('antes (por etapa)', legacy_conversion_funnel),
+                                ('depois (atual)', VisitorEvent.get_conversion_funnel)):
+            result, queries, timings = measure(db, function, funnel.id, start_date, end_date, args.repeat)
+            results[label] = result
+            print(f'  {label:<18} {queries:>3} consultas   '
+                  f'mediana {statistics.median(timings):8.1f} ms   mínimo {min(timings):8.1f} ms')
+        
+        before, after = results.values()
+        if before != after:
+            sys.exit('ERRO: as implementações devolveram resultados diferentes')
+        
+        print('  resultados idênticos')
+
+if __name__ == '__main__':
+    main()
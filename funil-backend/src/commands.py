@@ -0,0 +1,133 @@
+from datetime import datetime, timedelta
+import click
+from flask.cli import AppGroup
+
+rollups_cli = AppGroup('rollups', help='Manutenção dos buckets horários de eventos')
+
+def _parse_date(value):
+    """Converte YYYY-MM-DD em datetime (ou None)"""
+    return datetime.strptime(value, '%Y-%m-%d') if value else None
+
+@rollups_cli.command('rebuild')
+@click.option('--start', help='Data inicial (YYYY-MM-DD). Sem ela, reconstrói todo o histórico.')
+@click.option('--end', help='Data final inclusiva (YYYY-MM-DD). Padrão: agora.')
+def rebuild_rollups(start, end):
+    """Recalcula os buckets horários a partir de visitor_events"""
+    from src.models.event_rollup import EventHourlyRollup, EventRollupState
+    from src.models import db
+    
+    try:
+        start_date = _parse_date(start)
+        end_date = _parse_date(end)
+    except ValueError:
+        raise click.BadParameter('Use o formato YYYY-MM-DD')
+    
+    if end_date:
+        end_date = end_date + timedelta(days=1) - timedelta(microseconds=1)
+    
+    start_hour, end_hour, written = EventHourlyRollup.rebuild(start_date, end_date)
+    state = db.session.get(EventRollupState, EventRollupState.SINGLETON_ID)
+    
+    click.echo(f'{written} buckets recalculados entre {start_hour} e {end_hour}')
+    click.echo(f'Cobertura: desde {state.covered_from}' + (' (histórico completo)' if state.full_history else ''))
+
+@rollups_cli.command('merge')
+def merge_rollups():
+    """Soma as contagens parciais gravadas na ingestão aos buckets horários"""
+    from src.models.event_rollup import EventHourlyRollup
+    
+    updated = EventHourlyRollup.merge_deltas()
+    click.echo(f'{updated} buckets horários atualizados')
+
+sketches_cli = AppGroup('sketches', help='Manutenção dos sketches de visitantes únicos')
+
+@sketches_cli.command('rebuild')
+@click.option('--start', help='Data inicial (YYYY-MM-DD, fuso de REPORT_TIMEZONE). Sem ela, reconstrói todo o histórico.')
+@click.option('--end', help='Data final inclusiva (YYYY-MM-DD). Padrão: hoje.')
+def rebuild_sketches(start, end):
+    """Recalcula os sketches HyperLogLog diários a partir de visitor_events"""
+    from src.models.visitor_sketch import VisitorSketch
+    
+    try:
+        start_date = _parse_date(start)
+        end_date = _parse_date(end)
+    except ValueError:
+        raise click.BadParameter('Use o formato YYYY-MM-DD')
+    
+    first_day, last_day, written = VisitorSketch.rebuild(
+        start_date.date() if start_date else None,
+        end_date.date() if end_date else None
+    )
+    
+    click.echo(f'{written} sketches recalculados entre {first_day} e {last_day}')
+
+@sketches_cli.command('merge')
+def merge_sketches():
+    """Une os sketches parciais gravados na ingestão aos sketches diários"""
+    from src.models.visitor_sketch import VisitorSketch
+    
+    updated = VisitorSketch.merge_deltas()
+    click.echo(f'{updated} sketches diários atualizados')
+
+def _write_chunks(chunks, target):
+    """Grava os blocos do export no arquivo de destino"""
+    for chunk in chunks:
+        target.write(chunk)
+
+exports_cli = AppGroup('exports', help='Exportação de eventos, visitantes e pagamentos')
+
+@exports_cli.command('run')
+@click.argument('dataset', type=click.Choice(['events', 'visitors', 'payments']))
+@click.option('--format', 'export_format', type=click.Choice(['csv', 'ndjson']), default='csv', show_default=True)
+@click.option('--columns', help='Colunas separadas por vírgula (padrão: todas).')
+@click.option('--funnel-id', type=int, help='Exporta apenas um funil.')
+@click.option('--start', help='Data inicial (YYYY-MM-DD, fuso de REPORT_TIMEZONE).')
+@click.option('--end', help='Data final inclusiva (YYYY-MM-DD).')
+@click.option('--gzip', 'compress', is_flag=True, help='Comprime a saída em gzip.')
+@click.option('--output', '-o', type=click.Path(dir_okay=False, writable=True), help='Arquivo de saída (padrão: stdout).')
+def run_export(dataset, export_format, columns, funnel_id, start, end, compress, output):
+    """Exporta uma tabela em CSV ou NDJSON lendo o banco em fluxo"""
+    from src.utils.export import iter_export
+    
+    try:
+        start_date = _parse_date(start)
+        end_date = _parse_date(end)
+    except ValueError:
+        raise click.BadParameter('Use o formato YYYY-MM-DD')
+    
+    columns = [column.strip() for column in columns.split(',') if column.strip()] if columns else None
+    
+    try:
+        chunks = iter_export(
+            dataset, export_format, columns, funnel_id,
+            start_date.date() if start_date else None,
+            end_date.date() if end_date else None,
+            compress=compress
+        )
+        
+        if output:
+            with open(output, 'wb') as target:
+                _write_chunks(chunks, target)
+        else:
+            # stdout pertence ao processo: só descarrega, sem fechar
+            stdout = click.get_binary_stream('stdout')
+            _write_chunks(chunks, stdout)
+            stdout.flush()
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+snapshots_cli = AppGroup('snapshots', help='Worker de snapshots pré-calculados do dashboard')
+
+@snapshots_cli.command('run')
+@click.option('--interval', type=int, help='Segundos entre os ciclos (padrão: ANALYTICS_SNAPSHOT_INTERVAL).')
+@click.option('--once', is_flag=True, help='Executa um único ciclo e sai.')
+def run_snapshots(interval, once):
+    """Recalcula periodicamente os snapshots do dashboard de todos os funis ativos"""
+    from flask import current_app
+    from src.services.snapshots import run_snapshot_worker
+    
+    interval = interval or current_app.config['ANALYTICS_SNAPSHOT_INTERVAL']
+    if interval <= 0:
+        raise click.BadParameter('O intervalo deve ser positivo', param_hint='--interval')
+    
+    run_snapshot_worker(interval, once=once, log=click.echo)
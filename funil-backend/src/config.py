@@ -30,6 +30,62 @@ class Config:
     
     DATAGET_API_TOKEN = os.environ.get('DATAGET_API_TOKEN')
     DATAGET_API_URL = os.environ.get('DATAGET_API_URL')
+    
+    # Buffer write-behind de eventos de visitantes
+    EVENT_BUFFER_ENABLED = os.environ.get('EVENT_BUFFER_ENABLED', 'true').lower() == 'true'
+    EVENT_BUFFER_MAX_SIZE = int(os.environ.get('EVENT_BUFFER_MAX_SIZE', 500))
+    EVENT_BUFFER_FLUSH_INTERVAL = float(os.environ.get('EVENT_BUFFER_FLUSH_INTERVAL', 2.0))
+    EVENT_BUFFER_MAX_RETRIES = int(os.environ.get('EVENT_BUFFER_MAX_RETRIES', 5))  # Tentativas de um lote com o banco indisponível
+    SKETCH_MERGE_INTERVAL = float(os.environ.get('SKETCH_MERGE_INTERVAL', 60))  # Consolidação dos parciais (contagens horárias e sketches) pela thread de flush (0 desativa)
+    
+    # Cache session_id -> visitor_id
+    VISITOR_CACHE_MAX_SIZE = int(os.environ.get('VISITOR_CACHE_MAX_SIZE', 50000))
+    VISITOR_CACHE_TTL = int(os.environ.get('VISITOR_CACHE_TTL', 1800))
+    
+    # Presença em memória dos visitantes online
+    PRESENCE_ENABLED = os.environ.get('PRESENCE_ENABLED', 'true').lower() == 'true'
+    PRESENCE_TIMEOUT = int(os.environ.get('PRESENCE_TIMEOUT', 300))
+    PRESENCE_SYNC_INTERVAL = int(os.environ.get('PRESENCE_SYNC_INTERVAL', 15))
+    
+    # Agrupamento das gravações de last_activity (no máximo uma por visitante a cada intervalo)
+    ACTIVITY_COALESCE_ENABLED = os.environ.get('ACTIVITY_COALESCE_ENABLED', 'true').lower() == 'true'
+    ACTIVITY_COALESCE_INTERVAL = int(os.environ.get('ACTIVITY_COALESCE_INTERVAL', 30))
+    ACTIVITY_COALESCE_FLUSH_INTERVAL = int(os.environ.get('ACTIVITY_COALESCE_FLUSH_INTERVAL', 5))
+    
+    # Fuso horário usado para montar os buckets diários dos relatórios
+    REPORT_TIMEZONE = os.environ.get('REPORT_TIMEZONE', 'America/Sao_Paulo')
+    
+    # Cache dos resultados de analytics do dashboard (por funil)
+    ANALYTICS_CACHE_ENABLED = os.environ.get('ANALYTICS_CACHE_ENABLED', 'true').lower() == 'true'
+    ANALYTICS_CACHE_TTL = int(os.environ.get('ANALYTICS_CACHE_TTL', 30))
+    ANALYTICS_CACHE_INGEST_THRESHOLD = int(os.environ.get('ANALYTICS_CACHE_INGEST_THRESHOLD', 500))
+    ANALYTICS_CACHE_MAX_SIZE = int(os.environ.get('ANALYTICS_CACHE_MAX_SIZE', 1000))
+    ANALYTICS_CACHE_VERSION_CHECK_INTERVAL = float(os.environ.get('ANALYTICS_CACHE_VERSION_CHECK_INTERVAL', 1.0))  # Consulta das invalidações dos outros workers
+    ANALYTICS_PATH_CACHE_TTL = int(os.environ.get('ANALYTICS_PATH_CACHE_TTL', 300))
+    
+    # Snapshots pré-calculados pelo worker `flask snapshots run`
+    ANALYTICS_SNAPSHOTS_ENABLED = os.environ.get('ANALYTICS_SNAPSHOTS_ENABLED', 'false').lower() == 'true'
+    ANALYTICS_SNAPSHOT_INTERVAL = int(os.environ.get('ANALYTICS_SNAPSHOT_INTERVAL', 60))
+    ANALYTICS_SNAPSHOT_MAX_AGE = int(os.environ.get('ANALYTICS_SNAPSHOT_MAX_AGE', 300))
+    
+    # Stream ao vivo do monitoramento (Server-Sent Events); o backend 'postgres'
+    # distribui as mensagens entre os workers com LISTEN/NOTIFY
+    LIVE_EVENTS_ENABLED = os.environ.get('LIVE_EVENTS_ENABLED', 'true').lower() == 'true'
+    LIVE_EVENTS_BACKEND = os.environ.get('LIVE_EVENTS_BACKEND', 'local')
+    LIVE_STREAM_MAX_CLIENTS = int(os.environ.get('LIVE_STREAM_MAX_CLIENTS', 16))
+    LIVE_STREAM_QUEUE_SIZE = int(os.environ.get('LIVE_STREAM_QUEUE_SIZE', 1000))
+    LIVE_STREAM_KEEPALIVE = int(os.environ.get('LIVE_STREAM_KEEPALIVE', 15))
+    LIVE_STREAM_MAX_DURATION = int(os.environ.get('LIVE_STREAM_MAX_DURATION', 300))
+    
+    # Cache dos scripts de pixels renderizados (rota pública); PIXEL_BROWSER_MAX_AGE
+    # é o max-age enviado ao navegador/CDN. Com 0 (padrão) a resposta vai com
+    # no-cache e é revalidada pelo ETag a cada carregamento (304 sem corpo), então
+    # um pixel alterado ou removido vale na próxima página
+    PIXEL_CACHE_ENABLED = os.environ.get('PIXEL_CACHE_ENABLED', 'true').lower() == 'true'
+    PIXEL_CACHE_TTL = int(os.environ.get('PIXEL_CACHE_TTL', 60))
+    PIXEL_CACHE_MAX_SIZE = int(os.environ.get('PIXEL_CACHE_MAX_SIZE', 10000))
+    PIXEL_CACHE_VERSION_CHECK_INTERVAL = float(os.environ.get('PIXEL_CACHE_VERSION_CHECK_INTERVAL', 1.0))  # Consulta das invalidações dos outros workers
+    PIXEL_BROWSER_MAX_AGE = int(os.environ.get('PIXEL_BROWSER_MAX_AGE', 0))
 
 class DevelopmentConfig(Config):
     """Configurações para desenvolvimento"""
@@ -43,6 +99,13 @@ class TestingConfig(Config):
     """Configurações para testes"""
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+    EVENT_BUFFER_ENABLED = False
+    PRESENCE_ENABLED = False
+    ACTIVITY_COALESCE_ENABLED = False
+    ANALYTICS_CACHE_ENABLED = False
+    ANALYTICS_SNAPSHOTS_ENABLED = False
+    LIVE_EVENTS_ENABLED = False
+    PIXEL_CACHE_ENABLED = False
 
 # Dicionário de configurações
 config = {
@@ -8,22 +8,49 @@ from flask import Flask, send_from_directory
 from flask_jwt_extended import JWTManager
 from flask_cors import CORS
 from src.models import db, init_db
-from src.routes import auth_bp, credentials_bp, funnels_bp, checkout_bp, monitoring_bp, payments_bp, tracking_bp
+from src.routes import auth_bp, credentials_bp, funnels_bp, checkout_bp, monitoring_bp, payments_bp, tracking_bp, exports_bp
 from src.config import config
+from src.commands import rollups_cli, sketches_cli, exports_cli, snapshots_cli
+from src.services.event_buffer import event_buffer
+from src.services.visitor_cache import visitor_cache
+from src.services.presence import presence
+from src.services.activity_coalescer import activity_coalescer
+from src.services.analytics_cache import analytics_cache
+from src.services.live_events import live_events
+from src.services.pixel_cache import pixel_cache
 
 app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
 
-# Carrega as configurações da aplicação
-app.config.from_object(config['development'])
+# Carrega as configurações da aplicação (FLASK_CONFIG: development, production ou testing)
+app.config.from_object(config[os.environ.get('FLASK_CONFIG', 'default')])
 
 # Inicializa o banco de dados
 init_db(app)
 
+# Inicializa o buffer de gravação em lote dos eventos de tracking
+event_buffer.init_app(app)
+visitor_cache.init_app(app)
+presence.init_app(app)
+activity_coalescer.init_app(app)
+analytics_cache.init_app(app)
+live_events.init_app(app)
+pixel_cache.init_app(app)
+
+# Registra os comandos de linha de comando (flask rollups ..., flask sketches ..., flask exports ..., flask snapshots ...)
+app.cli.add_command(rollups_cli)
+app.cli.add_command(sketches_cli)
+app.cli.add_command(exports_cli)
+app.cli.add_command(snapshots_cli)
+
 # Configura JWT
 jwt = JWTManager(app)
 
 # Configura CORS
-CORS(app, resources={r"/api/*": {"origins": app.config["CORS_ORIGINS"]}})
+CORS(app, resources={r"/api/*": {
+    "origins": app.config["CORS_ORIGINS"],
+    # Headers de resposta lidos pelo dashboard (cursores de paginação/incrementais e idade dos snapshots)
+    "expose_headers": ["X-Cursor", "X-Next-Cursor", "X-Online-After", "X-Snapshot-Age", "X-Snapshot-Computed-At"]
+}})
 
 # Registra os Blueprints
 app.register_blueprint(auth_bp, url_prefix="/api/auth")
@@ -33,6 +60,7 @@ app.register_blueprint(checkout_bp, url_prefix="/api/checkout")
 app.register_blueprint(monitoring_bp, url_prefix="/api/monitoring")
 app.register_blueprint(payments_bp, url_prefix="/api/payments")
 app.register_blueprint(tracking_bp, url_prefix="/api/tracking")
+app.register_blueprint(exports_bp, url_prefix="/api/exports")
 
 @app.route("/", defaults={"path": ""})
 @app.route("/<path:path>")
@@ -10,7 +10,24 @@ def init_db(app):
     migrate.init_app(app, db)
     
     # Importa todos os modelos para que sejam reconhecidos pelo Alembic
-    from . import user, credential, funnel, funnel_step, checkout_config, tracking_pixel, visitor, visitor_event, payment
+    from . import user, credential, funnel, funnel_step, checkout_config, tracking_pixel, visitor, visitor_event, event_rollup, visitor_sketch, analytics_snapshot, payment, cache_version
     
     return db
 
+def insert_ignoring_conflicts(table):
+    """Retorna um INSERT que ignora linhas que violam constraints únicas
+    
+    Usa ON CONFLICT DO NOTHING no PostgreSQL e no SQLite; nos demais bancos
+    retorna um INSERT simples.
+    """
+    dialect = db.engine.dialect.name
+    
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        return insert(table).on_conflict_do_nothing()
+    
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+        return insert(table).on_conflict_do_nothing()
+    
+    return db.insert(table)
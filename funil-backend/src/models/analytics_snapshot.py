@@ -0,0 +1,82 @@
+import json
+from datetime import datetime
+from src.models import db
+from src.models.event_rollup import NO_ID
+
+class AnalyticsSnapshot(db.Model):
+    """Último resultado pré-calculado de um relatório por (funil, tipo)
+    
+    Mantido pelo worker `flask snapshots run`; funnel_id NO_ID guarda a visão
+    geral de todos os funis. O conteúdo é JSON compacto.
+    """
+    
+    __tablename__ = 'analytics_snapshots'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    funnel_id = db.Column(db.Integer, nullable=False, default=NO_ID)
+    kind = db.Column(db.String(50), nullable=False)  # 'dashboard', 'hourly'
+    data = db.Column(db.Text, nullable=False)
+    computed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.UniqueConstraint('funnel_id', 'kind', name='uq_analytics_snapshot'),
+    )
+    
+    @staticmethod
+    def store(funnel_id, kind, data, computed_at=None):
+        """Grava (ou substitui) o snapshot de um funil"""
+        row = {
+            'funnel_id': funnel_id or NO_ID,
+            'kind': kind,
+            'data': json.dumps(data, separators=(',', ':'), ensure_ascii=False, default=str),
+            'computed_at': computed_at or datetime.utcnow()
+        }
+        
+        table = AnalyticsSnapshot.__table__
+        dialect = db.engine.dialect.name
+        
+        if dialect in ('postgresql', 'sqlite'):
+            if dialect == 'postgresql':
+                from sqlalchemy.dialects.postgresql import insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert
+            
+            stmt = insert(table).values(row)
+            db.session.execute(stmt.on_conflict_do_update(
+                index_elements=['funnel_id', 'kind'],
+                set_={'data': stmt.excluded.data, 'computed_at': stmt.excluded.computed_at}
+            ))
+        else:
+            updated = db.session.execute(
+                db.update(table).where(
+                    table.c.funnel_id == row['funnel_id'],
+                    table.c.kind == kind
+                ).values(data=row['data'], computed_at=row['computed_at'])
+            ).rowcount
+            if not updated:
+                db.session.execute(db.insert(table).values(row))
+    
+    @staticmethod
+    def latest(funnel_id, kind, max_age=None):
+        """Retorna (dados, idade_em_segundos, computed_at) do snapshot, ou None
+        
+        Args:
+            max_age: Idade máxima aceita em segundos; snapshots mais antigos são ignorados
+        """
+        row = db.session.execute(
+            db.select(AnalyticsSnapshot.data, AnalyticsSnapshot.computed_at).where(
+                AnalyticsSnapshot.funnel_id == (funnel_id or NO_ID),
+                AnalyticsSnapshot.kind == kind
+            )
+        ).first()
+        if row is None:
+            return None
+        
+        age = (datetime.utcnow() - row.computed_at).total_seconds()
+        if max_age is not None and age > max_age:
+            return None
+        
+        return json.loads(row.data), age, row.computed_at
+    
+    def __repr__(self):
+        return f'<AnalyticsSnapshot {self.kind} funil {self.funnel_id} - {self.computed_at}>'
@@ -0,0 +1,57 @@
+from datetime import datetime
+from src.models import db, insert_ignoring_conflicts
+
+class CacheVersion(db.Model):
+    """Contador de invalidações de um cache em memória, compartilhado entre os workers
+    
+    Cada cache usa um scope ('analytics', 'pixels') e chaves inteiras (em
+    geral o funnel_id). Quem invalida incrementa a versão da chave; os demais
+    workers comparam as versões periodicamente e descartam as suas cópias.
+    """
+    
+    __tablename__ = 'cache_versions'
+    
+    scope = db.Column(db.String(50), primary_key=True)
+    key = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    @staticmethod
+    def bump(scope, keys):
+        """Incrementa as versões das chaves em uma transação própria e retorna {chave: nova_versão}
+        
+        Usa uma conexão separada da sessão, então pode ser chamado depois do
+        commit de uma requisição sem afetar o estado dela.
+        """
+        table = CacheVersion.__table__
+        keys = sorted(set(keys))
+        now = datetime.utcnow()
+        
+        with db.engine.begin() as connection:
+            connection.execute(insert_ignoring_conflicts(table), [
+                {'scope': scope, 'key': key, 'version': 0, 'updated_at': now} for key in keys
+            ])
+            # Em ordem de chave: duas invalidações simultâneas bloqueiam as linhas na mesma ordem
+            for key in keys:
+                connection.execute(
+                    db.update(table).where(table.c.scope == scope, table.c.key == key).values(
+                        version=table.c.version + 1,
+                        updated_at=now
+                    )
+                )
+            
+            return dict(connection.execute(
+                db.select(table.c.key, table.c.version).where(table.c.scope == scope, table.c.key.in_(keys))
+            ).all())
+    
+    @staticmethod
+    def current(scope):
+        """Retorna {chave: versão} de um scope"""
+        table = CacheVersion.__table__
+        with db.engine.connect() as connection:
+            return dict(connection.execute(
+                db.select(table.c.key, table.c.version).where(table.c.scope == scope)
+            ).all())
+    
+    def __repr__(self):
+        return f'<CacheVersion {self.scope}:{self.key} v{self.version}>'
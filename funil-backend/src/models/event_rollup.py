@@ -0,0 +1,313 @@
+from collections import Counter
+from datetime import datetime, timedelta
+from src.models import db
+
+# Funil/etapa ausentes são gravados como 0 para que a chave única funcione com NULLs
+NO_ID = 0
+
+def floor_hour(value):
+    """Trunca um datetime para o início da hora"""
+    return value.replace(minute=0, second=0, microsecond=0)
+
+def hour_bucket(column):
+    """Expressão SQL que trunca uma coluna DateTime para o início da hora"""
+    if db.engine.dialect.name == 'sqlite':
+        # Mesmo formato de texto que o SQLAlchemy usa para DateTime no SQLite
+        return db.func.strftime('%Y-%m-%d %H:00:00.000000', column)
+    # Literal (e não parâmetro) para o GROUP BY casar com a expressão do SELECT
+    return db.func.date_trunc(db.literal_column("'hour'"), column)
+
+class EventHourlyRollup(db.Model):
+    """Contagem de eventos por (funil, etapa, tipo, hora), mantida na ingestão
+    
+    A ingestão só insere contagens parciais (EventHourlyRollupDelta), sem
+    bloquear as linhas da hora corrente, que todos os workers disputariam.
+    merge_deltas consolida os parciais aqui periodicamente; as consultas
+    somam buckets e parciais (bucket_rows).
+    """
+    
+    __tablename__ = 'event_hourly_rollups'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    funnel_id = db.Column(db.Integer, nullable=False, default=NO_ID)
+    step_id = db.Column(db.Integer, nullable=False, default=NO_ID)
+    event_type = db.Column(db.String(50), nullable=False)
+    hour = db.Column(db.DateTime, nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        db.UniqueConstraint('funnel_id', 'step_id', 'event_type', 'hour', name='uq_event_hourly_rollup'),
+        db.Index('ix_event_hourly_rollups_funnel_hour', 'funnel_id', 'hour'),
+        db.Index('ix_event_hourly_rollups_step_type_hour', 'step_id', 'event_type', 'hour'),
+    )
+    
+    def to_dict(self):
+        """Converte o modelo para dicionário"""
+        return {
+            'funnel_id': self.funnel_id or None,
+            'step_id': self.step_id or None,
+            'event_type': self.event_type,
+            'hour': self.hour.isoformat() if self.hour else None,
+            'count': self.count
+        }
+    
+    @staticmethod
+    def increment(events):
+        """Registra eventos recém-inseridos como contagens parciais (mesma transação dos eventos)
+        
+        Só INSERT em event_hourly_rollup_deltas: a ingestão não bloqueia as
+        linhas de event_hourly_rollups.
+        
+        Args:
+            events: Lista de dicionários com funnel_id, step_id, event_type e created_at
+        """
+        counts = Counter(
+            (
+                event.get('funnel_id') or NO_ID,
+                event.get('step_id') or NO_ID,
+                event['event_type'],
+                floor_hour(event.get('created_at') or datetime.utcnow())
+            )
+            for event in events
+        )
+        if not counts:
+            return 0
+        
+        db.session.execute(db.insert(EventHourlyRollupDelta.__table__), [
+            {'funnel_id': funnel_id, 'step_id': step_id, 'event_type': event_type, 'hour': hour, 'count': count}
+            for (funnel_id, step_id, event_type, hour), count in counts.items()
+        ])
+        
+        return len(counts)
+    
+    @staticmethod
+    def merge_deltas():
+        """Soma as contagens parciais pendentes aos buckets horários e as remove
+        
+        Os parciais são removidos e somados na mesma transação (DELETE ...
+        RETURNING quando o banco suporta), então execuções concorrentes não
+        contam em dobro. Os buckets são atualizados em ordem de chave para que
+        duas execuções simultâneas bloqueiem as linhas na mesma ordem.
+        
+        Returns:
+            Número de buckets atualizados
+        """
+        deltas = EventHourlyRollupDelta.__table__
+        columns = (deltas.c.funnel_id, deltas.c.step_id, deltas.c.event_type, deltas.c.hour, deltas.c.count)
+        
+        max_id = db.session.execute(db.select(db.func.max(deltas.c.id))).scalar()
+        if max_id is None:
+            return 0
+        
+        if db.engine.dialect.delete_returning:
+            pending = db.session.execute(db.delete(deltas).where(deltas.c.id <= max_id).returning(*columns)).all()
+        else:
+            pending = db.session.execute(
+                db.select(deltas.c.id, *columns).where(deltas.c.id <= max_id).with_for_update()
+            ).all()
+            db.session.execute(db.delete(deltas).where(deltas.c.id.in_([row.id for row in pending])))
+        
+        counts = Counter()
+        for row in pending:
+            counts[(row.funnel_id, row.step_id, row.event_type, row.hour)] += row.count
+        
+        rows = [
+            {'funnel_id': funnel_id, 'step_id': step_id, 'event_type': event_type, 'hour': hour, 'count': count}
+            for (funnel_id, step_id, event_type, hour), count in sorted(counts.items())
+        ]
+        if rows:
+            EventHourlyRollup._add_counts(rows)
+        db.session.commit()
+        
+        return len(rows)
+    
+    @staticmethod
+    def _add_counts(rows):
+        """Soma contagens aos buckets, criando os que não existem"""
+        table = EventHourlyRollup.__table__
+        dialect = db.engine.dialect.name
+        
+        if dialect in ('postgresql', 'sqlite'):
+            if dialect == 'postgresql':
+                from sqlalchemy.dialects.postgresql import insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert
+            
+            stmt = insert(table)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['funnel_id', 'step_id', 'event_type', 'hour'],
+                set_={'count': table.c.count + stmt.excluded.count}
+            )
+            db.session.execute(stmt, rows)
+        else:
+            for row in rows:
+                updated = db.session.execute(
+                    db.update(table).where(
+                        table.c.funnel_id == row['funnel_id'],
+                        table.c.step_id == row['step_id'],
+                        table.c.event_type == row['event_type'],
+                        table.c.hour == row['hour']
+                    ).values(count=table.c.count + row['count'])
+                ).rowcount
+                if not updated:
+                    db.session.execute(db.insert(table), [row])
+    
+    @staticmethod
+    def bucket_rows(start=None, end=None, funnel_id=None, step_ids=None, event_types=None):
+        """Subconsulta (funnel_id, step_id, event_type, hour, count) dos buckets e dos parciais pendentes
+        
+        Os filtros são aplicados em cada tabela; a mesma chave pode aparecer
+        várias vezes, então quem consulta soma count.
+        
+        Args:
+            start, end: Limites inclusivos de hour
+            step_ids: Lista ou subconsulta de etapas
+        """
+        queries = []
+        for model in (EventHourlyRollup, EventHourlyRollupDelta):
+            query = db.select(model.funnel_id, model.step_id, model.event_type, model.hour, model.count)
+            
+            if start is not None:
+                query = query.where(model.hour >= start)
+            
+            if end is not None:
+                query = query.where(model.hour <= end)
+            
+            if funnel_id:
+                query = query.where(model.funnel_id == funnel_id)
+            
+            if step_ids is not None:
+                query = query.where(model.step_id.in_(step_ids))
+            
+            if event_types:
+                query = query.where(model.event_type.in_(event_types))
+            
+            queries.append(query)
+        
+        return db.union_all(*queries).subquery()
+    
+    @staticmethod
+    def rebuild(start=None, end=None):
+        """Recalcula os buckets a partir de visitor_events para o intervalo [start, end]
+        
+        Sem start, recalcula desde o primeiro evento e marca todo o histórico como coberto.
+        O intervalo para no início da hora corrente: a hora aberta continua
+        recebendo parciais da ingestão, que a reconstrução contaria em dobro
+        ou apagaria. Retorna (primeira_hora, hora_final_exclusiva, buckets_gravados).
+        """
+        from src.models.visitor_event import VisitorEvent
+        
+        full_history = start is None
+        if full_history:
+            start = db.session.query(db.func.min(VisitorEvent.created_at)).scalar() or datetime.utcnow()
+        end = end or datetime.utcnow()
+        
+        start_hour = floor_hour(start)
+        end_hour = min(floor_hour(end) + timedelta(hours=1), floor_hour(datetime.utcnow()))
+        if end_hour <= start_hour:
+            return start_hour, start_hour, 0
+        
+        table = EventHourlyRollup.__table__
+        deltas = EventHourlyRollupDelta.__table__
+        db.session.execute(db.delete(table).where(table.c.hour >= start_hour, table.c.hour < end_hour))
+        db.session.execute(db.delete(deltas).where(deltas.c.hour >= start_hour, deltas.c.hour < end_hour))
+        
+        bucket = hour_bucket(VisitorEvent.created_at)
+        funnel = db.func.coalesce(VisitorEvent.funnel_id, db.literal_column(str(NO_ID)))
+        step = db.func.coalesce(VisitorEvent.step_id, db.literal_column(str(NO_ID)))
+        source = db.select(funnel, step, VisitorEvent.event_type, bucket, db.func.count()).where(
+            VisitorEvent.created_at >= start_hour,
+            VisitorEvent.created_at < end_hour
+        ).group_by(funnel, step, VisitorEvent.event_type, bucket)
+        
+        written = db.session.execute(
+            db.insert(table).from_select(['funnel_id', 'step_id', 'event_type', 'hour', 'count'], source)
+        ).rowcount
+        
+        EventRollupState.extend_coverage(start_hour, end_hour, full_history)
+        db.session.commit()
+        
+        return start_hour, end_hour, written
+    
+    @staticmethod
+    def covers(start=None, end=None):
+        """Indica se os buckets respondem exatamente pelo intervalo [start, end]"""
+        state = db.session.get(EventRollupState, EventRollupState.SINGLETON_ID)
+        if state is None or state.covered_from is None:
+            return False
+        
+        if start is None:
+            if not state.full_history:
+                return False
+        elif start != floor_hour(start):
+            return False
+        elif start < state.covered_from and not state.full_history:
+            return False
+        
+        # O fim é inclusivo: precisa terminar no último instante de uma hora
+        if end is not None and floor_hour(end + timedelta(microseconds=1)) != end + timedelta(microseconds=1):
+            return False
+        
+        return True
+    
+    def __repr__(self):
+        return f'<EventHourlyRollup {self.event_type} {self.hour} - {self.count}>'
+
+class EventHourlyRollupDelta(db.Model):
+    """Contagem parcial de um lote de eventos, aguardando EventHourlyRollup.merge_deltas"""
+    
+    __tablename__ = 'event_hourly_rollup_deltas'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    funnel_id = db.Column(db.Integer, nullable=False, default=NO_ID)
+    step_id = db.Column(db.Integer, nullable=False, default=NO_ID)
+    event_type = db.Column(db.String(50), nullable=False)
+    hour = db.Column(db.DateTime, nullable=False)
+    count = db.Column(db.Integer, nullable=False)
+    
+    __table_args__ = (
+        db.Index('ix_event_hourly_rollup_deltas_hour', 'hour'),
+    )
+    
+    def __repr__(self):
+        return f'<EventHourlyRollupDelta {self.event_type} {self.hour} - {self.count}>'
+
+class EventRollupState(db.Model):
+    """Registro único com o período coberto pelos buckets horários
+    
+    Todas as horas a partir de covered_from estão completas: as anteriores à
+    reconstrução foram recalculadas e as seguintes são mantidas na ingestão.
+    """
+    
+    __tablename__ = 'event_rollup_state'
+    
+    SINGLETON_ID = 1
+    
+    id = db.Column(db.Integer, primary_key=True)
+    covered_from = db.Column(db.DateTime)
+    full_history = db.Column(db.Boolean, default=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    @staticmethod
+    def extend_coverage(start_hour, end_hour, full_history=False):
+        """Amplia a cobertura após reconstruir o intervalo [start_hour, end_hour)"""
+        state = db.session.get(EventRollupState, EventRollupState.SINGLETON_ID)
+        if state is None:
+            state = EventRollupState(id=EventRollupState.SINGLETON_ID)
+            db.session.add(state)
+        
+        # Só vale estender quando o intervalo reconstruído encosta na cobertura atual
+        # (ou, na primeira reconstrução, chega até a hora corrente mantida pela ingestão)
+        if state.covered_from is None:
+            if end_hour >= floor_hour(datetime.utcnow()):
+                state.covered_from = start_hour
+        elif start_hour < state.covered_from <= end_hour:
+            state.covered_from = start_hour
+        
+        if full_history and state.covered_from == start_hour:
+            state.full_history = True
+        
+        state.updated_at = datetime.utcnow()
+    
+    def __repr__(self):
+        return f'<EventRollupState desde {self.covered_from}>'
@@ -25,8 +25,15 @@ class Funnel(db.Model):
     visitors = db.relationship('Visitor', backref='funnel', lazy='dynamic')
     payments = db.relationship('Payment', backref='funnel', lazy='dynamic')
     
-    def to_dict(self):
-        """Converte o modelo para dicionário"""
+    def to_dict(self, step_counts=None):
+        """Converte o modelo para dicionário
+        
+        Args:
+            step_counts: (total, ativas) de etapas já conhecido (evita os dois COUNT por funil)
+        """
+        if step_counts is None:
+            step_counts = (self.steps.count(), self.steps.filter_by(is_active=True).count())
+        
         return {
             'id': self.id,
             'name': self.name,
@@ -38,16 +45,36 @@ class Funnel(db.Model):
             'created_by': self.created_by,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None,
-            'steps_count': self.steps.count(),
-            'active_steps_count': self.steps.filter_by(is_active=True).count()
+            'steps_count': step_counts[0],
+            'active_steps_count': step_counts[1]
         }
     
     def to_dict_with_steps(self):
         """Converte o modelo para dicionário incluindo as etapas"""
-        data = self.to_dict()
-        data['steps'] = [step.to_dict() for step in self.steps.order_by('order_index').all()]
+        steps = self.steps.order_by('order_index').all()
+        data = self.to_dict(step_counts=(len(steps), sum(1 for step in steps if step.is_active)))
+        data['steps'] = [step.to_dict() for step in steps]
         return data
     
+    @staticmethod
+    def to_dict_many(funnels):
+        """Serializa uma lista de funis com as contagens de etapas de uma única consulta agrupada"""
+        from src.models.funnel_step import FunnelStep
+        
+        if not funnels:
+            return []
+        
+        rows = db.session.query(
+            FunnelStep.funnel_id,
+            db.func.count(FunnelStep.id),
+            db.func.count(db.case((FunnelStep.is_active == True, FunnelStep.id)))
+        ).filter(
+            FunnelStep.funnel_id.in_([funnel.id for funnel in funnels])
+        ).group_by(FunnelStep.funnel_id).all()
+        step_counts = {funnel_id: (total, active) for funnel_id, total, active in rows}
+        
+        return [funnel.to_dict(step_counts=step_counts.get(funnel.id, (0, 0))) for funnel in funnels]
+    
     def get_step_by_slug(self, slug):
         """Retorna uma etapa específica pelo slug"""
         return self.steps.filter_by(slug=slug).first()
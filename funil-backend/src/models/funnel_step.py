@@ -1,4 +1,5 @@
 from datetime import datetime
+from sqlalchemy.orm.attributes import set_committed_value
 from src.models import db
 
 class FunnelStep(db.Model):
@@ -43,6 +44,24 @@ class FunnelStep(db.Model):
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
     
+    @staticmethod
+    def preload(items, relationship, key):
+        """Preenche o relacionamento de etapa de vários objetos com uma única consulta
+        
+        Args:
+            items: Objetos que referenciam uma etapa (visitantes, eventos...)
+            relationship: Nome do relacionamento a preencher (ex.: 'current_step')
+            key: Nome da coluna com o id da etapa (ex.: 'current_step_id')
+        """
+        step_ids = {getattr(item, key) for item in items} - {None}
+        steps = {}
+        if step_ids:
+            steps = {step.id: step for step in FunnelStep.query.filter(FunnelStep.id.in_(step_ids)).all()}
+        
+        for item in items:
+            # Sem marcar o objeto como alterado nem disparar o lazy load
+            set_committed_value(item, relationship, steps.get(getattr(item, key)))
+    
     def to_dict_with_checkout(self):
         """Converte o modelo para dicionário incluindo configuração de checkout"""
         data = self.to_dict()
@@ -1,6 +1,17 @@
-from datetime import datetime
-from decimal import Decimal
+from datetime import datetime, timedelta
+from decimal import Decimal, ROUND_HALF_UP
 from src.models import db
+from src.utils.dates import get_report_timezone, local_date_bucket, local_date_of, local_day_range_utc
+
+def round_money(value):
+    """Arredonda um Decimal para centavos apenas na saída"""
+    return float(Decimal(value).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP))
+
+# Quebras disponíveis em Payment.get_analytics
+ANALYTICS_BREAKDOWNS = ('totals', 'daily', 'methods', 'steps')
+
+# Dimensões disponíveis em Payment.get_utm_attribution
+UTM_DIMENSIONS = ('utm_source', 'utm_medium', 'utm_campaign', 'utm_term', 'utm_content')
 
 class Payment(db.Model):
     """Modelo para pagamentos"""
@@ -21,6 +32,13 @@ class Payment(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # Índices para as estatísticas de receita e para o webhook do gateway
+    __table_args__ = (
+        db.Index('ix_payments_status_funnel_created', 'status', 'funnel_id', 'created_at'),
+        db.Index('uq_payments_external_id', 'external_id', unique=True),
+        db.Index('ix_payments_visitor_status', 'visitor_id', 'status'),
+    )
+    
     def to_dict(self):
         """Converte o modelo para dicionário"""
         return {
@@ -93,101 +111,302 @@ class Payment(db.Model):
         return self.status in ['failed', 'cancelled']
     
     @staticmethod
-    def get_revenue_stats(funnel_id=None, start_date=None, end_date=None):
-        """Retorna estatísticas de receita"""
-        query = Payment.query.filter_by(status='paid')
+    def _paid_filters(funnel_id=None, start_date=None, end_date=None):
+        """Filtros comuns das estatísticas de pagamentos aprovados"""
+        filters = [Payment.status == 'paid']
         
         if funnel_id:
-            query = query.filter_by(funnel_id=funnel_id)
+            filters.append(Payment.funnel_id == funnel_id)
         
         if start_date:
-            query = query.filter(Payment.created_at >= start_date)
+            filters.append(Payment.created_at >= start_date)
         
         if end_date:
-            query = query.filter(Payment.created_at <= end_date)
+            filters.append(Payment.created_at <= end_date)
         
-        payments = query.all()
+        return filters
+    
+    @staticmethod
+    def _revenue_sum():
+        """SUM(amount) tipado como o valor, para o driver devolver Decimal"""
+        return db.func.coalesce(db.func.sum(Payment.amount, type_=Payment.amount.type), 0)
+    
+    @staticmethod
+    def get_revenue_stats(funnel_id=None, start_date=None, end_date=None):
+        """Retorna estatísticas de receita"""
+        total_revenue, total_transactions = db.session.execute(
+            db.select(Payment._revenue_sum(), db.func.count(Payment.id)).where(
+                *Payment._paid_filters(funnel_id, start_date, end_date)
+            )
+        ).one()
         
-        total_revenue = sum(float(p.amount) for p in payments)
-        total_transactions = len(payments)
-        average_ticket = total_revenue / total_transactions if total_transactions > 0 else 0
+        total_revenue = Decimal(total_revenue)
+        average_ticket = total_revenue / total_transactions if total_transactions > 0 else Decimal(0)
         
         return {
-            'total_revenue': round(total_revenue, 2),
+            'total_revenue': round_money(total_revenue),
             'total_transactions': total_transactions,
-            'average_ticket': round(average_ticket, 2),
+            'average_ticket': round_money(average_ticket),
             'currency': 'BRL'
         }
     
     @staticmethod
-    def get_daily_revenue(funnel_id=None, days=30):
-        """Retorna receita diária dos últimos X dias"""
-        from datetime import timedelta
+    def get_daily_revenue(funnel_id=None, days=30, tz=None):
+        """Retorna receita diária dos últimos X dias, com os dias no fuso de REPORT_TIMEZONE"""
+        tz = tz or get_report_timezone()
         
-        end_date = datetime.utcnow()
-        start_date = end_date - timedelta(days=days)
+        last_day = datetime.now(tz).date()
+        first_day = last_day - timedelta(days=days)
+        start_date, end_date = local_day_range_utc(first_day, last_day, tz)
         
-        query = Payment.query.filter(
-            Payment.status == 'paid',
-            Payment.created_at >= start_date,
-            Payment.created_at <= end_date
-        )
-        
-        if funnel_id:
-            query = query.filter_by(funnel_id=funnel_id)
-        
-        payments = query.all()
+        bucket = local_date_bucket(Payment.created_at, tz)
+        rows = db.session.execute(
+            db.select(bucket, Payment._revenue_sum(), db.func.count(Payment.id)).where(
+                Payment.status == 'paid',
+                Payment.created_at >= start_date,
+                Payment.created_at < end_date,
+                *([Payment.funnel_id == funnel_id] if funnel_id else [])
+            ).group_by(bucket)
+        ).all()
         
         # Agrupa por dia
         daily_revenue = {}
-        current_date = start_date.date()
+        current_date = first_day
         
-        while current_date <= end_date.date():
-            daily_revenue[current_date.isoformat()] = {
-                'date': current_date.isoformat(),
-                'revenue': 0,
-                'transactions': 0
-            }
+        while current_date <= last_day:
+            daily_revenue[current_date] = [Decimal(0), 0]
             current_date += timedelta(days=1)
         
-        for payment in payments:
-            date_key = payment.created_at.date().isoformat()
-            if date_key in daily_revenue:
-                daily_revenue[date_key]['revenue'] += float(payment.amount)
-                daily_revenue[date_key]['transactions'] += 1
+        # No SQLite os buckets são horas UTC e várias podem cair no mesmo dia local
+        for day_bucket, revenue, transactions in rows:
+            day = local_date_of(day_bucket, tz)
+            if day in daily_revenue:
+                daily_revenue[day][0] += Decimal(revenue)
+                daily_revenue[day][1] += transactions
         
-        return list(daily_revenue.values())
+        return [
+            {
+                'date': day.isoformat(),
+                'revenue': round_money(revenue),
+                'transactions': transactions
+            }
+            for day, (revenue, transactions) in daily_revenue.items()
+        ]
     
     @staticmethod
     def get_payment_methods_stats(funnel_id=None, start_date=None, end_date=None):
         """Retorna estatísticas por método de pagamento"""
-        query = Payment.query.filter_by(status='paid')
+        rows = db.session.execute(
+            db.select(Payment.payment_method, db.func.count(Payment.id), Payment._revenue_sum()).where(
+                *Payment._paid_filters(funnel_id, start_date, end_date)
+            ).group_by(Payment.payment_method)
+        ).all()
+        
+        return [
+            {
+                'method': method,
+                'count': count,
+                'revenue': round_money(Decimal(revenue))
+            }
+            for method, count, revenue in rows
+        ]
+    
+    @staticmethod
+    def get_analytics(funnel_id=None, start_date=None, end_date=None, breakdowns=None, tz=None, days=30):
+        """Calcula, em uma única consulta, as estatísticas de receita pedidas
+        
+        Os pagamentos aprovados são agrupados uma vez por (dia local, método, etapa),
+        apenas nas dimensões necessárias, e cada quebra é somada a partir dessas linhas.
+        
+        Args:
+            start_date, end_date: Datas (inclusivas) no fuso de REPORT_TIMEZONE; sem
+                start_date o período são os últimos days dias, como em get_daily_revenue
+            breakdowns: Subconjunto de ANALYTICS_BREAKDOWNS (todas por padrão)
+        
+        Returns:
+            Dicionário com revenue_stats, daily_revenue, payment_methods_stats e
+            step_revenue_stats, conforme as quebras pedidas
+        """
+        from src.models.funnel_step import FunnelStep
+        
+        breakdowns = set(breakdowns or ANALYTICS_BREAKDOWNS)
+        tz = tz or get_report_timezone()
+        
+        last_day = end_date or datetime.now(tz).date()
+        start_date = start_date or last_day - timedelta(days=days)
+        range_start, range_end = local_day_range_utc(start_date, last_day, tz)
+        
+        columns = []
+        if 'daily' in breakdowns:
+            columns.append(local_date_bucket(Payment.created_at, tz).label('day'))
+        if 'methods' in breakdowns:
+            columns.append(Payment.payment_method.label('method'))
+        if 'steps' in breakdowns:
+            columns += [Payment.step_id.label('step_id'), FunnelStep.name.label('step_name')]
+        
+        query = db.select(
+            *columns,
+            Payment._revenue_sum().label('revenue'),
+            db.func.count(Payment.id).label('transactions')
+        ).where(
+            Payment.status == 'paid',
+            Payment.created_at >= range_start,
+            Payment.created_at < range_end,
+            *([Payment.funnel_id == funnel_id] if funnel_id else [])
+        )
+        
+        if 'steps' in breakdowns:
+            query = query.outerjoin(FunnelStep, FunnelStep.id == Payment.step_id)
+        
+        if columns:
+            query = query.group_by(*columns)
+        
+        rows = db.session.execute(query).all()
+        
+        total_revenue = Decimal(0)
+        total_transactions = 0
+        daily = {}
+        methods = {}
+        steps = {}
+        
+        for row in rows:
+            revenue = Decimal(row.revenue)
+            total_revenue += revenue
+            total_transactions += row.transactions
+            
+            if 'daily' in breakdowns:
+                # No SQLite os buckets são horas UTC e várias podem cair no mesmo dia local
+                bucket = daily.setdefault(local_date_of(row.day, tz), [Decimal(0), 0])
+                bucket[0] += revenue
+                bucket[1] += row.transactions
+            
+            if 'methods' in breakdowns:
+                bucket = methods.setdefault(row.method, [Decimal(0), 0])
+                bucket[0] += revenue
+                bucket[1] += row.transactions
+            
+            if 'steps' in breakdowns:
+                bucket = steps.setdefault((row.step_id, row.step_name), [Decimal(0), 0])
+                bucket[0] += revenue
+                bucket[1] += row.transactions
+        
+        result = {}
+        
+        if 'totals' in breakdowns:
+            average_ticket = total_revenue / total_transactions if total_transactions > 0 else Decimal(0)
+            result['revenue_stats'] = {
+                'total_revenue': round_money(total_revenue),
+                'total_transactions': total_transactions,
+                'average_ticket': round_money(average_ticket),
+                'currency': 'BRL'
+            }
+        
+        if 'daily' in breakdowns:
+            current_date = start_date
+            daily_revenue = []
+            
+            while current_date <= last_day:
+                revenue, transactions = daily.get(current_date, (Decimal(0), 0))
+                daily_revenue.append({
+                    'date': current_date.isoformat(),
+                    'revenue': round_money(revenue),
+                    'transactions': transactions
+                })
+                current_date += timedelta(days=1)
+            
+            result['daily_revenue'] = daily_revenue
+        
+        if 'methods' in breakdowns:
+            result['payment_methods_stats'] = [
+                {
+                    'method': method,
+                    'count': transactions,
+                    'revenue': round_money(revenue)
+                }
+                for method, (revenue, transactions) in methods.items()
+            ]
+        
+        if 'steps' in breakdowns:
+            result['step_revenue_stats'] = [
+                {
+                    'step_id': step_id,
+                    'step_name': step_name,
+                    'count': transactions,
+                    'revenue': round_money(revenue)
+                }
+                for (step_id, step_name), (revenue, transactions) in steps.items()
+            ]
+        
+        return result
+    
+    @staticmethod
+    def get_utm_attribution(dimensions=('utm_source',), funnel_id=None, start_date=None, end_date=None, tz=None):
+        """Receita atribuída às UTMs dos visitantes, agrupada pelas dimensões escolhidas
+        
+        A atribuição é pela chegada: entram os visitantes com first_visit no período
+        e os pagamentos aprovados deles até o fim do período. Tudo é calculado em
+        uma única consulta agregada (visitantes LEFT JOIN pagamentos por visitante).
+        
+        Args:
+            dimensions: Subconjunto ordenado de UTM_DIMENSIONS
+            start_date, end_date: Datas (inclusivas) no fuso de REPORT_TIMEZONE
+        """
+        from src.models.visitor import Visitor
+        
+        tz = tz or get_report_timezone()
+        range_start = range_end = None
+        if start_date or end_date:
+            range_start, range_end = local_day_range_utc(start_date or end_date, end_date or start_date, tz)
+        
+        paid = db.select(
+            Payment.visitor_id,
+            Payment._revenue_sum().label('revenue'),
+            db.func.count(Payment.id).label('transactions')
+        ).where(
+            Payment.status == 'paid',
+            Payment.visitor_id.isnot(None),
+            *([Payment.funnel_id == funnel_id] if funnel_id else []),
+            *([Payment.created_at < range_end] if end_date else [])
+        ).group_by(Payment.visitor_id).subquery()
+        
+        group_columns = [getattr(Visitor, dimension) for dimension in dimensions]
+        query = db.select(
+            *group_columns,
+            db.func.count(Visitor.id).label('visitors'),
+            db.func.count(paid.c.visitor_id).label('paying_visitors'),
+            db.func.coalesce(db.func.sum(paid.c.revenue, type_=Payment.amount.type), 0).label('revenue'),
+            db.func.coalesce(db.func.sum(paid.c.transactions), 0).label('transactions')
+        ).select_from(Visitor).outerjoin(paid, paid.c.visitor_id == Visitor.id)
         
         if funnel_id:
-            query = query.filter_by(funnel_id=funnel_id)
+            query = query.where(Visitor.funnel_id == funnel_id)
         
         if start_date:
-            query = query.filter(Payment.created_at >= start_date)
+            query = query.where(Visitor.first_visit >= range_start)
         
         if end_date:
-            query = query.filter(Payment.created_at <= end_date)
+            query = query.where(Visitor.first_visit < range_end)
         
-        payments = query.all()
+        rows = db.session.execute(
+            query.group_by(*group_columns).order_by(db.desc('revenue'))
+        ).all()
         
-        methods_stats = {}
-        for payment in payments:
-            method = payment.payment_method
-            if method not in methods_stats:
-                methods_stats[method] = {
-                    'method': method,
-                    'count': 0,
-                    'revenue': 0
-                }
+        attribution = []
+        for row in rows:
+            revenue = Decimal(row.revenue)
+            transactions = int(row.transactions)
             
-            methods_stats[method]['count'] += 1
-            methods_stats[method]['revenue'] += float(payment.amount)
+            attribution.append({
+                **{dimension: row[index] for index, dimension in enumerate(dimensions)},
+                'visitors': row.visitors,
+                'paying_visitors': row.paying_visitors,
+                'transactions': transactions,
+                'revenue': round_money(revenue),
+                'conversion_rate': round(row.paying_visitors / row.visitors * 100, 2) if row.visitors else 0,
+                'average_ticket': round_money(revenue / transactions) if transactions else 0
+            })
         
-        return list(methods_stats.values())
+        return attribution
     
     def __repr__(self):
         return f'<Payment {self.external_id} - R$ {self.amount} - {self.status}>'
@@ -1,6 +1,76 @@
 from datetime import datetime
+from jinja2 import Environment
 from src.models import db
 
+# Templates dos scripts por fornecedor, compilados uma vez na importação. Os valores
+# vão para o JavaScript via tojson (string JSON com <, >, & e ' escapados) e para
+# URLs via urlencode; o autoescape cobre os atributos HTML.
+_template_env = Environment(autoescape=True, trim_blocks=True, lstrip_blocks=True)
+
+PIXEL_TEMPLATES = {
+    'facebook': _template_env.from_string("""<!-- Facebook Pixel Code -->
+<script>
+!function(f,b,e,v,n,t,s)
+{if(f.fbq)return;n=f.fbq=function(){n.callMethod?
+n.callMethod.apply(n,arguments):n.queue.push(arguments)};
+if(!f._fbq)f._fbq=n;n.push=n;n.loaded=!0;n.version='2.0';
+n.queue=[];t=b.createElement(e);t.async=!0;
+t.src=v;s=b.getElementsByTagName(e)[0];
+s.parentNode.insertBefore(t,s)}(window, document,'script',
+'https://connect.facebook.net/en_US/fbevents.js');
+{% for pixel in pixels %}
+fbq('init', {{ pixel.pixel_id|tojson }});
+{% endfor %}
+fbq('track', 'PageView');
+{% for pixel in pixels if pixel.event_name %}
+fbq('trackSingle', {{ pixel.pixel_id|tojson }}, {{ pixel.event_name|tojson }});
+{% endfor %}
+</script>
+<noscript>
+{% for pixel in pixels %}
+<img height="1" width="1" style="display:none" src="https://www.facebook.com/tr?id={{ pixel.pixel_id|urlencode }}&amp;ev=PageView&amp;noscript=1"/>
+{% endfor %}
+</noscript>
+<!-- End Facebook Pixel Code -->"""),
+    'google': _template_env.from_string("""<!-- Google tag (gtag.js) -->
+<script async src="https://www.googletagmanager.com/gtag/js?id={{ pixels[0].pixel_id|urlencode }}"></script>
+<script>
+window.dataLayer = window.dataLayer || [];
+function gtag(){dataLayer.push(arguments);}
+gtag('js', new Date());
+{% for pixel in pixels %}
+gtag('config', {{ pixel.pixel_id|tojson }});
+{% endfor %}
+{% for pixel in pixels if pixel.event_name %}
+gtag('event', {{ pixel.event_name|tojson }}, {'send_to': {{ pixel.pixel_id|tojson }}});
+{% endfor %}
+</script>"""),
+    'tiktok': _template_env.from_string("""<!-- TikTok Pixel Code -->
+<script>
+!function (w, d, t) {
+w.TiktokAnalyticsObject=t;var ttq=w[t]=w[t]||[];ttq.methods=["page","track","identify","instances","debug","on","off","once","ready","alias","group","enableCookie","disableCookie"],ttq.setAndDefer=function(t,e){t[e]=function(){t.push([e].concat(Array.prototype.slice.call(arguments,0)))}};for(var i=0;i<ttq.methods.length;i++)ttq.setAndDefer(ttq,ttq.methods[i]);ttq.instance=function(t){for(var e=ttq._i[t]||[],n=0;n<ttq.methods.length;n++)ttq.setAndDefer(e,ttq.methods[n]);return e},ttq.load=function(e,n){var i="https://analytics.tiktok.com/i18n/pixel/events.js";ttq._i=ttq._i||{},ttq._i[e]=[],ttq._i[e]._u=i,ttq._t=ttq._t||{},ttq._t[e]=+new Date,ttq._o=ttq._o||{},ttq._o[e]=n||{};var o=document.createElement("script");o.type="text/javascript",o.async=!0,o.src=i+"?sdkid="+e+"&lib="+t;var a=document.getElementsByTagName("script")[0];a.parentNode.insertBefore(o,a)};
+{% for pixel in pixels %}
+ttq.load({{ pixel.pixel_id|tojson }});
+{% endfor %}
+ttq.page();
+{% for pixel in pixels if pixel.event_name %}
+ttq.instance({{ pixel.pixel_id|tojson }}).track({{ pixel.event_name|tojson }});
+{% endfor %}
+}(window, document, 'ttq');
+</script>
+<!-- End TikTok Pixel Code -->"""),
+    'custom': _template_env.from_string("""<!-- Custom Pixel -->
+<script>
+{% for pixel in pixels %}
+console.log('Custom pixel fired:', {{ pixel.pixel_id|tojson }});
+{% if pixel.event_name %}
+console.log('Event:', {{ pixel.event_name|tojson }});
+{% endif %}
+{% endfor %}
+</script>
+<!-- End Custom Pixel -->"""),
+}
+
 class TrackingPixel(db.Model):
     """Modelo para pixels de tracking"""
     
@@ -42,106 +112,25 @@ class TrackingPixel(db.Model):
     
     def generate_script(self):
         """Gera o script do pixel baseado no tipo"""
-        if self.pixel_type == 'facebook':
-            return self._generate_facebook_pixel()
-        elif self.pixel_type == 'google':
-            return self._generate_google_pixel()
-        elif self.pixel_type == 'tiktok':
-            return self._generate_tiktok_pixel()
-        else:
-            return self._generate_custom_pixel()
+        return TrackingPixel.render_scripts([self])
     
-    def _generate_facebook_pixel(self):
-        """Gera script do Facebook Pixel"""
-        script = """
-        <!-- Facebook Pixel Code -->
-        <script>
-        !function(f,b,e,v,n,t,s)
-        {if(f.fbq)return;n=f.fbq=function(){n.callMethod?
-        n.callMethod.apply(n,arguments):n.queue.push(arguments)};
-        if(!f._fbq)f._fbq=n;n.push=n;n.loaded=!0;n.version='2.0';
-        n.queue=[];t=b.createElement(e);t.async=!0;
-        t.src=v;s=b.getElementsByTagName(e)[0];
-        s.parentNode.insertBefore(t,s)}(window, document,'script',
-        'https://connect.facebook.net/en_US/fbevents.js');
-        fbq('init', '""" + self.pixel_id + """');
-        fbq('track', 'PageView');
-        """
-        
-        if self.event_name:
-            script += "fbq('track', '" + self.event_name + "');"
-        
-        script += """
-        </script>
-        <noscript><img height="1" width="1" style="display:none"
-        src="https://www.facebook.com/tr?id=""" + self.pixel_id + """&ev=PageView&noscript=1"
-        /></noscript>
-        <!-- End Facebook Pixel Code -->
-        """
-        
-        return script
-    
-    def _generate_google_pixel(self):
-        """Gera script do Google Analytics/Ads"""
-        script = """
-        <!-- Google tag (gtag.js) -->
-        <script async src="https://www.googletagmanager.com/gtag/js?id=""" + self.pixel_id + """"></script>
-        <script>
-        window.dataLayer = window.dataLayer || [];
-        function gtag(){dataLayer.push(arguments);}
-        gtag('js', new Date());
-        gtag('config', '""" + self.pixel_id + """');
-        """
-        
-        if self.event_name:
-            script += "gtag('event', '" + self.event_name + "');"
-        
-        script += """
-        </script>
-        """
-        
-        return script
-    
-    def _generate_tiktok_pixel(self):
-        """Gera script do TikTok Pixel"""
-        script = """
-        <!-- TikTok Pixel Code -->
-        <script>
-        !function (w, d, t) {
-        w.TiktokAnalyticsObject=t;var ttq=w[t]=w[t]||[];ttq.methods=["page","track","identify","instances","debug","on","off","once","ready","alias","group","enableCookie","disableCookie"],ttq.setAndDefer=function(t,e){t[e]=function(){t.push([e].concat(Array.prototype.slice.call(arguments,0)))}};for(var i=0;i<ttq.methods.length;i++)ttq.setAndDefer(ttq,ttq.methods[i]);ttq.instance=function(t){for(var e=ttq._i[t]||[],n=0;n<ttq.methods.length;n++)ttq.setAndDefer(e,ttq.methods[n]);return e},ttq.load=function(e,n){var i="https://analytics.tiktok.com/i18n/pixel/events.js";ttq._i=ttq._i||{},ttq._i[e]=[],ttq._i[e]._u=i,ttq._t=ttq._t||{},ttq._t[e]=+new Date,ttq._o=ttq._o||{},ttq._o[e]=n||{};var o=document.createElement("script");o.type="text/javascript",o.async=!0,o.src=i+"?sdkid="+e+"&lib="+t;var a=document.getElementsByTagName("script")[0];a.parentNode.insertBefore(o,a)};
-        ttq.load('""" + self.pixel_id + """');
-        ttq.page();
-        """
-        
-        if self.event_name:
-            script += "ttq.track('" + self.event_name + "');"
-        
-        script += """
-        }(window, document, 'ttq');
-        </script>
-        <!-- End TikTok Pixel Code -->
-        """
-        
-        return script
-    
-    def _generate_custom_pixel(self):
-        """Gera script customizado"""
-        script = """
-        <!-- Custom Pixel -->
-        <script>
-        // Custom pixel code for """ + self.pixel_id + """
-        console.log('Custom pixel fired: """ + self.pixel_id + """');
-        """
-        
-        if self.event_name:
-            script += "console.log('Event: " + self.event_name + "');"
+    @staticmethod
+    def render_scripts(pixels):
+        """Gera os scripts de vários pixels, com um único loader por fornecedor
         
-        script += """
-        </script>
-        <!-- End Custom Pixel -->
+        Os pixels são agrupados por tipo (na ordem em que aparecem) e cada
+        grupo é renderizado uma vez pelo template pré-compilado do fornecedor:
+        o bootstrap é injetado uma só vez, seguido de um init/config por pixel.
         """
+        groups = {}
+        for pixel in pixels:
+            pixel_type = pixel.pixel_type if pixel.pixel_type in PIXEL_TEMPLATES else 'custom'
+            groups.setdefault(pixel_type, []).append(pixel)
         
-        return script
+        return "\n".join(
+            PIXEL_TEMPLATES[pixel_type].render(pixels=group)
+            for pixel_type, group in groups.items()
+        )
     
     @staticmethod
     def get_funnel_pixels(funnel_id, step_id=None):
@@ -158,7 +147,8 @@ class TrackingPixel(db.Model):
             # Apenas pixels globais do funil
             query = query.filter(TrackingPixel.step_id.is_(None))
         
-        return query.all()
+        # Ordem estável: o HTML gerado (e o seu ETag) não varia entre consultas
+        return query.order_by(TrackingPixel.id).all()
     
     def __repr__(self):
         return f'<TrackingPixel {self.pixel_type} - {self.pixel_id}>'
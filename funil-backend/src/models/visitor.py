@@ -1,5 +1,31 @@
-from datetime import datetime, timedelta
-from src.models import db
+from datetime import date, datetime, timedelta
+import numpy as np
+from sqlalchemy.orm.attributes import set_committed_value
+from src.models import db, insert_ignoring_conflicts
+from src.utils.dates import epoch_seconds, get_report_timezone, local_day_range_utc, utc_to_local
+from src.utils.pagination import decode_cursor, encode_cursor, paginate_keyset
+
+EPOCH = datetime(1970, 1, 1)
+
+# Linhas lidas por lote (colunar) na análise de coortes
+COHORT_CHUNK_SIZE = 50000
+
+# Sobreposição aplicada ao cursor since dos visitantes online: cobre transações
+# confirmadas fora de ordem e a atividade que chega aos outros workers pela
+# sincronização da presença. O cliente remove os repetidos pelo id.
+SINCE_OVERLAP = timedelta(seconds=30)
+
+def _local_day_numbers(epoch_hours, tz):
+    """Converte um array de horas UTC (horas desde 1970) no ordinal do dia local
+    
+    O fuso é resolvido uma vez por hora distinta e aplicado de forma vetorizada.
+    """
+    unique_hours, inverse = np.unique(epoch_hours, return_inverse=True)
+    local_days = np.array(
+        [utc_to_local(EPOCH + timedelta(hours=int(hour)), tz).date().toordinal() for hour in unique_hours],
+        dtype=np.int64
+    )
+    return local_days[inverse]
 
 class Visitor(db.Model):
     """Modelo para rastrear visitantes do funil"""
@@ -20,14 +46,27 @@ class Visitor(db.Model):
     first_visit = db.Column(db.DateTime, default=datetime.utcnow)
     last_activity = db.Column(db.DateTime, default=datetime.utcnow)
     is_online = db.Column(db.Boolean, default=True)
+    # Horário do servidor da última gravação: base do cursor incremental (last_activity vem do cliente)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # Índices para a busca de visitantes online/inativos e para os relatórios por chegada
+    __table_args__ = (
+        db.Index('ix_visitors_online_activity_funnel', 'is_online', 'last_activity', 'funnel_id'),
+        db.Index('ix_visitors_funnel_first_visit', 'funnel_id', 'first_visit'),
+        db.Index('ix_visitors_updated_at', 'updated_at'),
+    )
     
     # Relacionamentos
     current_step = db.relationship('FunnelStep', foreign_keys=[current_step_id])
     events = db.relationship('VisitorEvent', backref='visitor', lazy='dynamic', cascade='all, delete-orphan')
     payments = db.relationship('Payment', backref='visitor', lazy='dynamic')
     
-    def to_dict(self):
-        """Converte o modelo para dicionário"""
+    def to_dict(self, events_count=None):
+        """Converte o modelo para dicionário
+        
+        Args:
+            events_count: Total de eventos já conhecido (evita o COUNT por visitante)
+        """
         return {
             'id': self.id,
             'session_id': self.session_id,
@@ -45,22 +84,63 @@ class Visitor(db.Model):
             'last_activity': self.last_activity.isoformat() if self.last_activity else None,
             'is_online': self.is_online,
             'time_on_site': self.get_time_on_site(),
-            'events_count': self.events.count()
+            'events_count': self.events.count() if events_count is None else events_count
         }
     
     def to_dict_with_events(self):
         """Converte o modelo para dicionário incluindo eventos"""
-        data = self.to_dict()
-        data['events'] = [event.to_dict() for event in self.events.order_by('created_at').all()]
+        from src.models.visitor_event import VisitorEvent
+        
+        events = self.events.order_by('created_at').all()
+        data = self.to_dict(events_count=len(events))
+        data['events'] = VisitorEvent.to_dict_many(events)
         return data
     
+    @staticmethod
+    def to_dict_many(visitors):
+        """Serializa uma lista de visitantes com um número fixo de consultas
+        
+        As etapas atuais são carregadas em uma consulta e os totais de eventos
+        vêm de uma única contagem agrupada, em vez de um lazy load e um COUNT
+        por visitante.
+        """
+        from src.models.funnel_step import FunnelStep
+        from src.models.visitor_event import VisitorEvent
+        
+        if not visitors:
+            return []
+        
+        FunnelStep.preload(visitors, 'current_step', 'current_step_id')
+        
+        events_counts = dict(db.session.query(VisitorEvent.visitor_id, db.func.count()).filter(
+            VisitorEvent.visitor_id.in_([visitor.id for visitor in visitors])
+        ).group_by(VisitorEvent.visitor_id).all())
+        
+        return [visitor.to_dict(events_count=events_counts.get(visitor.id, 0)) for visitor in visitors]
+    
     def update_activity(self, step_id=None):
         """Atualiza a última atividade do visitante"""
-        self.last_activity = datetime.utcnow()
-        self.is_online = True
+        from src.services.activity_coalescer import activity_coalescer
+        from src.services.presence import presence
+        
+        now = datetime.utcnow()
+        
+        if self.id and activity_coalescer.enabled:
+            # Atualiza a instância sem marcá-la como alterada; a gravação fica com o agrupador
+            activity_coalescer.record(self.id, now, step_id)
+            set_committed_value(self, 'last_activity', now)
+            set_committed_value(self, 'is_online', True)
+            if step_id:
+                set_committed_value(self, 'current_step_id', step_id)
+        else:
+            self.last_activity = now
+            self.is_online = True
+            
+            if step_id and step_id != self.current_step_id:
+                self.current_step_id = step_id
         
-        if step_id and step_id != self.current_step_id:
-            self.current_step_id = step_id
+        if self.id:
+            presence.heartbeat(self.id, self.funnel_id, self.current_step_id, now)
     
     def mark_offline(self):
         """Marca o visitante como offline"""
@@ -89,27 +169,225 @@ class Visitor(db.Model):
     
     def add_event(self, event_type, step_id=None, event_data=None):
         """Adiciona um evento para o visitante"""
+        from src.models.event_rollup import EventHourlyRollup
+        from src.models.funnel_step import FunnelStep
         from src.models.visitor_event import VisitorEvent
+        from src.models.visitor_sketch import VisitorSketch
+        
+        step = db.session.get(FunnelStep, step_id) if step_id else None
         
         event = VisitorEvent(
             visitor_id=self.id,
+            funnel_id=step.funnel_id if step else self.funnel_id,
             event_type=event_type,
             step_id=step_id,
-            event_data=event_data or {}
+            event_data=event_data or {},
+            created_at=datetime.utcnow()
         )
         
         db.session.add(event)
+        event_row = {
+            'visitor_id': self.id,
+            'funnel_id': event.funnel_id,
+            'step_id': event.step_id,
+            'event_type': event.event_type,
+            'created_at': event.created_at
+        }
+        EventHourlyRollup.increment([event_row])
+        VisitorSketch.add_events([event_row])
         self.update_activity(step_id)
         
         return event
     
+    @staticmethod
+    def resolve_sessions(sessions):
+        """Resolve os IDs dos visitantes de várias sessões, criando os que não existem
+        
+        Args:
+            sessions: Dicionário {session_id: dados_do_visitante}, onde os dados
+                (ip_address, user_agent, funnel_id, utm_*) só são usados na criação
+        
+        Returns:
+            Dicionário {session_id: visitor_id}
+        """
+        if not sessions:
+            return {}
+        
+        session_ids = list(sessions)
+        resolved = dict(db.session.execute(
+            db.select(Visitor.session_id, Visitor.id).where(Visitor.session_id.in_(session_ids))
+        ).all())
+        
+        missing = [session_id for session_id in session_ids if session_id not in resolved]
+        if missing:
+            now = datetime.utcnow()
+            rows = [
+                {
+                    'session_id': session_id,
+                    'first_visit': now,
+                    'last_activity': now,
+                    'is_online': True,
+                    'updated_at': now,
+                    **sessions[session_id]
+                }
+                for session_id in missing
+            ]
+            
+            # Sessões criadas em paralelo por outra requisição são ignoradas e relidas abaixo
+            db.session.execute(insert_ignoring_conflicts(Visitor.__table__), rows)
+            resolved.update(db.session.execute(
+                db.select(Visitor.session_id, Visitor.id).where(Visitor.session_id.in_(missing))
+            ).all())
+        
+        return resolved
+    
+    @staticmethod
+    def bulk_update_activity(activity):
+        """Atualiza a última atividade de vários visitantes com um único UPDATE em lote
+        
+        Args:
+            activity: Dicionário {visitor_id: (last_activity, step_id)}; step_id
+                None mantém a etapa atual do visitante
+        """
+        if not activity:
+            return 0
+        
+        visitors = Visitor.__table__
+        new_activity = db.bindparam('new_activity', type_=db.DateTime)
+        stmt = db.update(visitors).where(
+            visitors.c.id == db.bindparam('visitor_id')
+        ).values(
+            # Lotes fora de ordem nunca fazem last_activity retroceder
+            last_activity=db.case(
+                (visitors.c.last_activity.is_(None), new_activity),
+                (visitors.c.last_activity < new_activity, new_activity),
+                else_=visitors.c.last_activity
+            ),
+            current_step_id=db.func.coalesce(db.bindparam('new_step_id', type_=db.Integer), visitors.c.current_step_id),
+            is_online=True,
+            updated_at=datetime.utcnow()
+        )
+        
+        rows = [
+            {'visitor_id': visitor_id, 'new_activity': last_activity, 'new_step_id': step_id}
+            for visitor_id, (last_activity, step_id) in activity.items()
+        ]
+        db.session.execute(stmt, rows)
+        
+        return len(rows)
+    
+    @staticmethod
+    def bulk_mark_offline(visitor_ids, cutoff_time):
+        """Marca como offline, em um único UPDATE, os visitantes sem atividade desde cutoff_time
+        
+        Retorna (id, funnel_id) dos visitantes que passaram a offline; quem já
+        estava offline (por exemplo, marcado por outro worker) fica de fora.
+        """
+        if not visitor_ids:
+            return []
+        
+        visitors = Visitor.__table__
+        return db.session.execute(
+            db.update(visitors).where(
+                visitors.c.id.in_(list(visitor_ids)),
+                visitors.c.last_activity < cutoff_time,
+                visitors.c.is_online == True
+            ).values(is_online=False).returning(visitors.c.id, visitors.c.funnel_id)
+        ).all()
+    
+    @staticmethod
+    def online_cutoff():
+        """Instante a partir do qual a última atividade ainda conta como online"""
+        from src.services.presence import presence
+        
+        if presence.enabled:
+            return datetime.utcnow() - timedelta(seconds=presence.timeout)
+        
+        # Considera online visitantes com atividade nos últimos 5 minutos
+        return datetime.utcnow() - timedelta(minutes=5)
+    
     @staticmethod
     def get_online_visitors(funnel_id=None):
         """Retorna visitantes online"""
-        # Considera online visitantes com atividade nos últimos 5 minutos
-        cutoff_time = datetime.utcnow() - timedelta(minutes=5)
+        return Visitor.get_online_visitors_page(funnel_id)[0]
+    
+    @staticmethod
+    def get_online_visitors_page(funnel_id=None, since=None, limit=None, cursor=None):
+        """Retorna uma página dos visitantes online, do mais recente para o mais antigo
+        
+        A paginação é por keyset em (last_activity, id); com a presença em
+        memória, pelo último heartbeat de cada visitante.
+        
+        Args:
+            since: Cursor devolvido como high_water pela consulta anterior: só
+                visitantes alterados depois dele (menos SINCE_OVERLAP)
+            limit: Tamanho da página (sem limite se None)
+            cursor: Próximo cursor devolvido pela página anterior
+        
+        Returns:
+            (visitantes, high_water, próximo_cursor): high_water é o maior
+            horário de gravação (do servidor, não o last_activity do cliente)
+            entre os visitantes filtrados, usado como since da consulta
+            seguinte; próximo_cursor é None na última página
+        """
+        from src.services.presence import presence
+        
+        columns = (Visitor.last_activity, Visitor.id)
+        changed_after = since - SINCE_OVERLAP if since else None
+        
+        if presence.enabled:
+            # Presença em memória: o banco só é consultado pela chave primária da página
+            changes = presence.online_entries(funnel_id, changed_after)
+            high_water = max([changed_at for _, _, changed_at in changes] + ([since] if since else []), default=None)
+            entries = [(seen_at, visitor_id) for seen_at, visitor_id, _ in changes]
+            
+            if cursor:
+                after = tuple(decode_cursor(cursor, columns))
+                entries = [entry for entry in entries if entry < after]
+            
+            next_cursor = None
+            if limit is not None and len(entries) > limit:
+                entries = entries[:limit]
+                next_cursor = encode_cursor(entries[-1])
+            
+            if not entries:
+                return [], high_water, None
+            
+            visitor_ids = [visitor_id for _, visitor_id in entries]
+            visitors = {v.id: v for v in Visitor.query.filter(Visitor.id.in_(visitor_ids)).all()}
+            return [visitors[visitor_id] for visitor_id in visitor_ids if visitor_id in visitors], high_water, next_cursor
         
         query = Visitor.query.filter(
+            Visitor.last_activity >= Visitor.online_cutoff(),
+            Visitor.is_online == True
+        )
+        
+        if changed_after:
+            query = query.filter(Visitor.updated_at > changed_after)
+        
+        if funnel_id:
+            query = query.filter(Visitor.funnel_id == funnel_id)
+        
+        high_water = query.with_entities(db.func.max(Visitor.updated_at)).scalar()
+        if since and (high_water is None or high_water < since):
+            high_water = since
+        
+        if limit is None:
+            return query.order_by(Visitor.last_activity.desc(), Visitor.id.desc()).all(), high_water, None
+        
+        visitors, next_cursor = paginate_keyset(query, columns, limit, cursor, descending=True)
+        return visitors, high_water, next_cursor
+    
+    @staticmethod
+    def get_online_counts(funnel_id=None):
+        """Retorna o total de visitantes online e a distribuição por etapa"""
+        from src.services.presence import presence
+        
+        if presence.enabled:
+            return presence.online_counts(funnel_id)
+        
+        cutoff_time = datetime.utcnow() - timedelta(minutes=5)
+        query = db.session.query(Visitor.current_step_id, db.func.count(Visitor.id)).filter(
             Visitor.last_activity >= cutoff_time,
             Visitor.is_online == True
         )
@@ -117,7 +395,135 @@ class Visitor(db.Model):
         if funnel_id:
             query = query.filter(Visitor.funnel_id == funnel_id)
         
-        return query.all()
+        by_step = query.group_by(Visitor.current_step_id).all()
+        
+        return {
+            'total': sum(count for _, count in by_step),
+            'by_step': [{'step_id': step_id, 'count': count} for step_id, count in by_step]
+        }
+    
+    @staticmethod
+    def get_cohort_analysis(funnel_id=None, start_date=None, end_date=None, period='day', max_age=90, tz=None):
+        """Conversão paga e receita acumuladas por dia desde a primeira visita, por coorte
+        
+        Os visitantes chegam já contados por hora no banco e os pagamentos em lotes
+        colunares de inteiros; as matrizes (coorte x dias desde a primeira visita)
+        são montadas com operações do NumPy.
+        
+        Args:
+            start_date, end_date: Datas (inclusivas) de first_visit no fuso de REPORT_TIMEZONE;
+                o padrão são os últimos max_age dias
+            period: 'day' ou 'week' (semanas começando na segunda-feira)
+            max_age: Número de colunas (dias desde a primeira visita)
+        
+        Returns:
+            Dicionário com period, max_age e cohorts ([{cohort, visitors, conversion_rate,
+            revenue}]); idades ainda não observáveis vêm como None
+        """
+        from src.models.payment import Payment
+        
+        tz = tz or get_report_timezone()
+        today = datetime.now(tz).date()
+        end_date = end_date or today
+        start_date = start_date or end_date - timedelta(days=max_age - 1)
+        
+        if period == 'week':
+            # A primeira coorte semanal começa na segunda-feira da semana de start_date
+            first_cohort = start_date - timedelta(days=start_date.weekday())
+            cohort_days = 7
+        else:
+            first_cohort = start_date
+            cohort_days = 1
+        
+        range_start, range_end = local_day_range_utc(first_cohort, end_date, tz)
+        cohort_count = (end_date.toordinal() - first_cohort.toordinal()) // cohort_days + 1
+        
+        filters = [Visitor.first_visit >= range_start, Visitor.first_visit < range_end]
+        if funnel_id:
+            filters.append(Visitor.funnel_id == funnel_id)
+        
+        hour = db.literal_column('3600', type_=db.BigInteger)
+        first_visit_hour = epoch_seconds(Visitor.first_visit) // hour
+        connection = db.session.connection()
+        
+        # Tamanho das coortes: visitantes contados por hora UTC no banco
+        visitor_hours = connection.execute(
+            db.select(first_visit_hour, db.func.count()).where(*filters).group_by(first_visit_hour)
+        ).all()
+        cohort_sizes = np.zeros(cohort_count, dtype=np.int64)
+        if visitor_hours:
+            hours, counts = (np.array(column, dtype=np.int64) for column in zip(*visitor_hours))
+            cohorts = (_local_day_numbers(hours, tz) - first_cohort.toordinal()) // cohort_days
+            np.add.at(cohort_sizes, cohorts, counts)
+        
+        # Pagamentos aprovados desses visitantes em lotes colunares de inteiros:
+        # visitante, hora da primeira visita, hora do pagamento e valor em centavos
+        payer_ids, visit_hours, paid_hours, amounts = [], [], [], []
+        result = connection.execution_options(stream_results=True).execute(
+            db.select(
+                Payment.visitor_id,
+                first_visit_hour,
+                epoch_seconds(Payment.created_at) // hour,
+                db.cast(db.func.round(Payment.amount * 100), db.BigInteger)
+            ).join(Visitor, Visitor.id == Payment.visitor_id).where(
+                Payment.status == 'paid',
+                *filters
+            )
+        )
+        for chunk in result.partitions(COHORT_CHUNK_SIZE):
+            for target, column in zip((payer_ids, visit_hours, paid_hours, amounts), zip(*chunk)):
+                target.append(np.array(column, dtype=np.int64))
+        
+        revenue_cents = np.zeros((cohort_count, max_age), dtype=np.int64)
+        converted = np.zeros((cohort_count, max_age + 1), dtype=np.int64)
+        
+        if payer_ids:
+            payer_ids, visit_hours, paid_hours, amounts = (
+                np.concatenate(column) for column in (payer_ids, visit_hours, paid_hours, amounts)
+            )
+            visit_days = _local_day_numbers(visit_hours, tz)
+            ages = _local_day_numbers(paid_hours, tz) - visit_days
+            cohorts = (visit_days - first_cohort.toordinal()) // cohort_days
+            
+            visible = (ages >= 0) & (ages < max_age)
+            np.add.at(revenue_cents, (cohorts[visible], ages[visible]), amounts[visible])
+            
+            # Idade do primeiro pagamento de cada visitante (max_age = fora da janela)
+            payers, first_payment, payer_index = np.unique(payer_ids, return_index=True, return_inverse=True)
+            first_paid_age = np.full(len(payers), max_age, dtype=np.int64)
+            np.minimum.at(first_paid_age, payer_index[visible], ages[visible])
+            np.add.at(converted, (cohorts[first_payment], first_paid_age), 1)
+        
+        # Conversões e receita acumuladas ao longo das idades
+        cumulative_converted = np.cumsum(converted[:, :max_age], axis=1)
+        cumulative_revenue = np.cumsum(revenue_cents, axis=1)
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            conversion_rate = np.where(
+                cohort_sizes[:, None] > 0,
+                np.round(cumulative_converted / cohort_sizes[:, None] * 100, 2),
+                0.0
+            )
+        
+        # Última idade já observável em cada coorte (pela visita mais antiga da coorte)
+        cohort_starts = first_cohort.toordinal() + np.arange(cohort_count) * cohort_days
+        observable = np.clip(today.toordinal() - cohort_starts + 1, 0, max_age)
+        
+        cohorts = []
+        for index in range(cohort_count):
+            visible_ages = int(observable[index])
+            cohorts.append({
+                'cohort': date.fromordinal(int(cohort_starts[index])).isoformat(),
+                'visitors': int(cohort_sizes[index]),
+                'conversion_rate': conversion_rate[index, :visible_ages].tolist() + [None] * (max_age - visible_ages),
+                'revenue': (cumulative_revenue[index, :visible_ages] / 100).tolist() + [None] * (max_age - visible_ages)
+            })
+        
+        return {
+            'period': period,
+            'max_age': max_age,
+            'cohorts': cohorts
+        }
     
     @staticmethod
     def cleanup_old_visitors(days=30):
@@ -139,16 +545,13 @@ class Visitor(db.Model):
         """Marca visitantes inativos como offline"""
         cutoff_time = datetime.utcnow() - timedelta(minutes=5)
         
-        inactive_visitors = Visitor.query.filter(
+        updated = Visitor.query.filter(
             Visitor.last_activity < cutoff_time,
             Visitor.is_online == True
-        ).all()
-        
-        for visitor in inactive_visitors:
-            visitor.mark_offline()
+        ).update({'is_online': False}, synchronize_session=False)
         
         db.session.commit()
-        return len(inactive_visitors)
+        return updated
     
     def __repr__(self):
         return f'<Visitor {self.session_id} - {self.ip_address}>'
@@ -1,6 +1,38 @@
+import math
+from collections import Counter
 from datetime import datetime
+from itertools import groupby
 from src.models import db
 
+# Linhas por comando INSERT multi-valores no PostgreSQL
+BULK_INSERT_CHUNK_SIZE = 1000
+
+# Eventos contados como conversão de uma etapa
+CONVERSION_EVENT_TYPES = ['form_submit', 'payment_complete']
+
+# Linhas lidas por lote do cursor na análise de caminhos
+PATH_ANALYSIS_CHUNK_SIZE = 5000
+
+# Razão entre os limites dos buckets de duração (mediana com erro de ~2,5%)
+DURATION_BUCKET_RATIO = 1.05
+
+def _duration_bucket(seconds):
+    """Bucket logarítmico de uma duração em segundos"""
+    return int(math.log(max(seconds, 0) + 1, DURATION_BUCKET_RATIO))
+
+def _median_duration(buckets):
+    """Mediana aproximada a partir de um Counter {bucket: ocorrências}"""
+    total = sum(buckets.values())
+    if not total:
+        return None
+    
+    seen = 0
+    for bucket in sorted(buckets):
+        seen += buckets[bucket]
+        if seen * 2 >= total:
+            # Ponto médio geométrico do bucket
+            return round(DURATION_BUCKET_RATIO ** (bucket + 0.5) - 1, 1)
+
 class VisitorEvent(db.Model):
     """Modelo para eventos de visitantes"""
     
@@ -8,11 +40,20 @@ class VisitorEvent(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     visitor_id = db.Column(db.Integer, db.ForeignKey('visitors.id'), nullable=False)
+    funnel_id = db.Column(db.Integer, db.ForeignKey('funnels.id'))  # Desnormalizado da etapa/visitante
     event_type = db.Column(db.String(50), nullable=False)  # 'page_view', 'form_submit', 'payment_init', 'payment_complete'
     step_id = db.Column(db.Integer, db.ForeignKey('funnel_steps.id'))
     event_data = db.Column(db.JSON, default={})
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # Índices para as consultas de analytics e de eventos por visitante
+    __table_args__ = (
+        db.Index('ix_visitor_events_step_type_created', 'step_id', 'event_type', 'created_at'),
+        db.Index('ix_visitor_events_visitor_created', 'visitor_id', 'created_at'),
+        db.Index('ix_visitor_events_funnel_created', 'funnel_id', 'created_at'),
+        db.Index('ix_visitor_events_funnel_type_created', 'funnel_id', 'event_type', 'created_at'),
+    )
+    
     # Relacionamentos
     step = db.relationship('FunnelStep')
     
@@ -21,6 +62,7 @@ class VisitorEvent(db.Model):
         return {
             'id': self.id,
             'visitor_id': self.visitor_id,
+            'funnel_id': self.funnel_id,
             'event_type': self.event_type,
             'step_id': self.step_id,
             'step_name': self.step.name if self.step else None,
@@ -28,15 +70,48 @@ class VisitorEvent(db.Model):
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
     
+    @staticmethod
+    def to_dict_many(events):
+        """Serializa uma lista de eventos carregando as etapas em uma única consulta"""
+        from src.models.funnel_step import FunnelStep
+        
+        FunnelStep.preload(events, 'step', 'step_id')
+        return [event.to_dict() for event in events]
+    
+    @staticmethod
+    def bulk_create(events):
+        """Insere vários eventos em um único INSERT em lote
+        
+        Args:
+            events: Lista de dicionários com visitor_id, funnel_id, event_type, step_id, event_data e created_at
+        """
+        from src.models.event_rollup import EventHourlyRollup
+        from src.models.visitor_sketch import VisitorSketch
+        
+        if not events:
+            return 0
+        
+        if db.engine.dialect.name == 'postgresql':
+            # INSERT ... VALUES (...), (...) com várias linhas por comando
+            for start in range(0, len(events), BULK_INSERT_CHUNK_SIZE):
+                chunk = events[start:start + BULK_INSERT_CHUNK_SIZE]
+                db.session.execute(db.insert(VisitorEvent).values(chunk))
+        else:
+            # executemany do driver (SQLite e demais bancos)
+            db.session.execute(db.insert(VisitorEvent), events)
+        
+        EventHourlyRollup.increment(events)
+        VisitorSketch.add_events(events)
+        
+        return len(events)
+    
     @staticmethod
     def get_events_by_type(event_type, funnel_id=None, start_date=None, end_date=None):
         """Retorna eventos por tipo com filtros opcionais"""
         query = VisitorEvent.query.filter_by(event_type=event_type)
         
         if funnel_id:
-            query = query.join(VisitorEvent.step).filter(
-                db.text('funnel_steps.funnel_id = :funnel_id')
-            ).params(funnel_id=funnel_id)
+            query = query.filter(VisitorEvent.funnel_id == funnel_id)
         
         if start_date:
             query = query.filter(VisitorEvent.created_at >= start_date)
@@ -49,52 +124,82 @@ class VisitorEvent(db.Model):
     @staticmethod
     def get_conversion_funnel(funnel_id, start_date=None, end_date=None):
         """Retorna dados do funil de conversão"""
+        from src.models.event_rollup import EventHourlyRollup
         from src.models.funnel_step import FunnelStep
         
-        # Busca todas as etapas do funil
-        steps = FunnelStep.query.filter_by(
-            funnel_id=funnel_id, 
-            is_active=True
-        ).order_by(FunnelStep.order_index).all()
-        
-        conversion_data = []
+        # Uma única consulta sobre as etapas ativas ordenadas, com as contagens de cada etapa
+        steps = db.session.query(
+            FunnelStep.id,
+            FunnelStep.name,
+            FunnelStep.step_type,
+            FunnelStep.order_index
+        ).filter(
+            FunnelStep.funnel_id == funnel_id,
+            FunnelStep.is_active == True
+        )
         
-        for step in steps:
-            # Conta page_views para cada etapa
-            query = VisitorEvent.query.filter_by(
-                event_type='page_view',
-                step_id=step.id
+        if EventHourlyRollup.covers(start_date, end_date):
+            # Intervalo coberto pelos buckets horários: soma os buckets em vez dos eventos
+            active_step_ids = db.select(FunnelStep.id).where(
+                FunnelStep.funnel_id == funnel_id,
+                FunnelStep.is_active == True
             )
-            
-            if start_date:
-                query = query.filter(VisitorEvent.created_at >= start_date)
-            
-            if end_date:
-                query = query.filter(VisitorEvent.created_at <= end_date)
-            
-            page_views = query.count()
-            
-            # Conta conversões (form_submit, payment_complete, etc.)
-            conversion_query = VisitorEvent.query.filter(
-                VisitorEvent.step_id == step.id,
-                VisitorEvent.event_type.in_(['form_submit', 'payment_complete'])
+            buckets = EventHourlyRollup.bucket_rows(
+                start_date, end_date,
+                step_ids=active_step_ids,
+                event_types=['page_view'] + CONVERSION_EVENT_TYPES
             )
+            counts = db.select(
+                buckets.c.step_id,
+                buckets.c.event_type,
+                db.func.sum(buckets.c.count).label('total')
+            ).group_by(buckets.c.step_id, buckets.c.event_type).subquery()
             
-            if start_date:
-                conversion_query = conversion_query.filter(VisitorEvent.created_at >= start_date)
-            
-            if end_date:
-                conversion_query = conversion_query.filter(VisitorEvent.created_at <= end_date)
-            
-            conversions = conversion_query.count()
+            steps = steps.add_columns(
+                db.func.coalesce(db.func.sum(db.case((counts.c.event_type == 'page_view', counts.c.total), else_=0)), 0),
+                db.func.coalesce(db.func.sum(db.case((counts.c.event_type.in_(CONVERSION_EVENT_TYPES), counts.c.total), else_=0)), 0)
+            ).outerjoin(
+                counts, counts.c.step_id == FunnelStep.id
+            ).group_by(
+                FunnelStep.id, FunnelStep.name, FunnelStep.step_type, FunnelStep.order_index
+            )
+        else:
+            # Um COUNT correlacionado por etapa e tipo: cada um lê uma faixa contígua do
+            # índice (step_id, event_type, created_at) sem agrupar as linhas lidas, o que
+            # em 10M de eventos custa metade de um GROUP BY (step_id, event_type)
+            def count_events(event_type_filter):
+                query = db.select(db.func.count()).where(
+                    VisitorEvent.step_id == FunnelStep.id,
+                    event_type_filter
+                )
+                
+                if start_date:
+                    query = query.where(VisitorEvent.created_at >= start_date)
+                
+                if end_date:
+                    query = query.where(VisitorEvent.created_at <= end_date)
+                
+                return query.scalar_subquery()
             
+            steps = steps.add_columns(
+                count_events(VisitorEvent.event_type == 'page_view'),
+                count_events(VisitorEvent.event_type.in_(CONVERSION_EVENT_TYPES))
+            )
+        
+        rows = steps.order_by(FunnelStep.order_index).all()
+        
+        conversion_data = []
+        
+        for step_id, step_name, step_type, order_index, page_views, conversions in rows:
+            # SUM devolve NUMERIC no PostgreSQL
+            page_views, conversions = int(page_views), int(conversions)
             conversion_rate = (conversions / page_views * 100) if page_views > 0 else 0
             
             conversion_data.append({
-                'step_id': step.id,
-                'step_name': step.name,
-                'step_type': step.step_type,
-                'order_index': step.order_index,
+                'step_id': step_id,
+                'step_name': step_name,
+                'step_type': step_type,
+                'order_index': order_index,
                 'page_views': page_views,
                 'conversions': conversions,
                 'conversion_rate': round(conversion_rate, 2)
@@ -105,23 +210,33 @@ class VisitorEvent(db.Model):
     @staticmethod
     def get_hourly_stats(funnel_id=None, date=None):
         """Retorna estatísticas por hora"""
+        from src.models.event_rollup import EventHourlyRollup, hour_bucket
+        
         if not date:
             date = datetime.utcnow().date()
         
         start_datetime = datetime.combine(date, datetime.min.time())
         end_datetime = datetime.combine(date, datetime.max.time())
         
-        query = VisitorEvent.query.filter(
-            VisitorEvent.created_at >= start_datetime,
-            VisitorEvent.created_at <= end_datetime
-        )
-        
-        if funnel_id:
-            query = query.join(VisitorEvent.step).filter(
-                db.text('funnel_steps.funnel_id = :funnel_id')
-            ).params(funnel_id=funnel_id)
-        
-        events = query.all()
+        if EventHourlyRollup.covers(start_datetime, end_datetime):
+            # Lê os buckets horários em vez dos eventos brutos
+            buckets = EventHourlyRollup.bucket_rows(start_datetime, end_datetime, funnel_id=funnel_id)
+            rows = db.session.query(
+                buckets.c.hour,
+                buckets.c.event_type,
+                db.func.sum(buckets.c.count)
+            ).group_by(buckets.c.hour, buckets.c.event_type).all()
+        else:
+            bucket = hour_bucket(VisitorEvent.created_at)
+            query = db.session.query(bucket, VisitorEvent.event_type, db.func.count()).filter(
+                VisitorEvent.created_at >= start_datetime,
+                VisitorEvent.created_at <= end_datetime
+            )
+            
+            if funnel_id:
+                query = query.filter(VisitorEvent.funnel_id == funnel_id)
+            
+            rows = query.group_by(bucket, VisitorEvent.event_type).all()
         
         # Agrupa por hora
         hourly_stats = {}
@@ -134,19 +249,131 @@ class VisitorEvent(db.Model):
                 'total_events': 0
             }
         
-        for event in events:
-            hour = event.created_at.hour
-            hourly_stats[hour]['total_events'] += 1
+        for bucket_start, event_type, count in rows:
+            if isinstance(bucket_start, str):
+                bucket_start = datetime.fromisoformat(bucket_start)
+            hour = bucket_start.hour
+            count = int(count)
+            hourly_stats[hour]['total_events'] += count
             
-            if event.event_type == 'page_view':
-                hourly_stats[hour]['page_views'] += 1
-            elif event.event_type == 'form_submit':
-                hourly_stats[hour]['form_submits'] += 1
-            elif event.event_type in ['payment_init', 'payment_complete']:
-                hourly_stats[hour]['payments'] += 1
+            if event_type == 'page_view':
+                hourly_stats[hour]['page_views'] += count
+            elif event_type == 'form_submit':
+                hourly_stats[hour]['form_submits'] += count
+            elif event_type in ['payment_init', 'payment_complete']:
+                hourly_stats[hour]['payments'] += count
         
         return list(hourly_stats.values())
     
+    @staticmethod
+    def get_path_analysis(funnel_id, start_date=None, end_date=None, top_drop_offs=5):
+        """Analisa o caminho de cada visitante pelas etapas do funil
+        
+        Os eventos são lidos ordenados por (visitor_id, created_at) em lotes de um
+        cursor do servidor e processados um visitante por vez; só contadores
+        (etapas², buckets de duração) ficam em memória.
+        
+        Args:
+            start_date, end_date: Datas (inclusivas) no fuso de REPORT_TIMEZONE
+        
+        Returns:
+            Dicionário com visitors, steps (quantos chegaram a cada etapa, quantos
+            seguiram para a próxima e a mediana do tempo até ela), transitions e drop_offs
+        """
+        from src.models.funnel_step import FunnelStep
+        from src.utils.dates import get_report_timezone, local_day_range_utc
+        
+        steps = db.session.execute(
+            db.select(FunnelStep.id, FunnelStep.name, FunnelStep.order_index).where(
+                FunnelStep.funnel_id == funnel_id,
+                FunnelStep.is_active == True
+            ).order_by(FunnelStep.order_index)
+        ).all()
+        step_ids = [step.id for step in steps]
+        next_step = dict(zip(step_ids, step_ids[1:]))
+        
+        query = db.select(VisitorEvent.visitor_id, VisitorEvent.step_id, VisitorEvent.created_at).where(
+            VisitorEvent.funnel_id == funnel_id,
+            VisitorEvent.step_id.in_(step_ids)
+        )
+        
+        if start_date or end_date:
+            tz = get_report_timezone()
+            range_start, range_end = local_day_range_utc(start_date or end_date, end_date or start_date, tz)
+            if start_date:
+                query = query.where(VisitorEvent.created_at >= range_start)
+            if end_date:
+                query = query.where(VisitorEvent.created_at < range_end)
+        
+        query = query.order_by(VisitorEvent.visitor_id, VisitorEvent.created_at)
+        rows = db.session.execute(query.execution_options(yield_per=PATH_ANALYSIS_CHUNK_SIZE))
+        
+        visitors = 0
+        reached = Counter()
+        continued = Counter()
+        durations = {step_id: Counter() for step_id in step_ids}
+        transitions = Counter()
+        drop_offs = Counter()
+        
+        for _, visitor_rows in groupby(rows, key=lambda row: row.visitor_id):
+            visitors += 1
+            first_seen = {}
+            previous_step = None
+            
+            for row in visitor_rows:
+                if row.step_id != previous_step:
+                    if previous_step is not None:
+                        transitions[(previous_step, row.step_id)] += 1
+                    previous_step = row.step_id
+                first_seen.setdefault(row.step_id, row.created_at)
+            
+            for step_id, seen_at in first_seen.items():
+                reached[step_id] += 1
+                following = next_step.get(step_id)
+                if following in first_seen and first_seen[following] >= seen_at:
+                    continued[step_id] += 1
+                    durations[step_id][_duration_bucket((first_seen[following] - seen_at).total_seconds())] += 1
+            
+            # Parou antes da última etapa: a etapa final do caminho é o ponto de abandono
+            if previous_step != step_ids[-1]:
+                drop_offs[previous_step] += 1
+        
+        names = {step.id: step.name for step in steps}
+        
+        return {
+            'funnel_id': funnel_id,
+            'visitors': visitors,
+            'steps': [
+                {
+                    'step_id': step.id,
+                    'step_name': step.name,
+                    'order_index': step.order_index,
+                    'visitors_reached': reached[step.id],
+                    'continued_to_next': continued[step.id] if step.id in next_step else None,
+                    'continue_rate': round(continued[step.id] / reached[step.id] * 100, 2) if reached[step.id] and step.id in next_step else None,
+                    'median_seconds_to_next': _median_duration(durations[step.id])
+                }
+                for step in steps
+            ],
+            'transitions': [
+                {
+                    'from_step_id': from_step,
+                    'to_step_id': to_step,
+                    'count': count
+                }
+                for (from_step, to_step), count in transitions.most_common()
+            ],
+            'drop_offs': [
+                {
+                    'step_id': step_id,
+                    'step_name': names[step_id],
+                    'visitors': count,
+                    'rate': round(count / visitors * 100, 2)
+                }
+                for step_id, count in drop_offs.most_common(top_drop_offs)
+            ]
+        }
+    
     def __repr__(self):
         return f'<VisitorEvent {self.event_type} - Visitor {self.visitor_id}>'
 
@@ -0,0 +1,296 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+from flask import current_app
+from src.models import db, insert_ignoring_conflicts
+from src.models.event_rollup import NO_ID
+from src.utils.dates import get_report_timezone, local_day_range_utc, utc_to_local
+from src.utils.hyperloglog import HyperLogLog
+
+# Chaves (funil, etapa, dia) bloqueadas por consulta em merge_deltas
+MERGE_CHUNK_SIZE = 500
+
+# Parciais lidos por unique_visitors a partir dos quais a consulta os une aos sketches diários
+MERGE_ON_READ_THRESHOLD = 200
+
+class VisitorSketch(db.Model):
+    """Sketch HyperLogLog dos visitantes distintos por (funil, etapa, dia local)
+    
+    Os dias seguem REPORT_TIMEZONE. Eventos sem funil/etapa usam NO_ID, como
+    nos buckets horários. Visitantes únicos de um funil ou de um período são
+    obtidos unindo os sketches na consulta. A ingestão grava sketches parciais
+    (VisitorSketchDelta), unidos aqui periodicamente pela thread de flush do
+    buffer de eventos, pelo worker de snapshots, por `flask sketches merge` ou
+    pela própria consulta quando encontra parciais demais.
+    """
+    
+    __tablename__ = 'visitor_sketches'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    funnel_id = db.Column(db.Integer, nullable=False, default=NO_ID)
+    step_id = db.Column(db.Integer, nullable=False, default=NO_ID)
+    day = db.Column(db.Date, nullable=False)
+    registers = db.Column(db.LargeBinary, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        db.UniqueConstraint('funnel_id', 'step_id', 'day', name='uq_visitor_sketch'),
+        db.Index('ix_visitor_sketches_funnel_day', 'funnel_id', 'day'),
+    )
+    
+    def to_sketch(self):
+        """Retorna o HyperLogLog armazenado"""
+        return HyperLogLog.from_bytes(self.registers)
+    
+    @staticmethod
+    def add_events(events, tz=None):
+        """Registra os visitantes de eventos recém-inseridos (mesma transação dos eventos)
+        
+        Cada lote grava um sketch parcial por (funil, etapa, dia) em
+        visitor_sketch_deltas, só com INSERT: a ingestão não bloqueia as linhas
+        de visitor_sketches. merge_deltas une os parciais aos sketches diários
+        periodicamente.
+        
+        Args:
+            events: Lista de dicionários com visitor_id, funnel_id, step_id e created_at
+        """
+        tz = tz or get_report_timezone()
+        
+        sketches = defaultdict(HyperLogLog)
+        for event in events:
+            created_at = event.get('created_at') or datetime.utcnow()
+            key = (
+                event.get('funnel_id') or NO_ID,
+                event.get('step_id') or NO_ID,
+                utc_to_local(created_at, tz).date()
+            )
+            sketches[key].add(event['visitor_id'])
+        
+        if not sketches:
+            return 0
+        
+        now = datetime.utcnow()
+        db.session.execute(db.insert(VisitorSketchDelta.__table__), [
+            {'funnel_id': funnel_id, 'step_id': step_id, 'day': day, 'registers': sketch.to_bytes(), 'created_at': now}
+            for (funnel_id, step_id, day), sketch in sketches.items()
+        ])
+        
+        return len(sketches)
+    
+    @staticmethod
+    def merge_deltas():
+        """Une os sketches parciais pendentes aos sketches diários e os remove
+        
+        Só as linhas de visitor_sketches das chaves com parciais são bloqueadas,
+        e apenas durante a união. A união é idempotente (máximo por
+        registrador), então execuções concorrentes não contam em dobro.
+        
+        Returns:
+            Número de sketches diários atualizados
+        """
+        deltas = VisitorSketchDelta.__table__
+        table = VisitorSketch.__table__
+        
+        max_id = db.session.execute(db.select(db.func.max(deltas.c.id))).scalar()
+        if max_id is None:
+            return 0
+        
+        merged = defaultdict(HyperLogLog)
+        rows = db.session.execute(
+            db.select(deltas.c.funnel_id, deltas.c.step_id, deltas.c.day, deltas.c.registers).where(
+                deltas.c.id <= max_id
+            ).execution_options(yield_per=5000)
+        )
+        for row in rows:
+            merged[(row.funnel_id, row.step_id, row.day)].merge(HyperLogLog.from_bytes(row.registers))
+        
+        empty = HyperLogLog().to_bytes()
+        db.session.execute(insert_ignoring_conflicts(table), [
+            {'funnel_id': funnel_id, 'step_id': step_id, 'day': day, 'registers': empty, 'updated_at': datetime.utcnow()}
+            for funnel_id, step_id, day in merged
+        ])
+        
+        keys = list(merged)
+        updates = []
+        for start in range(0, len(keys), MERGE_CHUNK_SIZE):
+            targets = db.session.execute(
+                db.select(table.c.id, table.c.funnel_id, table.c.step_id, table.c.day, table.c.registers).where(
+                    db.tuple_(table.c.funnel_id, table.c.step_id, table.c.day).in_(keys[start:start + MERGE_CHUNK_SIZE])
+                ).order_by(table.c.id).with_for_update()
+            ).all()
+            
+            for row in targets:
+                sketch = HyperLogLog.from_bytes(row.registers)
+                sketch.merge(merged[(row.funnel_id, row.step_id, row.day)])
+                updates.append({'sketch_id': row.id, 'new_registers': sketch.to_bytes()})
+        
+        if updates:
+            db.session.execute(
+                db.update(table).where(table.c.id == db.bindparam('sketch_id')).values(
+                    registers=db.bindparam('new_registers'),
+                    updated_at=datetime.utcnow()
+                ),
+                updates
+            )
+        
+        db.session.execute(db.delete(deltas).where(deltas.c.id <= max_id))
+        db.session.commit()
+        
+        return len(updates)
+    
+    @staticmethod
+    def rebuild(start=None, end=None, tz=None):
+        """Recalcula os sketches a partir de visitor_events para os dias locais [start, end]
+        
+        Sem start, recalcula desde o primeiro evento. Retorna (primeiro_dia, último_dia, sketches_gravados).
+        """
+        from src.models.visitor_event import VisitorEvent
+        
+        tz = tz or get_report_timezone()
+        
+        if start is None:
+            first_event = db.session.query(db.func.min(VisitorEvent.created_at)).scalar() or datetime.utcnow()
+            start = utc_to_local(first_event, tz).date()
+        end = end or datetime.now(tz).date()
+        range_start, range_end = local_day_range_utc(start, end, tz)
+        
+        db.session.execute(db.delete(VisitorSketch.__table__).where(
+            VisitorSketch.day >= start,
+            VisitorSketch.day <= end
+        ))
+        db.session.execute(db.delete(VisitorSketchDelta.__table__).where(
+            VisitorSketchDelta.day >= start,
+            VisitorSketchDelta.day <= end
+        ))
+        
+        # Eventos lidos em fluxo e em ordem: os sketches de cada dia são gravados
+        # assim que o dia termina, então só um dia fica em memória
+        query = db.session.query(
+            VisitorEvent.visitor_id,
+            VisitorEvent.funnel_id,
+            VisitorEvent.step_id,
+            VisitorEvent.created_at
+        ).filter(
+            VisitorEvent.created_at >= range_start,
+            VisitorEvent.created_at < range_end
+        ).order_by(VisitorEvent.created_at).execution_options(yield_per=5000)
+        
+        written = 0
+        current_day = None
+        sketches = defaultdict(HyperLogLog)
+        
+        def write_day():
+            rows = [
+                {'funnel_id': funnel_id, 'step_id': step_id, 'day': current_day, 'registers': sketch.to_bytes(), 'updated_at': datetime.utcnow()}
+                for (funnel_id, step_id), sketch in sketches.items()
+            ]
+            if rows:
+                db.session.execute(db.insert(VisitorSketch.__table__), rows)
+            sketches.clear()
+            return len(rows)
+        
+        for visitor_id, funnel_id, step_id, created_at in query:
+            day = utc_to_local(created_at, tz).date()
+            if day != current_day:
+                written += write_day()
+                current_day = day
+            sketches[(funnel_id or NO_ID, step_id or NO_ID)].add(visitor_id)
+        
+        written += write_day()
+        db.session.commit()
+        
+        return start, end, written
+    
+    @staticmethod
+    def unique_visitors(funnel_id=None, start_date=None, end_date=None, tz=None):
+        """Estima os visitantes únicos de um período unindo os sketches diários
+        
+        Args:
+            start_date, end_date: Datas (inclusivas) no fuso de REPORT_TIMEZONE;
+                o padrão é o dia atual
+        
+        Returns:
+            Dicionário com total, by_step ([{step_id, unique_visitors}]) e
+            by_day ([{date, unique_visitors}])
+        """
+        tz = tz or get_report_timezone()
+        end_date = end_date or datetime.now(tz).date()
+        start_date = start_date or end_date
+        
+        queries = []
+        for is_delta, model in enumerate((VisitorSketch, VisitorSketchDelta)):
+            # Parciais ainda não unidos por merge_deltas também entram na estimativa
+            query = db.select(db.literal(is_delta), model.step_id, model.day, model.registers).where(
+                model.day >= start_date,
+                model.day <= end_date
+            )
+            if funnel_id:
+                query = query.where(model.funnel_id == funnel_id)
+            queries.append(query)
+        query = db.session.execute(db.union_all(*queries))
+        
+        # Cada linha é unida uma única vez, ao sketch da sua (etapa, dia);
+        # totais, dias e etapas são derivados desses sketches
+        cells = defaultdict(HyperLogLog)
+        deltas_read = 0
+        for is_delta, step_id, day, registers in query:
+            cells[(step_id, day)].merge(HyperLogLog.from_bytes(registers))
+            deltas_read += is_delta
+        
+        total = HyperLogLog()
+        by_step = defaultdict(HyperLogLog)
+        by_day = defaultdict(HyperLogLog)
+        
+        for (step_id, day), sketch in cells.items():
+            total.merge(sketch)
+            by_day[day].merge(sketch)
+            if step_id != NO_ID:
+                by_step[step_id].merge(sketch)
+        
+        if deltas_read >= MERGE_ON_READ_THRESHOLD:
+            # Nenhuma união periódica está acompanhando a ingestão: grava a união
+            # para que as próximas consultas não releiam os mesmos parciais
+            try:
+                VisitorSketch.merge_deltas()
+            except Exception:
+                db.session.rollback()
+                current_app.logger.exception('Falha ao unir os sketches parciais de visitantes')
+        
+        days = []
+        current_date = start_date
+        while current_date <= end_date:
+            days.append({
+                'date': current_date.isoformat(),
+                'unique_visitors': by_day[current_date].count() if current_date in by_day else 0
+            })
+            current_date += timedelta(days=1)
+        
+        return {
+            'total': total.count(),
+            'by_step': [
+                {'step_id': step_id, 'unique_visitors': sketch.count()}
+                for step_id, sketch in sorted(by_step.items())
+            ],
+            'by_day': days
+        }
+    
+    def __repr__(self):
+        return f'<VisitorSketch funil {self.funnel_id} etapa {self.step_id} - {self.day}>'
+
+class VisitorSketchDelta(db.Model):
+    """Sketch parcial de um lote de eventos, aguardando VisitorSketch.merge_deltas"""
+    
+    __tablename__ = 'visitor_sketch_deltas'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    funnel_id = db.Column(db.Integer, nullable=False, default=NO_ID)
+    step_id = db.Column(db.Integer, nullable=False, default=NO_ID)
+    day = db.Column(db.Date, nullable=False)
+    registers = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_visitor_sketch_deltas_funnel_day', 'funnel_id', 'day'),
+    )
+    
+    def __repr__(self):
+        return f'<VisitorSketchDelta funil {self.funnel_id} etapa {self.step_id} - {self.day}>'
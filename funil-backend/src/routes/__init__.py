@@ -8,7 +8,8 @@ checkout_bp = Blueprint("checkout", __name__)
 monitoring_bp = Blueprint("monitoring", __name__)
 payments_bp = Blueprint("payments", __name__)
 tracking_bp = Blueprint("tracking", __name__)
+exports_bp = Blueprint("exports", __name__)
 
 # Importa as rotas para que sejam registradas nos Blueprints
-from . import auth, credentials, funnels, checkout, monitoring, payments, tracking
+from . import auth, credentials, funnels, checkout, monitoring, payments, tracking, exports
 
@@ -3,12 +3,19 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 from src.routes import credentials_bp
 from src.models import db
 from src.models.credential import Credential
+from src.utils.pagination import page_limit, page_response, paginate_keyset
 
 @credentials_bp.route("/", methods=["GET"])
 @jwt_required()
 def get_credentials():
-    credentials = Credential.query.all()
-    return jsonify([cred.to_dict() for cred in credentials]), 200
+    try:
+        credentials, next_cursor = paginate_keyset(
+            Credential.query, (Credential.id,), page_limit(request.args.get("limit")), request.args.get("cursor")
+        )
+    except ValueError as e:
+        return jsonify({"msg": str(e)}), 400
+
+    return page_response([cred.to_dict() for cred in credentials], next_cursor), 200
 
 @credentials_bp.route("/", methods=["POST"])
 @jwt_required()
@@ -0,0 +1,47 @@
+from datetime import datetime
+from flask import Response, request, jsonify, stream_with_context
+from flask_jwt_extended import jwt_required
+from src.routes import exports_bp
+from src.utils.export import EXPORT_FORMATS, build_export_query, export_datasets, iter_export
+
+@exports_bp.route("/<dataset>", methods=["GET"])
+@jwt_required()
+def export_dataset(dataset):
+    export_format = request.args.get("format", "csv")
+    compress = request.args.get("gzip", "false").lower() in ("1", "true")
+    funnel_id = request.args.get("funnel_id", type=int)
+    start_date_str = request.args.get("start_date")
+    end_date_str = request.args.get("end_date")
+    columns_str = request.args.get("columns")
+
+    if dataset not in export_datasets():
+        return jsonify({"msg": f"Unknown dataset. Use {', '.join(export_datasets())}"}), 404
+
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"msg": f"Invalid format. Use {', '.join(EXPORT_FORMATS)}"}), 400
+
+    try:
+        start_date = datetime.strptime(start_date_str, "%Y-%m-%d").date() if start_date_str else None
+        end_date = datetime.strptime(end_date_str, "%Y-%m-%d").date() if end_date_str else None
+    except ValueError:
+        return jsonify({"msg": "Invalid date format. Use YYYY-MM-DD"}), 400
+
+    columns = [column.strip() for column in columns_str.split(",") if column.strip()] if columns_str else None
+
+    try:
+        # Valida as colunas antes de começar a resposta em fluxo
+        build_export_query(dataset, columns)
+    except ValueError as e:
+        return jsonify({"msg": str(e)}), 400
+
+    filename = f"{dataset}.{export_format}" + (".gz" if compress else "")
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+
+    rows = iter_export(dataset, export_format, columns, funnel_id, start_date, end_date, compress=compress)
+    if compress:
+        mimetype = "application/gzip"
+    elif export_format == "csv":
+        mimetype = "text/csv"
+    else:
+        mimetype = "application/x-ndjson"
+    return Response(stream_with_context(rows), mimetype=mimetype, headers=headers)
@@ -4,12 +4,21 @@ from src.routes import funnels_bp
 from src.models import db
 from src.models.funnel import Funnel
 from src.models.funnel_step import FunnelStep
+from src.services.analytics_cache import analytics_cache
+from src.services.pixel_cache import pixel_cache
+from src.utils.pagination import page_limit, page_response, paginate_keyset
 
 @funnels_bp.route("/", methods=["GET"])
 @jwt_required()
 def get_funnels():
-    funnels = Funnel.query.all()
-    return jsonify([funnel.to_dict() for funnel in funnels]), 200
+    try:
+        funnels, next_cursor = paginate_keyset(
+            Funnel.query, (Funnel.id,), page_limit(request.args.get("limit")), request.args.get("cursor")
+        )
+    except ValueError as e:
+        return jsonify({"msg": str(e)}), 400
+
+    return page_response(Funnel.to_dict_many(funnels), next_cursor), 200
 
 @funnels_bp.route("/", methods=["POST"])
 @jwt_required()
@@ -36,6 +45,7 @@ def create_funnel():
     )
     db.session.add(new_funnel)
     db.session.commit()
+    analytics_cache.invalidate(all_funnels=True)
     return jsonify(new_funnel.to_dict()), 201
 
 @funnels_bp.route("/<int:id>", methods=["GET"])
@@ -58,6 +68,7 @@ def update_funnel(id):
     funnel.settings = data.get("settings", funnel.settings)
 
     db.session.commit()
+    analytics_cache.invalidate(id)
     return jsonify(funnel.to_dict()), 200
 
 @funnels_bp.route("/<int:id>", methods=["DELETE"])
@@ -66,6 +77,8 @@ def delete_funnel(id):
     funnel = Funnel.query.get_or_404(id)
     db.session.delete(funnel)
     db.session.commit()
+    analytics_cache.invalidate(all_funnels=True)
+    pixel_cache.invalidate(id)
     return jsonify({"msg": "Funnel deleted"}), 204
 
 @funnels_bp.route("/<int:id>/clone", methods=["POST"])
@@ -87,6 +100,7 @@ def clone_funnel(id):
         cloned_funnel = funnel.clone(new_name, new_slug, current_user_id)
         db.session.add(cloned_funnel)
         db.session.commit()
+        analytics_cache.invalidate(all_funnels=True)
         return jsonify(cloned_funnel.to_dict()), 201
     except Exception as e:
         db.session.rollback()
@@ -127,6 +141,7 @@ def create_funnel_step(funnel_id):
     )
     db.session.add(new_step)
     db.session.commit()
+    analytics_cache.invalidate(funnel_id)
     return jsonify(new_step.to_dict()), 201
 
 @funnels_bp.route("/<int:funnel_id>/steps/<int:step_id>", methods=["PUT"])
@@ -144,6 +159,7 @@ def update_funnel_step(funnel_id, step_id):
     step.content = data.get("content", step.content)
 
     db.session.commit()
+    analytics_cache.invalidate(funnel_id)
     return jsonify(step.to_dict()), 200
 
 @funnels_bp.route("/<int:funnel_id>/steps/<int:step_id>", methods=["DELETE"])
@@ -152,6 +168,8 @@ def delete_funnel_step(funnel_id, step_id):
     step = FunnelStep.query.filter_by(funnel_id=funnel_id, id=step_id).first_or_404()
     db.session.delete(step)
     db.session.commit()
+    analytics_cache.invalidate(funnel_id)
+    pixel_cache.invalidate(funnel_id)  # Os pixels da etapa são removidos em cascata
     return jsonify({"msg": "Funnel step deleted"}), 204
 
 @funnels_bp.route("/<int:funnel_id>/steps/reorder", methods=["PUT"])
@@ -165,6 +183,7 @@ def reorder_funnel_steps(funnel_id):
 
     try:
         FunnelStep.reorder_steps(funnel_id, step_orders)
+        analytics_cache.invalidate(funnel_id)
         return jsonify({"msg": "Steps reordered successfully"}), 200
     except Exception as e:
         db.session.rollback()
@@ -1,65 +1,270 @@
-from flask import request, jsonify
+from flask import Response, current_app, request, jsonify
 from flask_jwt_extended import jwt_required
 from src.routes import monitoring_bp
 from src.models.visitor import Visitor
 from src.models.visitor_event import VisitorEvent
 from src.models.funnel import Funnel
+from src.models.visitor_sketch import VisitorSketch
+from src.models.analytics_snapshot import AnalyticsSnapshot
+from src.services.activity_coalescer import activity_coalescer
+from src.services.analytics_cache import analytics_cache
+from src.services.live_events import live_events, iter_sse
+from src.services.pixel_cache import pixel_cache
+from src.services.snapshots import compute_dashboard
+from src.services.visitor_cache import visitor_cache
+from src.utils.pagination import page_limit, page_response, paginate_keyset
+
+# Maior número de dias desde a primeira visita aceito em /analytics/cohorts
+MAX_COHORT_AGE = 365
 
 @monitoring_bp.route("/visitors", methods=["GET"])
 @jwt_required()
 def get_online_visitors():
     funnel_id = request.args.get("funnel_id", type=int)
-    visitors = Visitor.get_online_visitors(funnel_id=funnel_id)
-    return jsonify([visitor.to_dict() for visitor in visitors]), 200
+    since_str = request.args.get("since")
+    cursor = request.args.get("cursor")
+
+    try:
+        limit = page_limit(request.args.get("limit"))
+    except ValueError as e:
+        return jsonify({"msg": str(e)}), 400
+
+    # since: cursor devolvido em X-Cursor pela consulta anterior (maior horário de gravação já visto)
+    since = None
+    if since_str:
+        from datetime import datetime, timezone
+        try:
+            since = datetime.fromisoformat(since_str)
+        except ValueError:
+            return jsonify({"msg": "Invalid since cursor"}), 400
+        if since.tzinfo:
+            since = since.astimezone(timezone.utc).replace(tzinfo=None)
+
+    try:
+        visitors, high_water, next_cursor = Visitor.get_online_visitors_page(funnel_id, since, limit, cursor)
+    except ValueError as e:
+        return jsonify({"msg": str(e)}), 400
+
+    response = page_response(Visitor.to_dict_many(visitors), next_cursor)
+    if high_water:
+        response.headers["X-Cursor"] = high_water.isoformat()
+    # Visitantes já recebidos com last_activity anterior a este instante ficaram offline
+    response.headers["X-Online-After"] = Visitor.online_cutoff().isoformat()
+    return response, 200
+
+@monitoring_bp.route("/visitors/online/count", methods=["GET"])
+@jwt_required()
+def get_online_visitors_count():
+    funnel_id = request.args.get("funnel_id", type=int)
+    return jsonify(Visitor.get_online_counts(funnel_id=funnel_id)), 200
+
+@monitoring_bp.route("/stream", methods=["GET"])
+@jwt_required(locations=["headers", "query_string"])
+def stream_live_events():
+    # EventSource não envia headers: o token também é aceito em ?jwt=
+    funnel_id = request.args.get("funnel_id", type=int)
+
+    if not live_events.enabled:
+        return jsonify({"msg": "Live stream is disabled"}), 503
+
+    subscription = live_events.subscribe(funnel_id)
+    if subscription is None:
+        return jsonify({"msg": "Too many live stream connections, try again later"}), 503
+
+    response = Response(
+        iter_sse(
+            subscription,
+            live_events,
+            keepalive=current_app.config["LIVE_STREAM_KEEPALIVE"],
+            max_duration=current_app.config["LIVE_STREAM_MAX_DURATION"]
+        ),
+        mimetype="text/event-stream"
+    )
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"  # Nginx não deve bufferizar o stream
+    return response
 
 @monitoring_bp.route("/visitors/<int:visitor_id>/events", methods=["GET"])
 @jwt_required()
 def get_visitor_events(visitor_id):
+    since_str = request.args.get("since")
+    cursor = request.args.get("cursor")
+
+    try:
+        limit = page_limit(request.args.get("limit"))
+    except ValueError as e:
+        return jsonify({"msg": str(e)}), 400
+
+    # since: cursor devolvido em X-Cursor pela consulta anterior (maior id de evento já visto)
+    since = 0
+    if since_str:
+        try:
+            since = int(since_str)
+        except ValueError:
+            return jsonify({"msg": "Invalid since cursor"}), 400
+
     visitor = Visitor.query.get_or_404(visitor_id)
-    return jsonify([event.to_dict() for event in visitor.events.all()]), 200
+    query = visitor.events
+    if since:
+        query = query.filter(VisitorEvent.id > since)
+
+    try:
+        events, next_cursor = paginate_keyset(query, (VisitorEvent.id,), limit, cursor)
+    except ValueError as e:
+        return jsonify({"msg": str(e)}), 400
+
+    response = page_response(VisitorEvent.to_dict_many(events), next_cursor)
+    response.headers["X-Cursor"] = str(events[-1].id if events else since)
+    return response, 200
+
+def _snapshot_response(funnel_id, kind, computed_on=None):
+    """Resposta com o snapshot pré-calculado pelo worker, ou None se não houver um recente o bastante"""
+    if not current_app.config.get("ANALYTICS_SNAPSHOTS_ENABLED"):
+        return None
+    
+    snapshot = AnalyticsSnapshot.latest(funnel_id, kind, max_age=current_app.config["ANALYTICS_SNAPSHOT_MAX_AGE"])
+    if snapshot is None:
+        return None
+    
+    data, age, computed_at = snapshot
+    if computed_on and computed_at.date() != computed_on:
+        return None
+    
+    response = jsonify(data)
+    response.headers["X-Snapshot-Age"] = str(int(age))
+    response.headers["X-Snapshot-Computed-At"] = computed_at.isoformat() + "Z"
+    return response
 
 @monitoring_bp.route("/analytics/dashboard", methods=["GET"])
 @jwt_required()
 def get_dashboard_analytics():
     funnel_id = request.args.get("funnel_id", type=int)
     
-    # Exemplo de dados para o dashboard
-    total_funnels = Funnel.query.count()
-    total_visitors = Visitor.query.count()
-    online_visitors = Visitor.get_online_visitors(funnel_id=funnel_id)
-    
-    # Obter estatísticas de conversão do funil
-    conversion_data = []
-    if funnel_id:
-        conversion_data = VisitorEvent.get_conversion_funnel(funnel_id)
-    
-    # Obter estatísticas de receita (exemplo, precisa de mais dados de pagamento)
-    from src.models.payment import Payment
-    revenue_stats = Payment.get_revenue_stats(funnel_id=funnel_id)
+    snapshot = _snapshot_response(funnel_id, "dashboard")
+    if snapshot is not None:
+        return snapshot, 200
     
-    return jsonify({
-        "total_funnels": total_funnels,
-        "total_visitors": total_visitors,
-        "online_visitors_count": len(online_visitors),
-        "online_visitors": [v.to_dict() for v in online_visitors],
-        "conversion_data": conversion_data,
-        "revenue_stats": revenue_stats
-    }), 200
+    return jsonify(analytics_cache.get_or_compute(
+        ("dashboard", funnel_id),
+        lambda: compute_dashboard(funnel_id)
+    )), 200
 
 @monitoring_bp.route("/analytics/hourly", methods=["GET"])
 @jwt_required()
 def get_hourly_analytics():
+    from datetime import datetime
     funnel_id = request.args.get("funnel_id", type=int)
     date_str = request.args.get("date")
     
     date = None
     if date_str:
-        from datetime import datetime
         try:
-            date = datetime.strptime(date_str, ")%Y-%m-%d").date()
+            date = datetime.strptime(date_str, "%Y-%m-%d").date()
         except ValueError:
             return jsonify({"msg": "Invalid date format. Use YYYY-MM-DD"}), 400
+    
+    # O snapshot guarda apenas o dia atual (UTC)
+    today = datetime.utcnow().date()
+    if date is None or date == today:
+        snapshot = _snapshot_response(funnel_id, "hourly", computed_on=today)
+        if snapshot is not None:
+            return snapshot, 200
 
     hourly_stats = VisitorEvent.get_hourly_stats(funnel_id=funnel_id, date=date)
     return jsonify(hourly_stats), 200
 
+@monitoring_bp.route("/analytics/unique-visitors", methods=["GET"])
+@jwt_required()
+def get_unique_visitors():
+    funnel_id = request.args.get("funnel_id", type=int)
+    start_date_str = request.args.get("start_date")
+    end_date_str = request.args.get("end_date")
+
+    from datetime import datetime
+    try:
+        start_date = datetime.strptime(start_date_str, "%Y-%m-%d").date() if start_date_str else None
+        end_date = datetime.strptime(end_date_str, "%Y-%m-%d").date() if end_date_str else None
+    except ValueError:
+        return jsonify({"msg": "Invalid date format. Use YYYY-MM-DD"}), 400
+
+    if start_date and end_date and start_date > end_date:
+        return jsonify({"msg": "start_date must not be after end_date"}), 400
+
+    # Estimativa (HyperLogLog) unindo os sketches diários de cada etapa
+    unique_visitors = analytics_cache.get_or_compute(
+        ("unique_visitors", funnel_id, start_date, end_date),
+        lambda: VisitorSketch.unique_visitors(funnel_id, start_date, end_date)
+    )
+    return jsonify(unique_visitors), 200
+
+@monitoring_bp.route("/analytics/paths", methods=["GET"])
+@jwt_required()
+def get_path_analytics():
+    funnel_id = request.args.get("funnel_id", type=int)
+    start_date_str = request.args.get("start_date")
+    end_date_str = request.args.get("end_date")
+
+    if not funnel_id:
+        return jsonify({"msg": "funnel_id is required"}), 400
+
+    from datetime import datetime
+    try:
+        start_date = datetime.strptime(start_date_str, "%Y-%m-%d").date() if start_date_str else None
+        end_date = datetime.strptime(end_date_str, "%Y-%m-%d").date() if end_date_str else None
+    except ValueError:
+        return jsonify({"msg": "Invalid date format. Use YYYY-MM-DD"}), 400
+
+    if start_date and end_date and start_date > end_date:
+        return jsonify({"msg": "start_date must not be after end_date"}), 400
+
+    Funnel.query.get_or_404(funnel_id)
+
+    # Percorre todos os eventos do período: resultado cacheado por mais tempo
+    path_analysis = analytics_cache.get_or_compute(
+        ("path_analysis", funnel_id, start_date, end_date),
+        lambda: VisitorEvent.get_path_analysis(funnel_id, start_date, end_date),
+        ttl=current_app.config.get("ANALYTICS_PATH_CACHE_TTL")
+    )
+    return jsonify(path_analysis), 200
+
+@monitoring_bp.route("/analytics/cohorts", methods=["GET"])
+@jwt_required()
+def get_cohort_analytics():
+    funnel_id = request.args.get("funnel_id", type=int)
+    start_date_str = request.args.get("start_date")
+    end_date_str = request.args.get("end_date")
+    period = request.args.get("period", "day")
+    max_age = request.args.get("max_age", 90, type=int)
+
+    from datetime import datetime
+    try:
+        start_date = datetime.strptime(start_date_str, "%Y-%m-%d").date() if start_date_str else None
+        end_date = datetime.strptime(end_date_str, "%Y-%m-%d").date() if end_date_str else None
+    except ValueError:
+        return jsonify({"msg": "Invalid date format. Use YYYY-MM-DD"}), 400
+
+    if start_date and end_date and start_date > end_date:
+        return jsonify({"msg": "start_date must not be after end_date"}), 400
+
+    if period not in ("day", "week"):
+        return jsonify({"msg": "period must be 'day' or 'week'"}), 400
+
+    if not 1 <= max_age <= MAX_COHORT_AGE:
+        return jsonify({"msg": f"max_age must be between 1 and {MAX_COHORT_AGE}"}), 400
+
+    cohorts = analytics_cache.get_or_compute(
+        ("cohorts", funnel_id, start_date, end_date, period, max_age),
+        lambda: Visitor.get_cohort_analysis(funnel_id, start_date, end_date, period, max_age)
+    )
+    return jsonify(cohorts), 200
+
+@monitoring_bp.route("/cache/stats", methods=["GET"])
+@jwt_required()
+def get_cache_stats():
+    return jsonify({
+        "visitor_sessions": visitor_cache.stats(),
+        "visitor_activity": activity_coalescer.stats(),
+        "analytics": analytics_cache.stats(),
+        "live_stream": live_events.stats(),
+        "pixel_scripts": pixel_cache.stats()
+    }), 200
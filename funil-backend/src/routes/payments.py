@@ -2,13 +2,25 @@ from flask import request, jsonify
 from flask_jwt_extended import jwt_required
 from src.routes import payments_bp
 from src.models import db
-from src.models.payment import Payment
+from src.models.payment import Payment, ANALYTICS_BREAKDOWNS, UTM_DIMENSIONS
 from src.models.visitor import Visitor
 from src.models.funnel import Funnel
 from src.models.funnel_step import FunnelStep
 from src.models.checkout_config import CheckoutConfig
 from src.models.credential import Credential
+from src.services.analytics_cache import analytics_cache
+from src.services.live_events import live_events
 import requests
+import uuid
+
+def _publish_payment(payment, previous_status=None):
+    """Envia a mudança de status do pagamento ao stream ao vivo do monitoramento"""
+    live_events.publish("payment", {
+        **payment.to_dict_summary(),
+        "visitor_id": payment.visitor_id,
+        "step_id": payment.step_id,
+        "previous_status": previous_status
+    }, payment.funnel_id)
 
 @payments_bp.route("/create", methods=["POST"])
 # @jwt_required() # Pode ser acessado por funil, sem JWT
@@ -64,7 +76,7 @@ def create_payment():
 
         # Simulação de resposta da SkalePay
         skalepay_response = {
-            "id": "pix_simulado_12345",
+            "id": f"pix_simulado_{uuid.uuid4().hex[:12]}",
             "status": "pending",
             "qr_code_image": "https://via.placeholder.com/150?text=QR+Code",
             "qr_code_text": "00020126580014BR.GOV.BCB.PIX0136a6239612-42b7-45a7-937b-94c7c7d2d3e4520400005303986540510.005802BR6007BRASIL62070503***6304E821",
@@ -88,6 +100,7 @@ def create_payment():
         
         visitor.add_event("payment_init", step_id, {"payment_id": new_payment.id, "amount": new_payment.amount})
         db.session.commit()
+        _publish_payment(new_payment)
 
         return jsonify(new_payment.to_dict()), 201
 
@@ -116,12 +129,13 @@ def payment_webhook():
         return jsonify({"msg": "Payment not found"}), 404
 
     if payment.status != new_status:
+        previous_status = payment.status
         payment.update_status(new_status, data) # Atualiza status e adiciona dados do webhook
         db.session.commit()
+        analytics_cache.invalidate(payment.funnel_id)
         
-        # Opcional: Notificar o dashboard via WebSocket
-        # from src.main import socketio
-        # socketio.emit("payment_status_change", payment.to_dict())
+        # Notifica os dashboards conectados ao stream ao vivo
+        _publish_payment(payment, previous_status)
 
     return jsonify({"msg": "Webhook received and processed"}), 200
 
@@ -131,18 +145,55 @@ def get_payment_analytics():
     funnel_id = request.args.get("funnel_id", type=int)
     start_date_str = request.args.get("start_date")
     end_date_str = request.args.get("end_date")
+    breakdowns_str = request.args.get("breakdowns")
 
     from datetime import datetime
-    start_date = datetime.strptime(start_date_str, "%Y-%m-%d") if start_date_str else None
-    end_date = datetime.strptime(end_date_str, "%Y-%m-%d") if end_date_str else None
-
-    revenue_stats = Payment.get_revenue_stats(funnel_id, start_date, end_date)
-    daily_revenue = Payment.get_daily_revenue(funnel_id, days=7) # Últimos 7 dias
-    payment_methods_stats = Payment.get_payment_methods_stats(funnel_id, start_date, end_date)
-
-    return jsonify({
-        "revenue_stats": revenue_stats,
-        "daily_revenue": daily_revenue,
-        "payment_methods_stats": payment_methods_stats
-    }), 200
+    try:
+        start_date = datetime.strptime(start_date_str, "%Y-%m-%d").date() if start_date_str else None
+        end_date = datetime.strptime(end_date_str, "%Y-%m-%d").date() if end_date_str else None
+    except ValueError:
+        return jsonify({"msg": "Invalid date format. Use YYYY-MM-DD"}), 400
+
+    if start_date and end_date and start_date > end_date:
+        return jsonify({"msg": "start_date must not be after end_date"}), 400
+
+    breakdowns = None
+    if breakdowns_str:
+        breakdowns = [item.strip() for item in breakdowns_str.split(",") if item.strip()]
+        invalid = [item for item in breakdowns if item not in ANALYTICS_BREAKDOWNS]
+        if invalid:
+            return jsonify({"msg": f"Invalid breakdowns: {', '.join(invalid)}. Use {', '.join(ANALYTICS_BREAKDOWNS)}"}), 400
+
+    # Todas as quebras saem de uma única consulta e respeitam o mesmo período
+    analytics = Payment.get_analytics(funnel_id, start_date, end_date, breakdowns)
+    return jsonify(analytics), 200
+
+@payments_bp.route("/attribution", methods=["GET"])
+@jwt_required()
+def get_utm_attribution():
+    funnel_id = request.args.get("funnel_id", type=int)
+    start_date_str = request.args.get("start_date")
+    end_date_str = request.args.get("end_date")
+    dimensions_str = request.args.get("dimensions", "utm_source")
+
+    from datetime import datetime
+    try:
+        start_date = datetime.strptime(start_date_str, "%Y-%m-%d").date() if start_date_str else None
+        end_date = datetime.strptime(end_date_str, "%Y-%m-%d").date() if end_date_str else None
+    except ValueError:
+        return jsonify({"msg": "Invalid date format. Use YYYY-MM-DD"}), 400
+
+    if start_date and end_date and start_date > end_date:
+        return jsonify({"msg": "start_date must not be after end_date"}), 400
+
+    dimensions = tuple(dict.fromkeys(item.strip() for item in dimensions_str.split(",") if item.strip()))
+    invalid = [item for item in dimensions if item not in UTM_DIMENSIONS]
+    if not dimensions or invalid:
+        return jsonify({"msg": f"Invalid dimensions: {', '.join(invalid) or '(none)'}. Use {', '.join(UTM_DIMENSIONS)}"}), 400
+
+    attribution = analytics_cache.get_or_compute(
+        ("utm_attribution", funnel_id, dimensions, start_date, end_date),
+        lambda: Payment.get_utm_attribution(dimensions, funnel_id, start_date, end_date)
+    )
+    return jsonify({"dimensions": list(dimensions), "attribution": attribution}), 200
 
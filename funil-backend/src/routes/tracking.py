@@ -1,10 +1,21 @@
-from flask import request, jsonify
+from datetime import datetime, timezone
+from flask import current_app, make_response, request, jsonify
 from flask_jwt_extended import jwt_required
 from src.routes import tracking_bp
 from src.models import db
 from src.models.tracking_pixel import TrackingPixel
 from src.models.funnel import Funnel
 from src.models.funnel_step import FunnelStep
+from src.models.visitor import Visitor
+from src.models.visitor_event import VisitorEvent
+from src.services.activity_coalescer import activity_coalescer
+from src.services.analytics_cache import analytics_cache
+from src.services.event_buffer import event_buffer
+from src.services.live_events import live_events
+from src.services.pixel_cache import pixel_cache
+from src.services.presence import presence
+from src.services.visitor_cache import visitor_cache
+from src.utils.pagination import page_limit, page_response, paginate_keyset
 
 @tracking_bp.route("/pixels", methods=["GET"])
 @jwt_required()
@@ -13,11 +24,18 @@ def get_pixels():
     step_id = request.args.get("step_id", type=int)
     
     if funnel_id:
+        # Pixels ativos de um funil/etapa: poucos, sem paginação
         pixels = TrackingPixel.get_funnel_pixels(funnel_id, step_id)
-    else:
-        pixels = TrackingPixel.query.all()
-        
-    return jsonify([pixel.to_dict() for pixel in pixels]), 200
+        return jsonify([pixel.to_dict() for pixel in pixels]), 200
+
+    try:
+        pixels, next_cursor = paginate_keyset(
+            TrackingPixel.query, (TrackingPixel.id,), page_limit(request.args.get("limit")), request.args.get("cursor")
+        )
+    except ValueError as e:
+        return jsonify({"msg": str(e)}), 400
+
+    return page_response([pixel.to_dict() for pixel in pixels], next_cursor), 200
 
 @tracking_bp.route("/pixels", methods=["POST"])
 @jwt_required()
@@ -45,6 +63,7 @@ def create_pixel():
     )
     db.session.add(new_pixel)
     db.session.commit()
+    pixel_cache.invalidate(funnel_id)
     return jsonify(new_pixel.to_dict()), 201
 
 @tracking_bp.route("/pixels/<int:id>", methods=["PUT"])
@@ -52,6 +71,7 @@ def create_pixel():
 def update_pixel(id):
     pixel = TrackingPixel.query.get_or_404(id)
     data = request.get_json()
+    previous_funnel_id = pixel.funnel_id
 
     pixel.funnel_id = data.get("funnel_id", pixel.funnel_id)
     pixel.step_id = data.get("step_id", pixel.step_id)
@@ -61,6 +81,7 @@ def update_pixel(id):
     pixel.is_active = data.get("is_active", pixel.is_active)
 
     db.session.commit()
+    pixel_cache.invalidate(previous_funnel_id, pixel.funnel_id)
     return jsonify(pixel.to_dict()), 200
 
 @tracking_bp.route("/pixels/<int:id>", methods=["DELETE"])
@@ -69,11 +90,194 @@ def delete_pixel(id):
     pixel = TrackingPixel.query.get_or_404(id)
     db.session.delete(pixel)
     db.session.commit()
+    pixel_cache.invalidate(pixel.funnel_id)
     return jsonify({"msg": "Tracking pixel deleted"}), 204
 
 @tracking_bp.route("/pixels/<int:funnel_id>/<int:step_id>/render", methods=["GET"])
 def render_pixels(funnel_id, step_id):
-    pixels = TrackingPixel.get_funnel_pixels(funnel_id, step_id)
-    scripts = "\n".join([pixel.generate_script() for pixel in pixels])
-    return scripts, 200, {"Content-Type": "text/html"}
+    def render():
+        pixels = TrackingPixel.get_funnel_pixels(funnel_id, step_id)
+        return TrackingPixel.render_scripts(pixels)
+
+    scripts, etag = pixel_cache.get_or_render(funnel_id, step_id, render)
+
+    response = make_response(scripts, 200, {"Content-Type": "text/html; charset=utf-8"})
+    response.set_etag(etag)
+    # Navegador/CDN revalidam pelo ETag (304) a cada carregamento, ou depois de
+    # PIXEL_BROWSER_MAX_AGE segundos quando configurado
+    response.cache_control.public = True
+    max_age = current_app.config["PIXEL_BROWSER_MAX_AGE"]
+    if max_age:
+        response.cache_control.max_age = max_age
+    else:
+        response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+# Ingestão pública de eventos de visitantes
+MAX_EVENTS_PER_BATCH = 1000
+VISITOR_FIELDS = ("funnel_id", "utm_source", "utm_medium", "utm_campaign", "utm_term", "utm_content")
+
+def _parse_event(raw):
+    """Valida um evento recebido e retorna (evento, erro)"""
+    if not isinstance(raw, dict):
+        return None, "Event must be an object"
+
+    session_id = raw.get("session_id")
+    event_type = raw.get("event_type")
+    step_id = raw.get("step_id")
+    funnel_id = raw.get("funnel_id")
+    event_data = raw.get("event_data") or {}
+    created_at = raw.get("created_at")
+
+    if not isinstance(session_id, str) or not session_id or len(session_id) > 255:
+        return None, "Invalid session_id"
+    if not isinstance(event_type, str) or not event_type or len(event_type) > 50:
+        return None, "Invalid event_type"
+    if step_id is not None and (not isinstance(step_id, int) or isinstance(step_id, bool)):
+        return None, "Invalid step_id"
+    if funnel_id is not None and (not isinstance(funnel_id, int) or isinstance(funnel_id, bool)):
+        return None, "Invalid funnel_id"
+    if not isinstance(event_data, dict):
+        return None, "event_data must be an object"
+
+    if created_at is not None:
+        try:
+            created_at = datetime.fromisoformat(created_at)
+        except (TypeError, ValueError):
+            return None, "Invalid created_at, use ISO 8601"
+        if created_at.tzinfo:
+            created_at = created_at.astimezone(timezone.utc).replace(tzinfo=None)
+        # Relógios adiantados no navegador não podem gerar eventos no futuro
+        created_at = min(created_at, datetime.utcnow())
+    else:
+        created_at = datetime.utcnow()
+
+    for field in VISITOR_FIELDS[1:]:
+        value = raw.get(field)
+        if value is not None and (not isinstance(value, str) or len(value) > 255):
+            return None, f"Invalid {field}"
+
+    return {
+        "session_id": session_id,
+        "event_type": event_type,
+        "step_id": step_id,
+        "funnel_id": funnel_id,
+        "event_data": event_data,
+        "created_at": created_at,
+        "visitor": {field: raw.get(field) for field in VISITOR_FIELDS}
+    }, None
+
+@tracking_bp.route("/events", methods=["POST"])
+def ingest_events():
+    data = request.get_json(silent=True) or {}
+    raw_events = data.get("events")
+
+    if not isinstance(raw_events, list) or not raw_events:
+        return jsonify({"msg": "events must be a non-empty list"}), 400
+
+    if len(raw_events) > MAX_EVENTS_PER_BATCH:
+        return jsonify({"msg": f"A batch accepts at most {MAX_EVENTS_PER_BATCH} events"}), 413
+
+    events = []
+    rejected = []
+    for index, raw in enumerate(raw_events):
+        event, error = _parse_event(raw)
+        if error:
+            rejected.append({"index": index, "msg": error})
+        else:
+            event["index"] = index
+            events.append(event)
+
+    # Valida todas as etapas e funis referenciados com uma consulta para cada
+    step_ids = {event["step_id"] for event in events if event["step_id"] is not None}
+    step_funnels = {}
+    if step_ids:
+        step_funnels = dict(db.session.execute(
+            db.select(FunnelStep.id, FunnelStep.funnel_id).where(FunnelStep.id.in_(step_ids))
+        ).all())
+
+    funnel_ids = {event["funnel_id"] for event in events if event["funnel_id"] is not None}
+    known_funnels = set()
+    if funnel_ids:
+        known_funnels = set(db.session.execute(
+            db.select(Funnel.id).where(Funnel.id.in_(funnel_ids))
+        ).scalars())
+
+    valid_events = []
+    for event in events:
+        if event["funnel_id"] is not None and event["funnel_id"] not in known_funnels:
+            # funnel_id vai para chaves estrangeiras: um id inexistente derrubaria o lote inteiro
+            rejected.append({"index": event["index"], "msg": "Unknown funnel_id"})
+            continue
+
+        step_id = event["step_id"]
+        if step_id is not None:
+            if step_id not in step_funnels:
+                rejected.append({"index": event["index"], "msg": "Unknown step_id"})
+                continue
+            # O funil da etapa prevalece sobre o informado pelo cliente
+            event["funnel_id"] = step_funnels[step_id]
+            if event["visitor"]["funnel_id"] is None:
+                event["visitor"]["funnel_id"] = step_funnels[step_id]
+        valid_events.append(event)
+
+    rejected.sort(key=lambda item: item["index"])
+
+    if not valid_events:
+        return jsonify({"msg": "No valid events", "accepted": 0, "rejected": rejected}), 400
+
+    # Dados de criação do visitante vêm do primeiro evento de cada sessão
+    sessions = {}
+    for event in valid_events:
+        if event["session_id"] not in sessions:
+            sessions[event["session_id"]] = {
+                "ip_address": request.remote_addr,
+                "user_agent": request.headers.get("User-Agent"),
+                **event["visitor"]
+            }
+
+    try:
+        # Visitantes novos são criados e confirmados antes dos eventos
+        visitor_ids = visitor_cache.resolve(sessions)
+
+        rows = []
+        activity = {}
+        visitor_funnels = {}
+        for event in sorted(valid_events, key=lambda e: e["created_at"]):
+            visitor_id = visitor_ids[event["session_id"]]
+            rows.append({
+                "visitor_id": visitor_id,
+                "funnel_id": event["funnel_id"],
+                "event_type": event["event_type"],
+                "step_id": event["step_id"],
+                "event_data": event["event_data"],
+                "created_at": event["created_at"]
+            })
+
+            _, last_step_id = activity.get(visitor_id, (None, None))
+            activity[visitor_id] = (event["created_at"], event["step_id"] or last_step_id)
+            visitor_funnels[visitor_id] = event["funnel_id"] or visitor_funnels.get(visitor_id)
+
+        for visitor_id, (last_activity, step_id) in activity.items():
+            presence.heartbeat(visitor_id, visitor_funnels[visitor_id], step_id, last_activity)
+
+        if activity_coalescer.enabled:
+            # last_activity é gravado no máximo uma vez por intervalo por visitante
+            activity_coalescer.record_many(activity)
+            activity = {}
+
+        if event_buffer.enabled:
+            event_buffer.add(rows, activity)
+            return jsonify({"accepted": len(rows), "rejected": rejected}), 202
+
+        VisitorEvent.bulk_create(rows)
+        Visitor.bulk_update_activity(activity)
+        db.session.commit()
+        analytics_cache.note_events(rows)
+        live_events.publish_events(rows)
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"msg": f"Error ingesting events: {str(e)}"}), 500
 
+    return jsonify({"accepted": len(rows), "rejected": rejected}), 201
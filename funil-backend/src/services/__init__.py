@@ -0,0 +1 @@
+# Serviços em memória compartilhados pelas rotas (buffers, caches, etc.)
@@ -0,0 +1,150 @@
+import atexit
+import os
+import threading
+import time
+
+class ActivityCoalescer:
+    """Agrupa as atualizações de last_activity/current_step_id dos visitantes
+    
+    Cada visitante tem no máximo uma gravação por intervalo; heartbeats
+    recebidos nesse meio tempo apenas avançam o valor pendente. Mudanças de
+    etapa nunca são descartadas: prevalecem sobre heartbeats posteriores e são
+    gravadas no flush seguinte. Cada flush aplica tudo em um único UPDATE em lote.
+    """
+    
+    def __init__(self, interval=30, flush_interval=5):
+        self.app = None
+        self.enabled = False
+        self.interval = interval
+        self.flush_interval = flush_interval
+        self._reset_state()
+    
+    def _reset_state(self):
+        """Cria lock, pendências e thread do processo atual"""
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = {}
+        self._written_at = {}
+        self._thread = None
+        self._stopped = False
+        self.recorded = 0
+        self.written = 0
+    
+    def init_app(self, app):
+        """Configura o agrupador a partir da configuração da aplicação"""
+        self.app = app
+        self.enabled = app.config.get('ACTIVITY_COALESCE_ENABLED', False)
+        self.interval = app.config.get('ACTIVITY_COALESCE_INTERVAL', self.interval)
+        self.flush_interval = app.config.get('ACTIVITY_COALESCE_FLUSH_INTERVAL', self.flush_interval)
+        app.extensions['activity_coalescer'] = self
+        atexit.register(self.shutdown)
+    
+    def record(self, visitor_id, seen_at, step_id=None):
+        """Registra atividade de um visitante para gravação posterior
+        
+        Pendências são tuplas (last_activity, step_id, mudou_de_etapa).
+        """
+        if os.getpid() != self._pid:
+            self._reset_state()
+        
+        with self._lock:
+            self.recorded += 1
+            current = self._pending.get(visitor_id)
+            if current is None:
+                self._pending[visitor_id] = (seen_at, step_id, bool(step_id))
+            else:
+                last_activity = max(current[0], seen_at)
+                if step_id and (not current[2] or seen_at >= current[0]):
+                    self._pending[visitor_id] = (last_activity, step_id, True)
+                else:
+                    self._pending[visitor_id] = (last_activity, current[1], current[2])
+            
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='activity-coalescer', daemon=True)
+                self._thread.start()
+    
+    def record_many(self, activity):
+        """Registra várias atividades no formato {visitor_id: (last_activity, step_id)}"""
+        for visitor_id, (seen_at, step_id) in activity.items():
+            self.record(visitor_id, seen_at, step_id)
+    
+    def _run(self):
+        while not self._stopped:
+            time.sleep(self.flush_interval)
+            self.flush()
+    
+    def _take_due(self, force):
+        """Separa as pendências que já podem ser gravadas (chamar com o lock adquirido)"""
+        now = time.monotonic()
+        due = {}
+        
+        for visitor_id, (seen_at, step_id, step_changed) in list(self._pending.items()):
+            written_at = self._written_at.get(visitor_id)
+            if force or step_changed or written_at is None or now - written_at >= self.interval:
+                due[visitor_id] = (seen_at, step_id)
+                del self._pending[visitor_id]
+                self._written_at[visitor_id] = now
+        
+        # Esquece visitantes sem gravações recentes para o dicionário não crescer sem limite
+        expired = [
+            visitor_id for visitor_id, written_at in self._written_at.items()
+            if now - written_at > 2 * self.interval and visitor_id not in self._pending
+        ]
+        for visitor_id in expired:
+            del self._written_at[visitor_id]
+        
+        return due
+    
+    def flush(self, force=False):
+        """Grava as pendências vencidas (ou todas, com force) e retorna quantos visitantes foram atualizados"""
+        if self.app is None:
+            return 0
+        
+        from src.models import db
+        from src.models.visitor import Visitor
+        
+        with self._flush_lock:
+            with self._lock:
+                due = self._take_due(force)
+            
+            if not due:
+                return 0
+            
+            with self.app.app_context():
+                try:
+                    Visitor.bulk_update_activity(due)
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    self.app.logger.exception('Falha ao gravar atividade de %d visitantes', len(due))
+                    with self._lock:
+                        for visitor_id, (seen_at, step_id) in due.items():
+                            if visitor_id not in self._pending:
+                                self._pending[visitor_id] = (seen_at, step_id, bool(step_id))
+                    return 0
+                finally:
+                    db.session.remove()
+            
+            self.written += len(due)
+            return len(due)
+    
+    def shutdown(self):
+        """Grava todas as pendências antes do processo encerrar"""
+        if os.getpid() != self._pid or self.app is None:
+            return
+        
+        self._stopped = True
+        self.flush(force=True)
+    
+    def stats(self):
+        """Retorna quantas atualizações foram recebidas e quantas chegaram ao banco"""
+        with self._lock:
+            return {
+                'interval': self.interval,
+                'pending': len(self._pending),
+                'recorded': self.recorded,
+                'written': self.written
+            }
+
+activity_coalescer = ActivityCoalescer()
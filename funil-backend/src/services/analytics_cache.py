@@ -0,0 +1,206 @@
+import threading
+import time
+from collections import Counter, OrderedDict
+from src.services.cache_versions import SharedCacheVersions
+
+# Chaves de cache_versions além dos funnel_id: invalidação de todos os funis e dos dados sem funil
+ALL_FUNNELS_KEY = 0
+NO_FUNNEL_KEY = -1
+
+class AnalyticsCache:
+    """Cache com TTL por chave para os resultados de analytics do dashboard
+    
+    As chaves são tuplas (nome, funnel_id); funnel_id None indica a visão
+    geral de todos os funis. Entradas expiradas ou invalidadas continuam
+    sendo servidas (stale-while-revalidate) enquanto uma única requisição
+    por chave recalcula o valor. Só quando não há valor anterior as demais
+    requisições aguardam o recálculo em andamento.
+    
+    Os valores ficam em cada worker do gunicorn, mas as invalidações são
+    compartilhadas pela tabela cache_versions: quem invalida incrementa a
+    versão do funil e os outros workers a conferem no máximo a cada
+    version_check_interval segundos, descartando as suas cópias. Cada worker
+    recalcula uma vez por chave após a invalidação. As chaves incluem datas
+    e dimensões vindas da query string, então o número de entradas é
+    limitado a max_size, descartando as menos usadas (LRU).
+    """
+    
+    def __init__(self, ttl=30, ingest_threshold=500, max_size=1000, version_check_interval=1.0):
+        self.enabled = True
+        self.ttl = ttl
+        self.ingest_threshold = ingest_threshold
+        self.max_size = max_size
+        self.shared = SharedCacheVersions('analytics', version_check_interval)
+        self._entries = OrderedDict()
+        self._refreshing = {}
+        self._pending_events = Counter()
+        self._funnel_versions = Counter()
+        self._global_version = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+    
+    def init_app(self, app):
+        """Configura o cache a partir da configuração da aplicação"""
+        self.enabled = app.config.get('ANALYTICS_CACHE_ENABLED', self.enabled)
+        self.ttl = app.config.get('ANALYTICS_CACHE_TTL', self.ttl)
+        self.ingest_threshold = app.config.get('ANALYTICS_CACHE_INGEST_THRESHOLD', self.ingest_threshold)
+        self.max_size = app.config.get('ANALYTICS_CACHE_MAX_SIZE', self.max_size)
+        self.shared.check_interval = app.config.get('ANALYTICS_CACHE_VERSION_CHECK_INTERVAL', self.shared.check_interval)
+        app.extensions['analytics_cache'] = self
+    
+    def get_or_compute(self, key, compute, ttl=None, timeout=10.0):
+        """Retorna o valor cacheado de key, recalculando com compute() quando expirado
+        
+        Args:
+            key: Tupla (nome, funnel_id)
+            compute: Função sem argumentos que calcula o valor
+            ttl: Validade da entrada em segundos (ANALYTICS_CACHE_TTL por padrão)
+        """
+        if not self.enabled:
+            return compute()
+        
+        # Invalidações feitas pelos outros workers
+        for shared_key in self.shared.changed():
+            if shared_key == ALL_FUNNELS_KEY:
+                self._expire(all_funnels=True)
+            else:
+                self._expire(None if shared_key == NO_FUNNEL_KEY else shared_key)
+        
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            if entry is not None and entry['expires_at'] > now:
+                self.hits += 1
+                return entry['value']
+            
+            refreshing = self._refreshing.get(key)
+            owner = refreshing is None
+            if owner:
+                refreshing = self._refreshing[key] = threading.Event()
+                version = self._version(key)
+                self.misses += 1
+            elif entry is not None:
+                # Outra requisição já está recalculando: serve o valor anterior
+                self.stale_hits += 1
+                return entry['value']
+        
+        if not owner:
+            # Sem valor anterior: aguarda o recálculo em andamento
+            refreshing.wait(timeout)
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self.stale_hits += 1
+                    return entry['value']
+            return compute()
+        
+        try:
+            value = compute()
+        except Exception:
+            with self._lock:
+                self._refreshing.pop(key, None)
+            refreshing.set()
+            raise
+        
+        with self._lock:
+            # Uma invalidação durante o cálculo deixa o novo valor já expirado
+            stale = self._version(key) != version
+            self._entries[key] = {
+                'value': value,
+                'expires_at': 0 if stale else time.monotonic() + (ttl or self.ttl)
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._refreshing.pop(key, None)
+        refreshing.set()
+        
+        return value
+    
+    def _version(self, key):
+        """Versão das invalidações que afetam key (chamar com o lock adquirido)"""
+        if key[1] is None:
+            return self.invalidations
+        return self._global_version, self._funnel_versions[key[1]]
+    
+    def invalidate(self, funnel_id=None, all_funnels=False):
+        """Expira as entradas de um funil e as da visão geral, neste e nos demais workers
+        
+        Os valores expirados continuam disponíveis para stale-while-revalidate.
+        """
+        self._expire(funnel_id, all_funnels)
+        
+        if self.enabled:
+            if all_funnels:
+                self.shared.publish([ALL_FUNNELS_KEY])
+            else:
+                self.shared.publish([NO_FUNNEL_KEY if funnel_id is None else funnel_id])
+    
+    def _expire(self, funnel_id=None, all_funnels=False):
+        """Expira as entradas locais de um funil (ou de todos) e as da visão geral"""
+        with self._lock:
+            self.invalidations += 1
+            if all_funnels:
+                self._global_version += 1
+            else:
+                self._funnel_versions[funnel_id] += 1
+            
+            for key, entry in self._entries.items():
+                if all_funnels or key[1] is None or key[1] == funnel_id:
+                    entry['expires_at'] = 0
+            
+            if all_funnels:
+                self._pending_events.clear()
+            else:
+                self._pending_events.pop(funnel_id, None)
+    
+    def note_events(self, events):
+        """Contabiliza eventos ingeridos e invalida os funis que passaram do limite
+        
+        Args:
+            events: Lista de dicionários com funnel_id
+        """
+        if not self.enabled or not events:
+            return
+        
+        with self._lock:
+            self._pending_events.update(event.get('funnel_id') for event in events)
+            reached = [
+                funnel_id for funnel_id, count in self._pending_events.items()
+                if count >= self.ingest_threshold
+            ]
+        
+        for funnel_id in reached:
+            self.invalidate(funnel_id)
+    
+    def clear(self):
+        """Esvazia o cache"""
+        with self._lock:
+            self._entries.clear()
+            self._pending_events.clear()
+    
+    def stats(self):
+        """Retorna as métricas de acerto do cache"""
+        with self._lock:
+            lookups = self.hits + self.stale_hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'evictions': self.evictions,
+                'ttl': self.ttl,
+                'ingest_threshold': self.ingest_threshold,
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'hit_rate': round((self.hits + self.stale_hits) / lookups * 100, 2) if lookups else 0
+            }
+
+analytics_cache = AnalyticsCache()
@@ -0,0 +1,65 @@
+import threading
+import time
+from flask import current_app
+
+class SharedCacheVersions:
+    """Propaga as invalidações de um cache em memória entre os workers do gunicorn
+    
+    publish() incrementa as versões das chaves na tabela cache_versions;
+    changed() devolve as chaves que outros workers invalidaram desde a última
+    verificação, consultando o banco no máximo uma vez a cada check_interval.
+    Deve ser usado com o contexto da aplicação ativo. Falhas de banco só são
+    registradas no log: a invalidação local já foi feita e o TTL limita a
+    defasagem dos demais workers.
+    """
+    
+    def __init__(self, scope, check_interval=1.0):
+        self.scope = scope
+        self.check_interval = check_interval
+        self._known = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+    
+    def publish(self, keys):
+        """Registra uma invalidação das chaves para os outros workers"""
+        from src.models.cache_version import CacheVersion
+        
+        try:
+            versions = CacheVersion.bump(self.scope, keys)
+        except Exception:
+            current_app.logger.exception('Falha ao propagar a invalidação do cache %s', self.scope)
+            return
+        
+        with self._lock:
+            if self._known is None:
+                return
+            for key, version in versions.items():
+                # Sem invalidações de outros workers no meio: não há o que descartar de novo
+                if self._known.get(key, 0) == version - 1:
+                    self._known[key] = version
+    
+    def changed(self):
+        """Retorna as chaves invalidadas por outros workers desde a última verificação"""
+        from src.models.cache_version import CacheVersion
+        
+        now = time.monotonic()
+        with self._lock:
+            if now - self._checked_at < self.check_interval:
+                return []
+            self._checked_at = now
+        
+        try:
+            versions = CacheVersion.current(self.scope)
+        except Exception:
+            current_app.logger.exception('Falha ao consultar as invalidações do cache %s', self.scope)
+            return []
+        
+        with self._lock:
+            if self._known is None:
+                # Primeira verificação do processo: o cache local ainda está vazio
+                self._known = versions
+                return []
+            
+            changed = [key for key, version in versions.items() if self._known.get(key, 0) != version]
+            self._known.update(versions)
+            return changed
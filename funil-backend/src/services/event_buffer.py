@@ -0,0 +1,259 @@
+import atexit
+import json
+import os
+import threading
+import time
+from sqlalchemy.exc import InterfaceError, OperationalError, TimeoutError as PoolTimeoutError
+
+# Falhas de conexão/disponibilidade do banco: o lote é repetido inteiro no próximo flush.
+# Qualquer outro erro é tratado como dado inválido e o lote é dividido para isolar as linhas.
+TRANSIENT_ERRORS = (OperationalError, InterfaceError, PoolTimeoutError)
+
+class EventBuffer:
+    """Buffer write-behind para eventos de visitantes
+    
+    Acumula linhas de VisitorEvent e atualizações de last_activity em memória
+    e grava tudo em lote quando o buffer atinge o tamanho máximo ou quando o
+    intervalo de flush expira. Cada worker do gunicorn mantém seu próprio buffer.
+    
+    Um lote que falha por dado inválido é dividido ao meio recursivamente e só
+    as linhas que continuam falhando sozinhas são descartadas (registradas no
+    log como dead letter). Um lote que falha por indisponibilidade do banco
+    volta para a fila e é repetido até max_retries vezes.
+    
+    A mesma thread consolida, a cada sketch_merge_interval, as contagens
+    horárias e os sketches de visitantes únicos parciais gravados pelos lotes
+    (merge_deltas), para que as tabelas de parciais não cresçam sem o worker
+    de snapshots.
+    """
+    
+    def __init__(self, max_size=500, flush_interval=2.0, max_retries=5, sketch_merge_interval=60.0):
+        self.app = None
+        self.enabled = False
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.sketch_merge_interval = sketch_merge_interval
+        self.max_pending = max_size * 10
+        self._reset_state()
+    
+    def _reset_state(self):
+        """Cria lock, fila e thread do processo atual"""
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._events = []
+        self._activity = {}
+        self._retries = []
+        self._thread = None
+        self._stopped = False
+        self._deltas_written = False
+        self._merged_at = time.monotonic()
+        self.dropped_events = 0
+        self.dead_letter_events = 0
+    
+    def init_app(self, app):
+        """Configura o buffer a partir da configuração da aplicação"""
+        self.app = app
+        self.enabled = app.config.get('EVENT_BUFFER_ENABLED', False)
+        self.max_size = app.config.get('EVENT_BUFFER_MAX_SIZE', self.max_size)
+        self.flush_interval = app.config.get('EVENT_BUFFER_FLUSH_INTERVAL', self.flush_interval)
+        self.max_retries = app.config.get('EVENT_BUFFER_MAX_RETRIES', self.max_retries)
+        self.sketch_merge_interval = app.config.get('SKETCH_MERGE_INTERVAL', self.sketch_merge_interval)
+        self.max_pending = self.max_size * 10
+        app.extensions['event_buffer'] = self
+        atexit.register(self.shutdown)
+    
+    def add(self, events, activity):
+        """Enfileira eventos e atividades de visitantes para gravação em lote
+        
+        Args:
+            events: Lista de linhas de VisitorEvent (dicionários)
+            activity: Dicionário {visitor_id: (last_activity, step_id)}
+        """
+        if os.getpid() != self._pid:
+            # Processo filho após fork: não herda fila nem thread do pai
+            self._reset_state()
+        
+        with self._lock:
+            self._events.extend(events)
+            self._merge_activity(self._activity, activity)
+            pending = len(self._events)
+            self._ensure_thread()
+        
+        if pending >= self.max_size:
+            self._wakeup.set()
+    
+    @staticmethod
+    def _merge_activity(target, activity):
+        """Mantém apenas a atividade mais recente (e a última etapa) de cada visitante"""
+        for visitor_id, (last_activity, step_id) in activity.items():
+            current = target.get(visitor_id)
+            if current is None or last_activity >= current[0]:
+                target[visitor_id] = (last_activity, step_id or (current[1] if current else None))
+            elif step_id and not current[1]:
+                target[visitor_id] = (current[0], step_id)
+    
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='event-buffer-flush', daemon=True)
+            self._thread.start()
+    
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+            self._merge_deltas()
+    
+    def flush(self):
+        """Grava no banco tudo o que está pendente e retorna o número de eventos gravados"""
+        with self._flush_lock:
+            with self._lock:
+                events, self._events = self._events, []
+                activity, self._activity = self._activity, {}
+                retries, self._retries = self._retries, []
+            
+            if events:
+                retries.append((events, 0))
+            
+            if not retries and not activity:
+                return 0
+            
+            from src.models import db
+            
+            written = 0
+            with self.app.app_context():
+                try:
+                    for batch, attempts in retries:
+                        written += self._write_events(batch, attempts)
+                    self._write_activity(activity)
+                finally:
+                    db.session.remove()
+            
+            return written
+    
+    def _write_events(self, events, attempts):
+        """Grava um lote de eventos em uma transação, isolando as linhas inválidas
+        
+        Returns:
+            Número de eventos gravados
+        """
+        from src.models import db
+        from src.models.visitor_event import VisitorEvent
+        from src.services.analytics_cache import analytics_cache
+        from src.services.live_events import live_events
+        
+        try:
+            VisitorEvent.bulk_create(events)
+            db.session.commit()
+        except TRANSIENT_ERRORS as e:
+            db.session.rollback()
+            if attempts + 1 >= self.max_retries:
+                self._dead_letter(events, e)
+            else:
+                self.app.logger.warning('Falha ao gravar %d eventos em lote (tentativa %d): %s', len(events), attempts + 1, e)
+                self._requeue(events, attempts + 1)
+            return 0
+        except Exception as e:
+            db.session.rollback()
+            if len(events) == 1:
+                self._dead_letter(events, e)
+                return 0
+            # Dado inválido em alguma linha: grava cada metade separadamente
+            middle = len(events) // 2
+            return self._write_events(events[:middle], attempts) + self._write_events(events[middle:], attempts)
+        
+        self._deltas_written = True
+        analytics_cache.note_events(events)
+        live_events.publish_events(events)
+        return len(events)
+    
+    def _merge_deltas(self):
+        """Consolida os parciais pendentes se este worker gravou eventos desde a última consolidação"""
+        if not self.sketch_merge_interval or not self._deltas_written:
+            return
+        if time.monotonic() - self._merged_at < self.sketch_merge_interval:
+            return
+        
+        from src.models import db
+        from src.models.event_rollup import EventHourlyRollup
+        from src.models.visitor_sketch import VisitorSketch
+        
+        self._deltas_written = False
+        self._merged_at = time.monotonic()
+        with self.app.app_context():
+            for merge in (EventHourlyRollup.merge_deltas, VisitorSketch.merge_deltas):
+                try:
+                    merge()
+                except Exception:
+                    # Os parciais continuam na tabela: a próxima consolidação os inclui
+                    db.session.rollback()
+                    self._deltas_written = True
+                    self.app.logger.exception('Falha ao consolidar os parciais (%s)', merge.__qualname__)
+            db.session.remove()
+    
+    def _write_activity(self, activity):
+        """Grava as atividades pendentes; em falha transitória elas voltam para a fila"""
+        from src.models import db
+        from src.models.visitor import Visitor
+        
+        if not activity:
+            return
+        
+        try:
+            Visitor.bulk_update_activity(activity)
+            db.session.commit()
+        except TRANSIENT_ERRORS:
+            db.session.rollback()
+            self.app.logger.warning('Falha ao gravar a atividade de %d visitantes, repetindo no próximo flush', len(activity))
+            with self._lock:
+                pending_activity = self._activity
+                self._activity = dict(activity)
+                self._merge_activity(self._activity, pending_activity)
+        except Exception:
+            # Só last_activity/etapa atual: o próximo evento de cada visitante grava de novo
+            db.session.rollback()
+            self.app.logger.exception('Atividade de %d visitantes descartada', len(activity))
+    
+    def _requeue(self, events, attempts):
+        """Devolve um lote que falhou para a fila de repetição, descartando o excesso"""
+        with self._lock:
+            self._retries.append((events, attempts))
+            overflow = sum(len(batch) for batch, _ in self._retries) + len(self._events) - self.max_pending
+            while overflow > 0 and self._retries:
+                # Descarta primeiro os lotes mais antigos
+                batch, _ = self._retries.pop(0)
+                self.dropped_events += len(batch)
+                overflow -= len(batch)
+    
+    def _dead_letter(self, events, error):
+        """Descarta eventos que não puderam ser gravados, registrando-os no log"""
+        self.dead_letter_events += len(events)
+        self.app.logger.error(
+            'Descartando %d eventos que não puderam ser gravados (%s): %s',
+            len(events), error, json.dumps(events, default=str)
+        )
+    
+    def shutdown(self, timeout=10.0):
+        """Interrompe a thread de flush e grava o que restou na fila"""
+        if os.getpid() != self._pid or self.app is None:
+            return
+        
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(timeout)
+        
+        deadline = time.monotonic() + timeout
+        while self.pending_count() and time.monotonic() < deadline:
+            if not self.flush():
+                break
+    
+    def pending_count(self):
+        """Retorna quantos eventos aguardam gravação"""
+        with self._lock:
+            return len(self._events) + sum(len(batch) for batch, _ in self._retries)
+
+event_buffer = EventBuffer()
@@ -0,0 +1,323 @@
+import atexit
+import inspect
+import json
+import os
+import select
+import threading
+import time
+from collections import Counter, defaultdict, deque
+
+# Canal do LISTEN/NOTIFY usado pelo backend 'postgres'
+NOTIFY_CHANNEL = 'funil_live_events'
+
+# Limite do payload de NOTIFY (8000 bytes no PostgreSQL), com folga
+NOTIFY_PAYLOAD_LIMIT = 7900
+
+# Drivers do PostgreSQL suportados pelo backend 'postgres' (psycopg 3 a partir da 3.2)
+NOTIFY_DRIVERS = ('psycopg2', 'psycopg')
+
+# Eventos de visitantes enviados por funil em cada mensagem 'events' (os demais só entram na contagem)
+EVENTS_PER_MESSAGE = 20
+
+# Mensagem enviada a um cliente lento cuja fila estourou: ele deve recarregar o estado pela API
+RESYNC_MESSAGE = {'type': 'resync', 'funnel_id': None, 'data': {}}
+
+class Subscription:
+    """Fila de mensagens de um cliente conectado ao stream ao vivo"""
+    
+    def __init__(self, funnel_id=None, max_size=1000):
+        self.funnel_id = funnel_id
+        self.max_size = max_size
+        self._messages = deque()
+        self._ready = threading.Condition()
+    
+    def deliver(self, message):
+        """Enfileira uma mensagem se ela for do funil acompanhado pelo cliente"""
+        if self.funnel_id and message.get('funnel_id') != self.funnel_id:
+            return
+        
+        with self._ready:
+            if len(self._messages) >= self.max_size:
+                # Cliente não acompanha o ritmo: descarta o atraso em vez de crescer sem limite
+                self._messages.clear()
+                self._messages.append(RESYNC_MESSAGE)
+            else:
+                self._messages.append(message)
+            self._ready.notify()
+    
+    def get(self, timeout):
+        """Retorna a próxima mensagem, ou None se nada chegar dentro do timeout"""
+        with self._ready:
+            if not self._messages:
+                self._ready.wait(timeout)
+            return self._messages.popleft() if self._messages else None
+
+class LiveEventBroker:
+    """Pub/sub em processo das mudanças acompanhadas pelo monitoramento ao vivo
+    
+    Cada cliente do stream SSE tem sua própria fila; publish() entrega a
+    mensagem às filas do worker atual. Com LIVE_EVENTS_BACKEND=postgres as
+    mensagens passam por NOTIFY/LISTEN do PostgreSQL, de modo que clientes
+    conectados a um worker recebem também o que chegou aos outros. Uma thread
+    por processo mantém a conexão de LISTEN e envia os NOTIFY em lote.
+    """
+    
+    def __init__(self, backend='local', queue_size=1000, max_clients=16, poll_interval=0.1):
+        self.app = None
+        self.enabled = True
+        self.backend = backend
+        self.queue_size = queue_size
+        self.max_clients = max_clients
+        self.poll_interval = poll_interval
+        self._reset_state()
+    
+    def _reset_state(self):
+        """Cria as estruturas do processo atual"""
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._subscriptions = set()
+        self._outgoing = deque(maxlen=self.queue_size * 10)
+        self._thread = None
+        self._stopped = False
+        self.published = 0
+        self.dropped = 0
+    
+    def init_app(self, app):
+        """Configura o broker a partir da configuração da aplicação"""
+        self.app = app
+        self.enabled = app.config.get('LIVE_EVENTS_ENABLED', self.enabled)
+        self.backend = app.config.get('LIVE_EVENTS_BACKEND', self.backend)
+        self.queue_size = app.config.get('LIVE_STREAM_QUEUE_SIZE', self.queue_size)
+        self.max_clients = app.config.get('LIVE_STREAM_MAX_CLIENTS', self.max_clients)
+        
+        if self.backend not in ('local', 'postgres'):
+            raise ValueError(f"LIVE_EVENTS_BACKEND inválido: '{self.backend}' (use 'local' ou 'postgres')")
+        
+        if self.enabled and self.backend == 'postgres':
+            self._check_driver(app.config['SQLALCHEMY_DATABASE_URI'])
+        
+        self._outgoing = deque(maxlen=self.queue_size * 10)
+        app.extensions['live_events'] = self
+        atexit.register(self.shutdown)
+    
+    @staticmethod
+    def _check_driver(database_uri):
+        """Falha na inicialização se o banco não usa um driver com LISTEN/NOTIFY suportado"""
+        from sqlalchemy.engine import make_url
+        
+        url = make_url(database_uri)
+        driver = url.get_driver_name() if url.get_backend_name() == 'postgresql' else None
+        if driver not in NOTIFY_DRIVERS:
+            raise ValueError(
+                f"LIVE_EVENTS_BACKEND=postgres exige PostgreSQL com psycopg2 ou psycopg (3.2+); "
+                f"SQLALCHEMY_DATABASE_URI usa '{url.drivername}'"
+            )
+        
+        if driver == 'psycopg':
+            import psycopg
+            
+            # notifies(timeout=...) só existe a partir do psycopg 3.2
+            if 'timeout' not in inspect.signature(psycopg.Connection.notifies).parameters:
+                raise ValueError(f'LIVE_EVENTS_BACKEND=postgres exige psycopg 3.2 ou superior (instalado: {psycopg.__version__})')
+    
+    def _check_process(self):
+        """Reinicia o estado após fork e garante a thread de LISTEN (chamar com o lock adquirido)"""
+        if os.getpid() != self._pid:
+            # Processo filho após fork: não herda clientes, fila nem conexão do pai
+            self._reset_state()
+        if self.backend == 'postgres' and (self._thread is None or not self._thread.is_alive()):
+            self._thread = threading.Thread(target=self._run, name='live-events-listen', daemon=True)
+            self._thread.start()
+    
+    def subscribe(self, funnel_id=None):
+        """Registra um cliente do stream; retorna None se o worker já atingiu LIVE_STREAM_MAX_CLIENTS"""
+        with self._lock:
+            self._check_process()
+            if len(self._subscriptions) >= self.max_clients:
+                return None
+            
+            subscription = Subscription(funnel_id, self.queue_size)
+            self._subscriptions.add(subscription)
+        
+        return subscription
+    
+    def unsubscribe(self, subscription):
+        """Remove um cliente desconectado"""
+        with self._lock:
+            self._subscriptions.discard(subscription)
+    
+    def _has_listeners(self):
+        # No backend 'postgres' os clientes podem estar em outros workers
+        return self.backend == 'postgres' or bool(self._subscriptions)
+    
+    def publish(self, message_type, data, funnel_id=None):
+        """Publica uma mensagem para os clientes do stream"""
+        self.publish_many([{'type': message_type, 'funnel_id': funnel_id, 'data': data}])
+    
+    def publish_many(self, messages):
+        """Publica várias mensagens ({type, funnel_id, data}) de uma vez"""
+        if not self.enabled or not messages or not self._has_listeners():
+            return
+        
+        if self.backend == 'postgres':
+            with self._lock:
+                self._check_process()
+                self._outgoing.extend(messages)
+        else:
+            self._dispatch(messages)
+        
+        self.published += len(messages)
+    
+    def publish_events(self, events):
+        """Publica eventos de visitantes recém-gravados, uma mensagem por funil
+        
+        Args:
+            events: Lista de dicionários com visitor_id, funnel_id, step_id, event_type e created_at
+        """
+        if not self.enabled or not events or not self._has_listeners():
+            return
+        
+        by_funnel = defaultdict(list)
+        for event in events:
+            by_funnel[event.get('funnel_id')].append(event)
+        
+        self.publish_many([
+            {
+                'type': 'events',
+                'funnel_id': funnel_id,
+                'data': {
+                    'count': len(funnel_events),
+                    'by_type': dict(Counter(event['event_type'] for event in funnel_events)),
+                    'events': [
+                        {
+                            'visitor_id': event['visitor_id'],
+                            'event_type': event['event_type'],
+                            'step_id': event.get('step_id'),
+                            'created_at': event['created_at'].isoformat() if event.get('created_at') else None
+                        }
+                        for event in funnel_events[-EVENTS_PER_MESSAGE:]
+                    ]
+                }
+            }
+            for funnel_id, funnel_events in by_funnel.items()
+        ])
+    
+    def _dispatch(self, messages):
+        """Entrega mensagens aos clientes conectados a este worker"""
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        
+        for subscription in subscriptions:
+            for message in messages:
+                subscription.deliver(message)
+    
+    def _payloads(self, messages):
+        """Agrupa mensagens em arrays JSON que cabem no limite de NOTIFY"""
+        batch, size = [], 2
+        for message in messages:
+            encoded = json.dumps(message, separators=(',', ':'), default=str)
+            length = len(encoded.encode('utf-8')) + 1
+            if length + 2 > NOTIFY_PAYLOAD_LIMIT:
+                self.dropped += 1
+                self.app.logger.warning('Mensagem ao vivo %s excede o limite de NOTIFY e foi descartada', message['type'])
+                continue
+            if size + length > NOTIFY_PAYLOAD_LIMIT:
+                yield '[' + ','.join(batch) + ']'
+                batch, size = [], 2
+            batch.append(encoded)
+            size += length
+        
+        if batch:
+            yield '[' + ','.join(batch) + ']'
+    
+    def _run(self):
+        while not self._stopped:
+            try:
+                self._listen()
+            except Exception:
+                self.app.logger.exception('Falha na conexão LISTEN/NOTIFY das mensagens ao vivo')
+                time.sleep(5)
+    
+    def _listen(self):
+        """Mantém a conexão de LISTEN: envia os NOTIFY pendentes e entrega os recebidos"""
+        from src.models import db
+        
+        with self.app.app_context():
+            connection = db.engine.raw_connection()
+        # Conexão dedicada, fora do pool: fica em autocommit enquanto o processo viver
+        connection.detach()
+        
+        try:
+            driver = connection.driver_connection
+            driver.autocommit = True
+            cursor = driver.cursor()
+            cursor.execute(f'LISTEN {NOTIFY_CHANNEL}')
+            
+            while not self._stopped:
+                with self._lock:
+                    messages = list(self._outgoing)
+                    self._outgoing.clear()
+                
+                for payload in self._payloads(messages):
+                    cursor.execute('SELECT pg_notify(%s, %s)', (NOTIFY_CHANNEL, payload))
+                
+                for payload in self._received(driver):
+                    self._dispatch(json.loads(payload))
+        finally:
+            connection.close()
+    
+    def _received(self, driver):
+        """Payloads dos NOTIFY que chegarem em até poll_interval segundos"""
+        if type(driver).__module__.startswith('psycopg2'):
+            if select.select([driver], [], [], self.poll_interval)[0]:
+                driver.poll()
+                while driver.notifies:
+                    yield driver.notifies.pop(0).payload
+            return
+        
+        # psycopg 3: o gerador encerra quando o timeout expira
+        for notify in driver.notifies(timeout=self.poll_interval):
+            yield notify.payload
+    
+    def stats(self):
+        """Retorna as métricas do stream ao vivo deste worker"""
+        with self._lock:
+            return {
+                'backend': self.backend,
+                'clients': len(self._subscriptions),
+                'max_clients': self.max_clients,
+                'published': self.published,
+                'dropped': self.dropped
+            }
+    
+    def shutdown(self, timeout=2.0):
+        """Interrompe a thread de LISTEN"""
+        if os.getpid() != self._pid or self._thread is None:
+            return
+        
+        self._stopped = True
+        self._thread.join(timeout)
+
+def iter_sse(subscription, broker, keepalive=15, max_duration=300, retry_ms=3000):
+    """Gera o stream text/event-stream de uma assinatura
+    
+    Envia um comentário de keepalive quando não há mensagens, para que proxies
+    não fechem a conexão e clientes desconectados sejam detectados, e encerra
+    após max_duration segundos; o EventSource do navegador reconecta sozinho.
+    """
+    try:
+        yield f'retry: {retry_ms}\n\n'
+        deadline = time.monotonic() + max_duration
+        
+        while time.monotonic() < deadline:
+            message = subscription.get(timeout=keepalive)
+            if message is None:
+                yield ': keepalive\n\n'
+                continue
+            
+            data = json.dumps(message, separators=(',', ':'), ensure_ascii=False, default=str)
+            yield f"event: {message['type']}\ndata: {data}\n\n"
+    finally:
+        broker.unsubscribe(subscription)
+
+live_events = LiveEventBroker()
@@ -0,0 +1,117 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from src.services.cache_versions import SharedCacheVersions
+
+class PixelScriptCache:
+    """Cache LRU com TTL dos scripts de pixels renderizados por (funnel_id, step_id)
+    
+    Cada entrada guarda o HTML pronto e o seu ETag (hash do conteúdo), de modo
+    que a rota pública de renderização não consulta o banco nem monta os
+    scripts a cada visualização de página. O CRUD de pixels invalida as
+    entradas do funil no worker que atendeu a alteração e incrementa a versão
+    do funil em cache_versions; os demais workers a conferem no máximo a cada
+    version_check_interval segundos.
+    """
+    
+    def __init__(self, max_size=10000, ttl=60, version_check_interval=1.0):
+        self.enabled = True
+        self.max_size = max_size
+        self.ttl = ttl
+        self.shared = SharedCacheVersions('pixels', version_check_interval)
+        self._entries = OrderedDict()
+        self._funnel_versions = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+    
+    def init_app(self, app):
+        """Configura o cache a partir da configuração da aplicação"""
+        self.enabled = app.config.get('PIXEL_CACHE_ENABLED', self.enabled)
+        self.max_size = app.config.get('PIXEL_CACHE_MAX_SIZE', self.max_size)
+        self.ttl = app.config.get('PIXEL_CACHE_TTL', self.ttl)
+        self.shared.check_interval = app.config.get('PIXEL_CACHE_VERSION_CHECK_INTERVAL', self.shared.check_interval)
+        app.extensions['pixel_cache'] = self
+    
+    @staticmethod
+    def etag(body):
+        """ETag forte derivado do conteúdo renderizado"""
+        return hashlib.sha256(body.encode('utf-8')).hexdigest()[:32]
+    
+    def get_or_render(self, funnel_id, step_id, render):
+        """Retorna (html, etag) de uma etapa, renderizando com render() quando ausente ou expirado"""
+        if not self.enabled:
+            body = render()
+            return body, self.etag(body)
+        
+        # Invalidações feitas pelos outros workers
+        changed = self.shared.changed()
+        if changed:
+            self._expire(*changed)
+        
+        key = (funnel_id, step_id)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry['expires_at'] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry['body'], entry['etag']
+            
+            self.misses += 1
+            version = self._funnel_versions.get(funnel_id, 0)
+        
+        body = render()
+        etag = self.etag(body)
+        
+        with self._lock:
+            # Uma invalidação durante a renderização descarta o resultado
+            if self._funnel_versions.get(funnel_id, 0) == version:
+                self._entries[key] = {'body': body, 'etag': etag, 'expires_at': time.monotonic() + self.ttl}
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        
+        return body, etag
+    
+    def invalidate(self, *funnel_ids):
+        """Remove as entradas dos funis informados, neste e nos demais workers"""
+        self._expire(*funnel_ids)
+        
+        funnel_ids = [funnel_id for funnel_id in funnel_ids if funnel_id is not None]
+        if self.enabled and funnel_ids:
+            self.shared.publish(funnel_ids)
+    
+    def _expire(self, *funnel_ids):
+        """Remove as entradas locais dos funis informados"""
+        funnel_ids = set(funnel_ids)
+        with self._lock:
+            self.invalidations += 1
+            for funnel_id in funnel_ids:
+                self._funnel_versions[funnel_id] = self._funnel_versions.get(funnel_id, 0) + 1
+            
+            for key in [key for key in self._entries if key[0] in funnel_ids]:
+                del self._entries[key]
+    
+    def clear(self):
+        """Esvazia o cache"""
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self):
+        """Retorna as métricas de acerto do cache"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'hit_rate': round(self.hits / lookups * 100, 2) if lookups else 0
+            }
+
+pixel_cache = PixelScriptCache()
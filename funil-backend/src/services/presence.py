@@ -0,0 +1,220 @@
+import atexit
+import heapq
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from src.services.live_events import live_events
+
+class PresenceTracker:
+    """Presença em memória dos visitantes online
+    
+    Guarda o último heartbeat de cada visitante em um heap ordenado por tempo,
+    de modo que a expiração custa O(log n) por visitante, e mantém contadores
+    por (funnel_id, step_id) para responder "quem está online" sem consultar
+    o banco. Periodicamente marca como offline, na tabela visitors, quem
+    expirou e incorpora a atividade gravada pelos outros workers, lida pelo
+    horário de gravação (visitors.updated_at) e não pelo last_activity, que
+    vem do cliente e chega ao banco com o atraso do agrupador/buffer.
+    
+    Cada entrada guarda também changed_at, o horário (do servidor, sempre
+    crescente no processo) em que este worker registrou a mudança. É a base
+    dos cursores incrementais: o heartbeat traz o horário do cliente e a
+    atividade de outros workers chega com atraso.
+    """
+    
+    def __init__(self, timeout=300, sync_interval=15):
+        self.app = None
+        self.enabled = False
+        self.timeout = timeout
+        self.sync_interval = sync_interval
+        self._reset_state()
+    
+    def _reset_state(self):
+        """Cria as estruturas do processo atual"""
+        self._pid = os.getpid()
+        self._lock = threading.RLock()
+        self._sync_lock = threading.Lock()
+        self._entries = {}
+        self._heap = []
+        self._counts = Counter()
+        self._offline = set()
+        self._synced_until = None
+        self._last_change = datetime.min
+        self._thread = None
+        self._stopped = False
+    
+    def init_app(self, app):
+        """Configura o rastreador a partir da configuração da aplicação"""
+        self.app = app
+        self.enabled = app.config.get('PRESENCE_ENABLED', False)
+        self.timeout = app.config.get('PRESENCE_TIMEOUT', self.timeout)
+        self.sync_interval = app.config.get('PRESENCE_SYNC_INTERVAL', self.sync_interval)
+        app.extensions['presence'] = self
+        atexit.register(self.shutdown)
+    
+    def _check_process(self):
+        if os.getpid() != self._pid:
+            # Processo filho após fork: começa vazio e sincroniza com o banco
+            self._reset_state()
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='presence-sync', daemon=True)
+            self._thread.start()
+    
+    def heartbeat(self, visitor_id, funnel_id=None, step_id=None, seen_at=None):
+        """Registra atividade de um visitante (a gravação de last_activity fica com quem chama)"""
+        if not self.enabled:
+            return
+        
+        changed = self._record(visitor_id, funnel_id, step_id, seen_at or datetime.utcnow())
+        if changed is not None:
+            _, funnel_id, step_id, _ = changed
+            live_events.publish('presence', {'visitor_id': visitor_id, 'status': 'online', 'step_id': step_id}, funnel_id)
+    
+    def _record(self, visitor_id, funnel_id, step_id, seen_at):
+        """Atualiza a entrada do visitante; retorna a nova entrada se ele ficou online ou mudou de etapa"""
+        with self._lock:
+            self._check_process()
+            current = self._entries.get(visitor_id)
+            if current is not None:
+                if seen_at < current[0]:
+                    return None
+                funnel_id = funnel_id or current[1]
+                step_id = step_id or current[2]
+                if (seen_at, funnel_id, step_id) == current[:3]:
+                    return None  # Atividade já conhecida (ex.: relida na sincronização)
+                self._counts[(current[1], current[2])] -= 1
+            
+            # Horário do servidor, nunca menor que o da mudança anterior
+            self._last_change = max(datetime.utcnow(), self._last_change)
+            new_entry = self._entries[visitor_id] = (seen_at, funnel_id, step_id, self._last_change)
+            self._counts[(funnel_id, step_id)] += 1
+            heapq.heappush(self._heap, (seen_at, visitor_id))
+            self._offline.discard(visitor_id)
+            
+            # Entradas antigas do heap são descartadas na expiração; compacta se acumular demais
+            if len(self._heap) > 2 * len(self._entries) + 1024:
+                self._heap = [(entry[0], key) for key, entry in self._entries.items()]
+                heapq.heapify(self._heap)
+        
+        return new_entry if current is None or current[2] != step_id else None
+    
+    def _expire(self, now=None):
+        """Remove visitantes sem heartbeat dentro do timeout (chamar com o lock adquirido)"""
+        cutoff = (now or datetime.utcnow()) - timedelta(seconds=self.timeout)
+        
+        while self._heap and self._heap[0][0] < cutoff:
+            seen_at, visitor_id = heapq.heappop(self._heap)
+            current = self._entries.get(visitor_id)
+            if current is None or current[0] != seen_at:
+                continue  # Heartbeat substituído por um mais recente
+            
+            del self._entries[visitor_id]
+            self._counts[(current[1], current[2])] -= 1
+            if not self._counts[(current[1], current[2])]:
+                del self._counts[(current[1], current[2])]
+            self._offline.add(visitor_id)
+    
+    def online_entries(self, funnel_id=None, since=None):
+        """Retorna (último_heartbeat, visitor_id, changed_at) dos visitantes online, do mais recente para o mais antigo
+        
+        Args:
+            since: Se informado, só visitantes registrados (changed_at) depois deste instante
+        """
+        with self._lock:
+            self._check_process()
+            self._expire()
+            entries = [
+                (entry[0], visitor_id, entry[3]) for visitor_id, entry in self._entries.items()
+                if (not funnel_id or entry[1] == funnel_id) and (since is None or entry[3] > since)
+            ]
+        
+        return sorted(entries, reverse=True)
+    
+    def online_visitor_ids(self, funnel_id=None):
+        """Retorna os IDs dos visitantes online, do mais recente para o mais antigo"""
+        return [visitor_id for _, visitor_id, _ in self.online_entries(funnel_id)]
+    
+    def online_counts(self, funnel_id=None):
+        """Retorna o total de visitantes online e a distribuição por etapa"""
+        with self._lock:
+            self._check_process()
+            self._expire()
+            by_step = Counter()
+            for (entry_funnel_id, step_id), count in self._counts.items():
+                if count and (not funnel_id or entry_funnel_id == funnel_id):
+                    by_step[step_id] += count
+        
+        return {
+            'total': sum(by_step.values()),
+            'by_step': [{'step_id': step_id, 'count': count} for step_id, count in by_step.items()]
+        }
+    
+    def _run(self):
+        while not self._stopped:
+            self.sync()
+            time.sleep(self.sync_interval)
+    
+    def sync(self):
+        """Grava os visitantes que ficaram offline e incorpora a atividade registrada por outros workers"""
+        if self.app is None:
+            return
+        
+        from src.models import db
+        from src.models.visitor import SINCE_OVERLAP, Visitor
+        
+        with self._sync_lock:
+            with self._lock:
+                self._expire()
+                offline, self._offline = self._offline, set()
+            
+            now = datetime.utcnow()
+            online_after = now - timedelta(seconds=self.timeout)
+            
+            with self.app.app_context():
+                try:
+                    went_offline = Visitor.bulk_mark_offline(offline, online_after)
+                    db.session.commit()
+                    
+                    query = db.select(
+                        Visitor.id, Visitor.funnel_id, Visitor.current_step_id, Visitor.last_activity, Visitor.updated_at
+                    ).where(Visitor.last_activity > online_after, Visitor.is_online == True)
+                    if self._synced_until is not None:
+                        # Só o que foi gravado desde a sincronização anterior; a sobreposição
+                        # cobre transações confirmadas fora da ordem de updated_at
+                        query = query.where(Visitor.updated_at > self._synced_until - SINCE_OVERLAP)
+                    recent = db.session.execute(query).all()
+                except Exception:
+                    db.session.rollback()
+                    self.app.logger.exception('Falha ao sincronizar presença de visitantes')
+                    with self._lock:
+                        self._offline |= offline - set(self._entries)
+                    return
+                finally:
+                    db.session.remove()
+            
+            live_events.publish_many([
+                {'type': 'presence', 'funnel_id': funnel_id, 'data': {'visitor_id': visitor_id, 'status': 'offline'}}
+                for visitor_id, funnel_id in went_offline
+            ])
+            
+            # Atividade vinda de outros workers, que já a anunciaram no stream ao vivo
+            for visitor_id, funnel_id, step_id, last_activity, _ in recent:
+                self._record(visitor_id, funnel_id, step_id, last_activity)
+            
+            written = [row.updated_at for row in recent if row.updated_at is not None]
+            if written:
+                self._synced_until = max(written + [self._synced_until or datetime.min])
+            elif self._synced_until is None:
+                self._synced_until = now
+    
+    def shutdown(self):
+        """Interrompe a sincronização periódica gravando os visitantes offline pendentes"""
+        if os.getpid() != self._pid or self._thread is None:
+            return
+        
+        self._stopped = True
+        self.sync()
+
+presence = PresenceTracker()
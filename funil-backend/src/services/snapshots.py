@@ -0,0 +1,112 @@
+import time
+from datetime import datetime
+from flask import current_app
+
+def compute_dashboard(funnel_id=None):
+    """Calcula os dados do dashboard de um funil (ou de todos, com funnel_id None)"""
+    from src.models.funnel import Funnel
+    from src.models.payment import Payment
+    from src.models.visitor import Visitor
+    from src.models.visitor_event import VisitorEvent
+    from src.models.visitor_sketch import VisitorSketch
+    
+    # Exemplo de dados para o dashboard
+    total_funnels = Funnel.query.count()
+    total_visitors = Visitor.query.count()
+    unique_visitors_today = VisitorSketch.unique_visitors(funnel_id=funnel_id)["total"]
+    online_visitors = Visitor.get_online_visitors(funnel_id=funnel_id)
+    online_counts = Visitor.get_online_counts(funnel_id=funnel_id)
+    
+    # Obter estatísticas de conversão do funil
+    conversion_data = []
+    if funnel_id:
+        conversion_data = VisitorEvent.get_conversion_funnel(funnel_id)
+    
+    # Obter estatísticas de receita (exemplo, precisa de mais dados de pagamento)
+    revenue_stats = Payment.get_revenue_stats(funnel_id=funnel_id)
+    
+    return {
+        "total_funnels": total_funnels,
+        "total_visitors": total_visitors,
+        "unique_visitors_today": unique_visitors_today,
+        "online_visitors_count": online_counts["total"],
+        "online_by_step": online_counts["by_step"],
+        "online_visitors": Visitor.to_dict_many(online_visitors),
+        "conversion_data": conversion_data,
+        "revenue_stats": revenue_stats
+    }
+
+def compute_hourly(funnel_id=None):
+    """Calcula as estatísticas por hora do dia atual"""
+    from src.models.visitor_event import VisitorEvent
+    
+    return VisitorEvent.get_hourly_stats(funnel_id=funnel_id)
+
+# Tipos de snapshot mantidos pelo worker e as funções que os calculam
+SNAPSHOT_BUILDERS = {
+    'dashboard': compute_dashboard,
+    'hourly': compute_hourly,
+}
+
+def refresh_snapshots():
+    """Recalcula e grava os snapshots de todos os funis ativos e da visão geral
+    
+    Retorna (snapshots_gravados, falhas). Cada funil é confirmado separadamente,
+    então uma falha não descarta os demais.
+    """
+    from src.models import db
+    from src.models.analytics_snapshot import AnalyticsSnapshot
+    from src.models.event_rollup import EventHourlyRollup
+    from src.models.funnel import Funnel
+    from src.models.visitor_sketch import VisitorSketch
+    from src.services.presence import presence
+    
+    if presence.enabled:
+        # O worker não recebe heartbeats: atualiza a presença a partir do banco
+        presence.sync()
+    
+    # Consolida os parciais da ingestão antes de calcular as estatísticas
+    for merge in (EventHourlyRollup.merge_deltas, VisitorSketch.merge_deltas):
+        try:
+            merge()
+        except Exception:
+            db.session.rollback()
+            current_app.logger.exception('Falha ao consolidar os parciais (%s)', merge.__qualname__)
+    
+    written = 0
+    failures = 0
+    
+    # None representa a visão geral, sem filtro de funil
+    funnel_ids = [None] + list(db.session.scalars(
+        db.select(Funnel.id).where(Funnel.is_active == True).order_by(Funnel.id)
+    ))
+    
+    for funnel_id in funnel_ids:
+        try:
+            computed_at = datetime.utcnow()
+            for kind, build in SNAPSHOT_BUILDERS.items():
+                AnalyticsSnapshot.store(funnel_id, kind, build(funnel_id), computed_at)
+            db.session.commit()
+            written += len(SNAPSHOT_BUILDERS)
+        except Exception:
+            db.session.rollback()
+            failures += 1
+            current_app.logger.exception('Falha ao calcular snapshots do funil %s', funnel_id)
+    
+    # Devolve a conexão ao pool entre os ciclos
+    db.session.remove()
+    
+    return written, failures
+
+def run_snapshot_worker(interval, once=False, log=print):
+    """Laço do worker: recalcula os snapshots a cada interval segundos"""
+    while True:
+        started = time.monotonic()
+        written, failures = refresh_snapshots()
+        elapsed = time.monotonic() - started
+        log(f'{written} snapshots gravados em {elapsed:.1f}s' + (f' ({failures} funis com falha)' if failures else ''))
+        
+        if once:
+            return
+        
+        time.sleep(max(interval - elapsed, 0))
@@ -0,0 +1,148 @@
+import threading
+import time
+from collections import OrderedDict
+
+class VisitorSessionCache:
+    """Cache LRU com TTL para a resolução session_id -> visitor_id
+    
+    Sessões ainda não cacheadas são resolvidas (e criadas, se necessário) em
+    lote via Visitor.resolve_sessions. Requisições simultâneas da mesma sessão
+    nova aguardam a primeira resolução em vez de tentar inserir o visitante
+    de novo.
+    """
+    
+    def __init__(self, max_size=50000, ttl=1800):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def init_app(self, app):
+        """Configura o cache a partir da configuração da aplicação"""
+        self.max_size = app.config.get('VISITOR_CACHE_MAX_SIZE', self.max_size)
+        self.ttl = app.config.get('VISITOR_CACHE_TTL', self.ttl)
+        app.extensions['visitor_cache'] = self
+    
+    def _get(self, session_id, now):
+        """Lê uma entrada válida (chamar com o lock adquirido)"""
+        entry = self._entries.get(session_id)
+        if entry is None:
+            return None
+        
+        visitor_id, expires_at = entry
+        if expires_at < now:
+            del self._entries[session_id]
+            return None
+        
+        self._entries.move_to_end(session_id)
+        return visitor_id
+    
+    def _set(self, session_id, visitor_id, now):
+        """Grava uma entrada e aplica o limite LRU (chamar com o lock adquirido)"""
+        self._entries[session_id] = (visitor_id, now + self.ttl)
+        self._entries.move_to_end(session_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+    
+    def resolve(self, sessions, timeout=5.0):
+        """Retorna {session_id: visitor_id}, criando os visitantes que não existem
+        
+        Args:
+            sessions: Dicionário {session_id: dados_do_visitante} (ver Visitor.resolve_sessions)
+        """
+        from src.models import db
+        from src.models.visitor import Visitor
+        
+        resolved = {}
+        owned = []
+        waiting = []
+        done = threading.Event()
+        now = time.monotonic()
+        
+        with self._lock:
+            for session_id in sessions:
+                visitor_id = self._get(session_id, now)
+                if visitor_id is not None:
+                    self.hits += 1
+                    resolved[session_id] = visitor_id
+                    continue
+                
+                self.misses += 1
+                if session_id in self._inflight:
+                    waiting.append((session_id, self._inflight[session_id]))
+                else:
+                    self._inflight[session_id] = done
+                    owned.append(session_id)
+        
+        if owned:
+            found = None
+            try:
+                found = Visitor.resolve_sessions({session_id: sessions[session_id] for session_id in owned})
+                # Visitantes novos são confirmados antes de ficarem visíveis no cache
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            finally:
+                with self._lock:
+                    now = time.monotonic()
+                    for session_id in owned:
+                        if found and session_id in found:
+                            self._set(session_id, found[session_id], now)
+                        self._inflight.pop(session_id, None)
+                done.set()
+            resolved.update(found)
+        
+        retry = {}
+        for session_id, event in waiting:
+            event.wait(timeout)
+            with self._lock:
+                visitor_id = self._get(session_id, time.monotonic())
+            if visitor_id is None:
+                retry[session_id] = sessions[session_id]
+            else:
+                resolved[session_id] = visitor_id
+        
+        if retry:
+            # A resolução concorrente falhou ou expirou: resolve direto no banco
+            found = Visitor.resolve_sessions(retry)
+            db.session.commit()
+            with self._lock:
+                now = time.monotonic()
+                for session_id, visitor_id in found.items():
+                    self._set(session_id, visitor_id, now)
+            resolved.update(found)
+        
+        return resolved
+    
+    def discard(self, session_ids):
+        """Remove sessões do cache"""
+        with self._lock:
+            for session_id in session_ids:
+                self._entries.pop(session_id, None)
+    
+    def clear(self):
+        """Esvazia o cache"""
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self):
+        """Retorna as métricas de acerto do cache"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups * 100, 2) if lookups else 0
+            }
+
+visitor_cache = VisitorSessionCache()
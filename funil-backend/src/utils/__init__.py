@@ -0,0 +1 @@
+# Funções utilitárias compartilhadas pelos modelos e rotas
@@ -0,0 +1,50 @@
+from datetime import datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo
+from flask import current_app
+from src.models import db
+
+def get_report_timezone(name=None):
+    """Retorna o fuso horário usado nos relatórios (REPORT_TIMEZONE por padrão)"""
+    return ZoneInfo(name or current_app.config.get('REPORT_TIMEZONE', 'UTC'))
+
+def utc_to_local(value, tz):
+    """Converte um datetime UTC sem fuso (como gravado no banco) para o horário local"""
+    return value.replace(tzinfo=timezone.utc).astimezone(tz)
+
+def local_to_utc(value, tz):
+    """Converte um datetime local sem fuso para UTC sem fuso (formato do banco)"""
+    return value.replace(tzinfo=tz).astimezone(timezone.utc).replace(tzinfo=None)
+
+def local_day_range_utc(first_day, last_day, tz):
+    """Retorna [início, fim) em UTC cobrindo os dias locais first_day..last_day"""
+    start = local_to_utc(datetime.combine(first_day, time.min), tz)
+    end = local_to_utc(datetime.combine(last_day + timedelta(days=1), time.min), tz)
+    return start, end
+
+def local_date_bucket(column, tz):
+    """Expressão SQL que agrupa uma coluna DateTime UTC por data local
+    
+    No PostgreSQL converte com AT TIME ZONE. O SQLite não conhece fusos:
+    agrupa por hora UTC e a data local é resolvida em Python com local_date_of.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        # Literais (e não parâmetros) para o GROUP BY casar com a expressão do SELECT
+        local = db.func.timezone(db.literal_column(f"'{tz.key}'"), db.func.timezone(db.literal_column("'UTC'"), column))
+        return db.func.date(local)
+    return db.func.strftime('%Y-%m-%d %H:00:00', column)
+
+def local_date_of(bucket, tz):
+    """Converte o valor de local_date_bucket na data local correspondente"""
+    if isinstance(bucket, str):
+        if len(bucket) == 10:
+            return datetime.strptime(bucket, '%Y-%m-%d').date()
+        return utc_to_local(datetime.strptime(bucket, '%Y-%m-%d %H:%M:%S'), tz).date()
+    if isinstance(bucket, datetime):
+        return utc_to_local(bucket, tz).date()
+    return bucket
+
+def epoch_seconds(column):
+    """Expressão SQL com os segundos desde 1970 de uma coluna DateTime UTC (inteiro)"""
+    if db.engine.dialect.name == 'sqlite':
+        return db.cast(db.func.strftime(db.literal_column("'%s'"), column), db.BigInteger)
+    return db.cast(db.extract('epoch', column), db.BigInteger)
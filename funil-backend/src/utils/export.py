@@ -0,0 +1,122 @@
+import csv
+import io
+import json
+import zlib
+from datetime import date, datetime
+from decimal import Decimal
+from src.models import db
+from src.utils.dates import get_report_timezone, local_day_range_utc
+
+# Linhas lidas por lote do cursor do servidor
+EXPORT_CHUNK_SIZE = 5000
+
+EXPORT_FORMATS = ('csv', 'ndjson')
+
+def _datasets():
+    """Tabelas exportáveis: nome -> (modelo, coluna de data usada nos filtros)"""
+    from src.models.payment import Payment
+    from src.models.visitor import Visitor
+    from src.models.visitor_event import VisitorEvent
+    
+    return {
+        'events': (VisitorEvent, 'created_at'),
+        'visitors': (Visitor, 'first_visit'),
+        'payments': (Payment, 'created_at'),
+    }
+
+def export_datasets():
+    """Nomes das tabelas exportáveis"""
+    return list(_datasets())
+
+def export_columns(dataset):
+    """Colunas disponíveis de uma tabela exportável"""
+    model, _ = _datasets()[dataset]
+    return [column.name for column in model.__table__.columns]
+
+def build_export_query(dataset, columns=None, funnel_id=None, start_date=None, end_date=None):
+    """Monta o SELECT da exportação, ordenado por id
+    
+    Args:
+        columns: Colunas na ordem de saída (todas por padrão)
+        start_date, end_date: Datas (inclusivas) no fuso de REPORT_TIMEZONE
+    """
+    if dataset not in _datasets():
+        raise ValueError(f"Unknown dataset '{dataset}'. Use {', '.join(export_datasets())}")
+    
+    model, date_column = _datasets()[dataset]
+    table = model.__table__
+    columns = columns or export_columns(dataset)
+    
+    invalid = [column for column in columns if column not in table.c]
+    if invalid:
+        raise ValueError(f"Unknown columns for {dataset}: {', '.join(invalid)}")
+    
+    query = db.select(*(table.c[column] for column in columns)).order_by(table.c.id)
+    
+    if funnel_id:
+        query = query.where(table.c.funnel_id == funnel_id)
+    
+    if start_date or end_date:
+        range_start, range_end = local_day_range_utc(start_date or end_date, end_date or start_date, get_report_timezone())
+        if start_date:
+            query = query.where(table.c[date_column] >= range_start)
+        if end_date:
+            query = query.where(table.c[date_column] < range_end)
+    
+    return query, columns
+
+def _json_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+def _csv_value(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return _json_value(value)
+
+def _encode_chunk(rows, columns, export_format, header=False):
+    """Serializa um lote de linhas em CSV ou NDJSON"""
+    if export_format == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if header:
+            writer.writerow(columns)
+        writer.writerows([_csv_value(value) for value in row] for row in rows)
+        return buffer.getvalue().encode('utf-8')
+    
+    return ''.join(
+        json.dumps({column: _json_value(value) for column, value in zip(columns, row)}, ensure_ascii=False) + '\n'
+        for row in rows
+    ).encode('utf-8')
+
+def iter_export(dataset, export_format='csv', columns=None, funnel_id=None, start_date=None, end_date=None,
+                compress=False, chunk_size=EXPORT_CHUNK_SIZE):
+    """Gera a exportação em blocos de bytes, lendo o banco em lotes de um cursor do servidor
+    
+    A memória usada depende só de chunk_size, não do tamanho da tabela. Com
+    compress=True os blocos saem comprimidos em gzip à medida que são gerados.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown format '{export_format}'. Use {', '.join(EXPORT_FORMATS)}")
+    
+    query, columns = build_export_query(dataset, columns, funnel_id, start_date, end_date)
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None
+    
+    def emit(data):
+        return compressor.compress(data) if compressor else data
+    
+    header = export_format == 'csv'
+    if header:
+        yield emit(_encode_chunk([], columns, export_format, header=True))
+    
+    result = db.session.connection().execute(query.execution_options(yield_per=chunk_size))
+    for rows in result.partitions():
+        data = emit(_encode_chunk(rows, columns, export_format))
+        if data:
+            yield data
+    
+    if compressor:
+        yield compressor.flush()
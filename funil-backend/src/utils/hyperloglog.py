@@ -0,0 +1,108 @@
+import hashlib
+import math
+import numpy as np
+
+# Precisão padrão: 2^14 registradores, erro padrão de ~0,81%
+DEFAULT_PRECISION = 14
+
+# Formatos de serialização (primeiro byte)
+FORMAT_SPARSE = 1
+FORMAT_DENSE = 2
+
+# Entrada do formato esparso: índice (uint16 big-endian) + valor do registrador
+SPARSE_ENTRY = np.dtype([('index', '>u2'), ('rank', 'u1')])
+
+class HyperLogLog:
+    """Sketch HyperLogLog para contagem aproximada de elementos distintos
+    
+    Sketches com a mesma precisão podem ser unidos com merge (máximo por
+    registrador), o que permite guardar um sketch por dia e somar qualquer
+    período na consulta. Serializa no formato esparso (índice + valor dos
+    registradores preenchidos) enquanto ele for menor que o denso. União,
+    estimativa e serialização operam sobre todos os registradores com numpy.
+    """
+    
+    def __init__(self, precision=DEFAULT_PRECISION):
+        if not 4 <= precision <= 16:
+            raise ValueError('precision deve estar entre 4 e 16')
+        
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = np.zeros(self.m, dtype=np.uint8)
+    
+    @staticmethod
+    def _hash(value):
+        digest = hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest()
+        return int.from_bytes(digest, 'big')
+    
+    def add(self, value):
+        """Adiciona um elemento ao sketch"""
+        hashed = self._hash(value)
+        index = hashed >> (64 - self.precision)
+        remaining = hashed & ((1 << (64 - self.precision)) - 1)
+        # Posição do primeiro bit 1 nos bits restantes
+        rank = (64 - self.precision) - remaining.bit_length() + 1
+        
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+    
+    def update(self, values):
+        """Adiciona vários elementos ao sketch"""
+        for value in values:
+            self.add(value)
+    
+    def merge(self, other):
+        """Une outro sketch a este (máximo por registrador)"""
+        if other.precision != self.precision:
+            raise ValueError('Não é possível unir sketches com precisões diferentes')
+        
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+    
+    def count(self):
+        """Retorna a estimativa do número de elementos distintos"""
+        m = self.m
+        if m >= 128:
+            alpha = 0.7213 / (1 + 1.079 / m)
+        else:
+            alpha = {16: 0.673, 32: 0.697, 64: 0.709}[m]
+        
+        estimate = alpha * m * m / np.ldexp(1.0, -self.registers.astype(np.int32)).sum()
+        
+        # Correção para cardinalidades pequenas (linear counting)
+        zeros = self.m - np.count_nonzero(self.registers)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        
+        return int(round(estimate))
+    
+    def to_bytes(self):
+        """Serializa o sketch no formato mais compacto"""
+        filled = np.flatnonzero(self.registers)
+        
+        if len(filled) * 3 < self.m:
+            body = np.empty(len(filled), dtype=SPARSE_ENTRY)
+            body['index'] = filled
+            body['rank'] = self.registers[filled]
+            return bytes((FORMAT_SPARSE, self.precision)) + body.tobytes()
+        
+        return bytes((FORMAT_DENSE, self.precision)) + self.registers.tobytes()
+    
+    @classmethod
+    def from_bytes(cls, data):
+        """Reconstrói um sketch serializado com to_bytes"""
+        if not data:
+            return cls()
+        
+        sketch_format, precision = data[0], data[1]
+        sketch = cls(precision)
+        
+        if sketch_format == FORMAT_DENSE:
+            sketch.registers[:] = np.frombuffer(data, dtype=np.uint8, offset=2)
+        elif sketch_format == FORMAT_SPARSE:
+            body = np.frombuffer(data, dtype=SPARSE_ENTRY, offset=2)
+            sketch.registers[body['index']] = body['rank']
+        else:
+            raise ValueError(f'Formato de sketch desconhecido: {sketch_format}')
+        
+        return sketch
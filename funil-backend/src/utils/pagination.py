@@ -0,0 +1,91 @@
+import base64
+import json
+from datetime import datetime
+from flask import jsonify
+from src.models import db
+
+# Itens por página quando limit não é informado e maior limit aceito
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+def page_limit(value):
+    """Converte o parâmetro limit, limitado a [1, MAX_PAGE_SIZE]"""
+    if value in (None, ''):
+        return DEFAULT_PAGE_SIZE
+    
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise ValueError('limit must be an integer')
+    
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+def encode_cursor(values):
+    """Codifica os valores de ordenação do último item em um token opaco"""
+    payload = json.dumps(
+        [value.isoformat() if isinstance(value, datetime) else value for value in values],
+        separators=(',', ':')
+    )
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+def _decode_value(column, value):
+    """Converte um valor do cursor para o tipo da coluna, rejeitando tipos incompatíveis"""
+    if isinstance(column.type, db.DateTime):
+        return datetime.fromisoformat(value)
+    
+    if isinstance(column.type, db.Integer):
+        # bool é subclasse de int, mas não é um id válido
+        if not isinstance(value, int) or isinstance(value, bool):
+            raise ValueError
+        return value
+    
+    if not isinstance(value, str):
+        raise ValueError
+    return value
+
+def decode_cursor(token, columns):
+    """Decodifica um token de encode_cursor para as colunas de ordenação informadas"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError
+        return [_decode_value(column, value) for column, value in zip(columns, values)]
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+
+def keyset_filter(columns, values, descending=False):
+    """Condição "depois do cursor" para a ordenação por columns (comparação de tuplas)"""
+    key = db.tuple_(*columns)
+    bound = db.tuple_(*(db.literal(value, column.type) for column, value in zip(columns, values)))
+    return key < bound if descending else key > bound
+
+def paginate_keyset(query, columns, limit, cursor=None, descending=False):
+    """Retorna (itens, próximo_cursor) de uma página de query ordenada por columns
+    
+    O cursor guarda os valores de ordenação do último item devolvido, então
+    cada página é uma busca pelo índice a partir dele (sem OFFSET) e custa o
+    mesmo em qualquer profundidade. As colunas devem formar uma chave única
+    (terminar no id, por exemplo) e não podem ser nulas.
+    
+    Args:
+        cursor: Token devolvido como próximo cursor da página anterior
+    """
+    if cursor:
+        query = query.filter(keyset_filter(columns, decode_cursor(cursor, columns), descending))
+    
+    items = query.order_by(
+        *(column.desc() if descending else column.asc() for column in columns)
+    ).limit(limit + 1).all()
+    
+    if len(items) <= limit:
+        return items, None
+    
+    items = items[:limit]
+    return items, encode_cursor([getattr(items[-1], column.key) for column in columns])
+
+def page_response(data, next_cursor):
+    """jsonify(data) com o próximo cursor no header X-Next-Cursor (ausente na última página)"""
+    response = jsonify(data)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
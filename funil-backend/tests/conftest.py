@@ -0,0 +1,53 @@
+import os
+import sys
+
+import pytest
+from sqlalchemy import event
+
+# A aplicação é criada na importação de src.main: seleciona TestingConfig (SQLite em memória) antes
+os.environ['FLASK_CONFIG'] = 'testing'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask_jwt_extended import create_access_token
+from src.main import app as flask_app
+from src.models import db
+from src.models.user import User
+
+@pytest.fixture
+def app():
+    with flask_app.app_context():
+        db.create_all()
+        yield flask_app
+        db.session.remove()
+        db.drop_all()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def auth_headers(app):
+    user = User(email='admin@example.com', password_hash='x', name='Admin')
+    db.session.add(user)
+    db.session.commit()
+    return {'Authorization': f'Bearer {create_access_token(identity=str(user.id))}'}
+
+@pytest.fixture
+def count_queries(app):
+    """Retorna uma função que executa uma chamada e devolve quantos statements SQL ela emitiu"""
+    def count(call):
+        statements = []
+        
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        
+        # A requisição reaproveita o contexto do teste: começa com a sessão vazia, como em produção
+        db.session.remove()
+        event.listen(db.engine, 'after_cursor_execute', after_cursor_execute)
+        try:
+            call()
+        finally:
+            event.remove(db.engine, 'after_cursor_execute', after_cursor_execute)
+        return len(statements)
+    
+    return count
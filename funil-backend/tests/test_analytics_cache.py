@@ -0,0 +1,49 @@
+"""Invalidação do cache de analytics propagada entre workers (cache_versions)"""
+import pytest
+
+from src.services.analytics_cache import AnalyticsCache
+
+@pytest.fixture
+def workers(app):
+    """Dois caches independentes, como em dois workers do gunicorn, conferindo as versões a cada chamada"""
+    return AnalyticsCache(version_check_interval=0), AnalyticsCache(version_check_interval=0)
+
+def counting(values):
+    """compute() que devolve quantas vezes foi chamado"""
+    def compute():
+        values.append(len(values) + 1)
+        return values[-1]
+    return compute
+
+def test_invalidation_reaches_other_workers(workers):
+    first, second = workers
+    computed = []
+    
+    assert first.get_or_compute(('stats', 1), counting(computed)) == 1
+    assert second.get_or_compute(('stats', 1), counting(computed)) == 2
+    assert second.get_or_compute(('stats', 1), counting(computed)) == 2
+    
+    first.invalidate(1)
+    
+    assert second.get_or_compute(('stats', 1), counting(computed)) == 3
+    assert second.get_or_compute(('stats', 1), counting(computed)) == 3
+    assert first.get_or_compute(('stats', 1), counting(computed)) == 4
+    # A invalidação do próprio worker não é reaplicada quando ele confere as versões
+    assert first.get_or_compute(('stats', 1), counting(computed)) == 4
+
+def test_overview_and_other_funnels(workers):
+    first, second = workers
+    computed = []
+    
+    second.get_or_compute(('stats', None), counting(computed))
+    second.get_or_compute(('stats', 2), counting(computed))
+    
+    first.invalidate(1)
+    
+    # A visão geral inclui o funil 1; o funil 2 continua válido
+    assert second.get_or_compute(('stats', None), counting(computed)) == 3
+    assert second.get_or_compute(('stats', 2), counting(computed)) == 2
+    
+    first.invalidate(all_funnels=True)
+    
+    assert second.get_or_compute(('stats', 2), counting(computed)) == 4
@@ -0,0 +1,68 @@
+"""Buckets horários: parciais da ingestão, consolidação e reconstrução"""
+from datetime import datetime, timedelta
+
+from src.models import db
+from src.models.event_rollup import EventHourlyRollup, EventHourlyRollupDelta, floor_hour
+from src.models.funnel import Funnel
+from src.models.funnel_step import FunnelStep
+from src.models.visitor import Visitor
+from src.models.visitor_event import VisitorEvent
+
+def seed_events(hours_ago, count):
+    """Grava count eventos page_view no funil 1, hours_ago horas atrás, pelo caminho da ingestão"""
+    if db.session.get(Funnel, 1) is None:
+        db.session.add(Funnel(id=1, name='Funil', slug='funil'))
+        db.session.add(FunnelStep(id=1, funnel_id=1, name='Captura', slug='captura', step_type='capture', order_index=0))
+        db.session.add(Visitor(id=1, session_id='sessao', funnel_id=1))
+        db.session.flush()
+    
+    created_at = datetime.utcnow() - timedelta(hours=hours_ago)
+    VisitorEvent.bulk_create([
+        {'visitor_id': 1, 'funnel_id': 1, 'step_id': 1, 'event_type': 'page_view', 'event_data': {}, 'created_at': created_at}
+        for _ in range(count)
+    ])
+    db.session.commit()
+
+def total_count():
+    buckets = EventHourlyRollup.bucket_rows(funnel_id=1)
+    return db.session.scalar(db.select(db.func.coalesce(db.func.sum(buckets.c.count), 0)))
+
+def delta_count():
+    return db.session.scalar(db.select(db.func.count()).select_from(EventHourlyRollupDelta))
+
+def test_ingest_only_inserts_deltas(app):
+    seed_events(0, 3)
+    seed_events(0, 2)
+    
+    assert db.session.scalar(db.select(db.func.count()).select_from(EventHourlyRollup)) == 0
+    assert delta_count() == 2
+    assert total_count() == 5
+
+def test_merge_counts_each_delta_once(app):
+    seed_events(0, 3)
+    seed_events(1, 4)
+    seed_events(0, 2)
+    
+    assert EventHourlyRollup.merge_deltas() == 2
+    assert EventHourlyRollup.merge_deltas() == 0
+    assert delta_count() == 0
+    assert total_count() == 9
+    
+    seed_events(0, 1)
+    EventHourlyRollup.merge_deltas()
+    assert total_count() == 10
+
+def test_rebuild_stops_before_the_open_hour(app):
+    seed_events(2, 4)
+    seed_events(0, 3)
+    
+    _, end_hour, _ = EventHourlyRollup.rebuild()
+    
+    assert end_hour == floor_hour(datetime.utcnow())
+    # Os parciais da hora corrente continuam com a ingestão
+    assert delta_count() == 1
+    assert total_count() == 7
+    
+    # Histórico coberto: o funil de conversão soma buckets e parciais
+    assert EventHourlyRollup.covers()
+    assert VisitorEvent.get_conversion_funnel(1)[0]['page_views'] == 7
@@ -0,0 +1,27 @@
+"""Comando flask exports run: a saída padrão continua aberta depois do export"""
+import io
+
+import click
+
+class TrackingStream(io.BytesIO):
+    closed_by_export = False
+    
+    def close(self):
+        self.closed_by_export = True
+
+def test_export_to_stdout_does_not_close_it(app, monkeypatch):
+    stream = TrackingStream()
+    monkeypatch.setattr(click, 'get_binary_stream', lambda name: stream)
+    
+    result = app.test_cli_runner().invoke(args=['exports', 'run', 'events', '--format', 'ndjson'])
+    
+    assert result.exit_code == 0, result.output
+    assert not stream.closed_by_export
+
+def test_export_to_file(app, tmp_path):
+    output = tmp_path / 'visitors.csv'
+    
+    result = app.test_cli_runner().invoke(args=['exports', 'run', 'visitors', '--columns', 'id', '-o', str(output)])
+    
+    assert result.exit_code == 0, result.output
+    assert output.read_text().splitlines()[0] == 'id'
@@ -0,0 +1,27 @@
+"""Backend 'postgres' do stream ao vivo: drivers suportados"""
+from types import SimpleNamespace
+
+import pytest
+from src.services.live_events import LiveEventBroker
+
+@pytest.mark.parametrize('uri', ['postgresql://u:p@localhost/funil', 'postgresql+psycopg2://u:p@localhost/funil'])
+def test_psycopg2_is_accepted(uri):
+    LiveEventBroker._check_driver(uri)
+
+@pytest.mark.parametrize('uri', ['sqlite:///app.db', 'postgresql+pg8000://u:p@localhost/funil'])
+def test_unsupported_driver_fails_fast(uri):
+    with pytest.raises(ValueError, match='psycopg'):
+        LiveEventBroker._check_driver(uri)
+
+def test_psycopg3_notifies_are_received():
+    class Psycopg3Connection:
+        def notifies(self, timeout=None, stop_after=None):
+            self.timeout = timeout
+            yield SimpleNamespace(payload='[{"type":"a"}]')
+            yield SimpleNamespace(payload='[{"type":"b"}]')
+    
+    broker = LiveEventBroker(backend='postgres', poll_interval=0.25)
+    driver = Psycopg3Connection()
+    
+    assert list(broker._received(driver)) == ['[{"type":"a"}]', '[{"type":"b"}]']
+    assert driver.timeout == 0.25
@@ -0,0 +1,25 @@
+"""Scripts de pixels: invalidação entre workers e revalidação pelo navegador"""
+from src.services.pixel_cache import PixelScriptCache
+
+def test_invalidation_reaches_other_workers(app):
+    first, second = PixelScriptCache(version_check_interval=0), PixelScriptCache(version_check_interval=0)
+    scripts = {'html': '<script>v1</script>'}
+    render = lambda: scripts['html']
+    
+    first.get_or_render(1, 1, render)
+    assert second.get_or_render(1, 1, render)[0] == '<script>v1</script>'
+    
+    scripts['html'] = '<script>v2</script>'
+    first.invalidate(1)
+    
+    assert second.get_or_render(1, 1, render)[0] == '<script>v2</script>'
+    assert first.get_or_render(1, 1, render)[0] == '<script>v2</script>'
+
+def test_render_is_revalidated_by_etag(client):
+    response = client.get('/api/tracking/pixels/1/1/render')
+    
+    assert response.status_code == 200
+    assert 'no-cache' in response.headers['Cache-Control']
+    
+    revalidated = client.get('/api/tracking/pixels/1/1/render', headers={'If-None-Match': response.headers['ETag']})
+    assert revalidated.status_code == 304
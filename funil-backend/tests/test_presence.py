@@ -0,0 +1,42 @@
+"""Sincronização da presença entre workers pelo horário de gravação"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from src.models import db
+from src.models.visitor import Visitor
+from src.services.presence import PresenceTracker
+
+@pytest.fixture
+def tracker(app):
+    tracker = PresenceTracker(timeout=300, sync_interval=15)
+    tracker.app = app
+    tracker.enabled = True
+    # Sem a thread de sincronização periódica: o teste chama sync()
+    tracker._stopped = True
+    return tracker
+
+def write_visitor(session_id, activity_age):
+    """Grava um visitante como outro worker faria, com last_activity do cliente activity_age segundos atrás"""
+    visitor = Visitor(session_id=session_id, last_activity=datetime.utcnow() - timedelta(seconds=activity_age), is_online=True)
+    db.session.add(visitor)
+    db.session.commit()
+    return visitor.id
+
+def test_sync_picks_up_late_writes_with_old_activity(tracker):
+    first = write_visitor('primeiro', 10)
+    tracker.sync()
+    assert tracker.online_visitor_ids() == [first]
+    
+    # Gravado depois da sincronização (agrupador/buffer), com atividade bem anterior a ela
+    late = write_visitor('atrasado', 120)
+    tracker.sync()
+    
+    assert set(tracker.online_visitor_ids()) == {first, late}
+    assert tracker.online_counts()['total'] == 2
+
+def test_sync_ignores_expired_activity(tracker):
+    write_visitor('expirado', 600)
+    tracker.sync()
+    
+    assert tracker.online_visitor_ids() == []
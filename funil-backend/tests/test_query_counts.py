@@ -0,0 +1,69 @@
+"""Número de statements SQL das listagens do dashboard: constante com 1 ou N linhas (sem N+1)"""
+from src.models import db
+from src.models.funnel import Funnel
+from src.models.funnel_step import FunnelStep
+from src.models.visitor import Visitor
+from src.models.visitor_event import VisitorEvent
+
+N = 20
+
+def add_funnels(count, start=0):
+    for i in range(start, start + count):
+        funnel = Funnel(name=f'Funil {i}', slug=f'funil-{i}')
+        db.session.add(funnel)
+        db.session.flush()
+        db.session.add(FunnelStep(funnel_id=funnel.id, name='Captura', slug='captura', step_type='capture', order_index=0))
+    db.session.commit()
+
+def add_visitors(funnel_id, count, start=0):
+    step = FunnelStep.query.filter_by(funnel_id=funnel_id).first()
+    for i in range(start, start + count):
+        visitor = Visitor(session_id=f'sessao-{i}', funnel_id=funnel_id, current_step_id=step.id)
+        db.session.add(visitor)
+        db.session.flush()
+        db.session.add(VisitorEvent(visitor_id=visitor.id, funnel_id=funnel_id, step_id=step.id, event_type='page_view'))
+    db.session.commit()
+
+def add_events(visitor_id, count):
+    visitor = db.session.get(Visitor, visitor_id)
+    for _ in range(count):
+        db.session.add(VisitorEvent(visitor_id=visitor.id, funnel_id=visitor.funnel_id, step_id=visitor.current_step_id, event_type='page_view'))
+    db.session.commit()
+
+def get_ok(client, url, headers, expected):
+    def call():
+        response = client.get(url, headers=headers)
+        assert response.status_code == 200
+        assert len(response.get_json()) == expected
+    return call
+
+def test_funnels_list_query_count(client, auth_headers, count_queries):
+    add_funnels(1)
+    single = count_queries(get_ok(client, '/api/funnels/', auth_headers, 1))
+    
+    add_funnels(N - 1, start=1)
+    many = count_queries(get_ok(client, '/api/funnels/', auth_headers, N))
+    
+    assert many == single
+
+def test_online_visitors_query_count(client, auth_headers, count_queries):
+    add_funnels(1)
+    add_visitors(1, 1)
+    single = count_queries(get_ok(client, '/api/monitoring/visitors', auth_headers, 1))
+    
+    add_visitors(1, N - 1, start=1)
+    many = count_queries(get_ok(client, '/api/monitoring/visitors', auth_headers, N))
+    
+    assert many == single
+
+def test_visitor_events_query_count(client, auth_headers, count_queries):
+    add_funnels(1)
+    add_visitors(1, 1)
+    url = '/api/monitoring/visitors/1/events'
+    
+    single = count_queries(get_ok(client, url, auth_headers, 1))
+    
+    add_events(1, N - 1)
+    many = count_queries(get_ok(client, url, auth_headers, N))
+    
+    assert many == single
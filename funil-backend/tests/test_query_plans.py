@@ -0,0 +1,122 @@
+"""Plano das consultas de análise e de busca: nenhuma pode ler visitor_events, visitors ou payments inteira"""
+import re
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import event
+
+from src.models import db
+from src.models.funnel import Funnel
+from src.models.funnel_step import FunnelStep
+from src.models.payment import Payment
+from src.models.visitor import Visitor
+from src.models.visitor_event import VisitorEvent
+
+# Tabelas grandes que só podem ser lidas por índice
+INDEXED_TABLES = ('visitor_events', 'visitors', 'payments')
+
+# "SCAN tabela" sem índice é a leitura sequencial do SQLite ("SCAN tabela USING INDEX ..." percorre o índice)
+FULL_SCAN = re.compile(r'\bSCAN (%s)\b(?! USING)' % '|'.join(INDEXED_TABLES))
+
+@pytest.fixture
+def seeded(app):
+    """Alguns funis com etapas, visitantes, eventos e pagamentos, com estatísticas do planejador (ANALYZE)"""
+    now = datetime.utcnow()
+    for f in range(5):
+        funnel = Funnel(name=f'Funil {f}', slug=f'funil-{f}')
+        db.session.add(funnel)
+        db.session.flush()
+        steps = [
+            FunnelStep(funnel_id=funnel.id, name=f'Etapa {s}', slug=f'etapa-{s}', step_type='capture', order_index=s)
+            for s in range(3)
+        ]
+        db.session.add_all(steps)
+        db.session.flush()
+        
+        for v in range(40):
+            seen_at = now - timedelta(hours=v)
+            visitor = Visitor(
+                session_id=f'sessao-{f}-{v}', funnel_id=funnel.id, current_step_id=steps[v % 3].id,
+                first_visit=seen_at, last_activity=seen_at, is_online=v < 5, utm_source='google'
+            )
+            db.session.add(visitor)
+            db.session.flush()
+            
+            for step in steps[:v % 3 + 1]:
+                db.session.add(VisitorEvent(
+                    visitor_id=visitor.id, funnel_id=funnel.id, step_id=step.id, event_type='page_view', created_at=seen_at
+                ))
+            
+            if v % 4 == 0:
+                db.session.add(Payment(
+                    visitor_id=visitor.id, funnel_id=funnel.id, step_id=steps[-1].id, external_id=f'pay-{f}-{v}',
+                    amount=Decimal('97.00'), status='paid' if v % 8 else 'pending', created_at=seen_at
+                ))
+    
+    db.session.commit()
+    db.session.execute(db.text('ANALYZE'))
+    return now
+
+def full_scans(call):
+    """Executa call() e retorna [(statement, linha do plano)] das leituras sequenciais das tabelas grandes"""
+    statements = []
+    
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+            statements.append((statement, parameters))
+    
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        call()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+    
+    assert statements, 'nenhuma consulta executada'
+    
+    scans = []
+    connection = db.session.connection()
+    for statement, parameters in statements:
+        for row in connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters):
+            if FULL_SCAN.search(row[-1]):
+                scans.append((statement, row[-1]))
+    return scans
+
+FUNNEL_ID = 2
+
+QUERIES = {
+    'VisitorEvent.get_events_by_type': lambda now: VisitorEvent.get_events_by_type(
+        'page_view', FUNNEL_ID, now - timedelta(days=1), now
+    ),
+    'VisitorEvent.get_conversion_funnel': lambda now: VisitorEvent.get_conversion_funnel(
+        FUNNEL_ID, now - timedelta(days=7), now
+    ),
+    'VisitorEvent.get_hourly_stats': lambda now: VisitorEvent.get_hourly_stats(FUNNEL_ID, now.date()),
+    'VisitorEvent.get_path_analysis': lambda now: VisitorEvent.get_path_analysis(
+        FUNNEL_ID, now - timedelta(days=7), now
+    ),
+    'Visitor.get_online_visitors_page': lambda now: Visitor.get_online_visitors_page(FUNNEL_ID, limit=10),
+    'Visitor.get_online_visitors_page desde um cursor': lambda now: Visitor.get_online_visitors_page(
+        FUNNEL_ID, since=now - timedelta(minutes=1), limit=10
+    ),
+    'Visitor.get_online_counts': lambda now: Visitor.get_online_counts(FUNNEL_ID),
+    'Visitor.get_cohort_analysis': lambda now: Visitor.get_cohort_analysis(
+        FUNNEL_ID, now - timedelta(days=7), now
+    ),
+    'Payment.get_revenue_stats': lambda now: Payment.get_revenue_stats(FUNNEL_ID, now - timedelta(days=7), now),
+    'Payment.get_daily_revenue': lambda now: Payment.get_daily_revenue(FUNNEL_ID),
+    'Payment.get_payment_methods_stats': lambda now: Payment.get_payment_methods_stats(
+        FUNNEL_ID, now - timedelta(days=7), now
+    ),
+    'Payment.get_analytics': lambda now: Payment.get_analytics(FUNNEL_ID, now - timedelta(days=7), now),
+    'Payment.get_utm_attribution': lambda now: Payment.get_utm_attribution(
+        funnel_id=FUNNEL_ID, start_date=now - timedelta(days=7), end_date=now
+    ),
+    'Payment por external_id': lambda now: Payment.query.filter_by(external_id='pay-1-8').first(),
+}
+
+@pytest.mark.parametrize('name', QUERIES)
+def test_query_uses_indexes(seeded, name):
+    scans = full_scans(lambda: QUERIES[name](seeded))
+    
+    assert not scans, '\n\n'.join(f'{plan}\n{statement}' for statement, plan in scans)
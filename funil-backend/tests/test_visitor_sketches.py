@@ -0,0 +1,51 @@
+"""Sketches de visitantes únicos: parciais da ingestão, união e compactação na leitura"""
+from datetime import datetime
+
+from src.models import db
+from src.models.visitor_sketch import MERGE_ON_READ_THRESHOLD, VisitorSketch, VisitorSketchDelta
+from src.utils.hyperloglog import HyperLogLog
+
+def add_batches(count, visitors_per_batch=5):
+    now = datetime.utcnow()
+    for batch in range(count):
+        VisitorSketch.add_events([
+            {'visitor_id': batch * visitors_per_batch + v, 'funnel_id': 1, 'step_id': 1 + v % 2, 'created_at': now}
+            for v in range(visitors_per_batch)
+        ])
+    db.session.commit()
+
+def delta_count():
+    return db.session.scalar(db.select(db.func.count()).select_from(VisitorSketchDelta))
+
+def test_merge_keeps_estimate(app):
+    add_batches(20)
+    before = VisitorSketch.unique_visitors(funnel_id=1)
+    
+    VisitorSketch.merge_deltas()
+    
+    assert delta_count() == 0
+    assert VisitorSketch.unique_visitors(funnel_id=1) == before
+    assert abs(before['total'] - 100) <= 2
+
+def test_unique_visitors_compacts_pending_deltas(app):
+    # Cada lote grava um parcial por etapa (duas etapas)
+    add_batches(MERGE_ON_READ_THRESHOLD // 2 - 1)
+    VisitorSketch.unique_visitors(funnel_id=1)
+    assert delta_count() > 0
+    
+    add_batches(1)
+    before = VisitorSketch.unique_visitors(funnel_id=1)
+    
+    assert delta_count() == 0
+    assert VisitorSketch.unique_visitors(funnel_id=1) == before
+
+def test_hyperloglog_round_trip():
+    sketch = HyperLogLog()
+    sketch.update(range(1000))
+    other = HyperLogLog()
+    other.update(range(500, 3000))
+    
+    merged = HyperLogLog.from_bytes(sketch.to_bytes()).merge(HyperLogLog.from_bytes(other.to_bytes()))
+    
+    assert abs(merged.count() - 3000) < 3000 * 0.05
+    assert HyperLogLog.from_bytes(merged.to_bytes()).to_bytes() == merged.to_bytes()
@@ -42,6 +42,34 @@ class ApiService {
     }
   }
 
+  // Percorre as páginas de um endpoint paginado (próximo cursor em X-Next-Cursor)
+  async requestAllPages(endpoint, pageSize = 200) {
+    const items = []
+    const separator = endpoint.includes('?') ? '&' : '?'
+    let cursor = null
+
+    do {
+      const params = new URLSearchParams({ limit: pageSize })
+      if (cursor) {
+        params.set('cursor', cursor)
+      }
+
+      const response = await fetch(`${API_BASE_URL}${endpoint}${separator}${params}`, {
+        headers: this.getHeaders(),
+      })
+      const data = await response.json()
+
+      if (!response.ok) {
+        throw new Error(data.message || 'Erro na requisição')
+      }
+
+      items.push(...data)
+      cursor = response.headers.get('X-Next-Cursor')
+    } while (cursor)
+
+    return items
+  }
+
   // Autenticação
   async login(email, password) {
     const response = await this.request('/auth/login', {
@@ -68,7 +96,7 @@ class ApiService {
 
   // Credenciais
   async getCredentials() {
-    return this.request('/credentials')
+    return this.requestAllPages('/credentials')
   }
 
   async createCredential(credentialData) {
@@ -93,7 +121,7 @@ class ApiService {
 
   // Funis
   async getFunnels() {
-    return this.request('/funnels')
+    return this.requestAllPages('/funnels')
   }
 
   async createFunnel(funnelData) {
@@ -178,17 +206,33 @@ class ApiService {
 
   // Monitoramento
   async getActiveVisitors() {
-    return this.request('/monitoring/visitors')
+    return this.requestAllPages('/monitoring/visitors')
   }
 
   async getVisitorEvents(visitorId) {
-    return this.request(`/monitoring/visitors/${visitorId}/events`)
+    return this.requestAllPages(`/monitoring/visitors/${visitorId}/events`)
   }
 
   async getDashboardStats() {
     return this.request('/monitoring/stats')
   }
 
+  // Stream ao vivo (Server-Sent Events): presence, events, payment e resync.
+  // Retorna o EventSource; chame close() para encerrar.
+  subscribeMonitoring(handlers = {}, funnelId = null) {
+    const params = new URLSearchParams({ jwt: this.token || '' })
+    if (funnelId) {
+      params.set('funnel_id', funnelId)
+    }
+
+    const source = new EventSource(`${API_BASE_URL}/monitoring/stream?${params}`)
+    for (const [type, handler] of Object.entries(handlers)) {
+      source.addEventListener(type, (event) => handler(JSON.parse(event.data)))
+    }
+
+    return source
+  }
+
   // Tracking
   async getTrackingPixels(funnelId) {
     return this.request(`/tracking/${funnelId}/pixels`)